@@ -0,0 +1 @@
+# Бенчмарки конвейера: синтетический корпус и замеры
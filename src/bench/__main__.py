@@ -0,0 +1,93 @@
+from pathlib import Path
+from typing import List
+import typer
+from rich import print as rprint
+from rich.table import Table
+
+from .corpus import SIZE_PRESETS, generate_corpus
+from .suite import DEFAULT_THRESHOLD, compare, load_results, run_suite, save_results
+
+
+app = typer.Typer(add_completion=False, help="Бенчмарки конвейера на синтетическом корпусе YouTrack")
+
+
+@app.command("generate")
+def cli_generate(
+    out: str = typer.Option(..., help="Папка для сгенерированных тикетов"),
+    tickets: int = typer.Option(200, help="Число тикетов"),
+    seed: int = typer.Option(42, help="Seed генератора (одинаковый seed — одинаковый корпус)"),
+    size: str = typer.Option("medium", help=f"Размер тикетов: {', '.join(SIZE_PRESETS)}"),
+    image_ratio: float = typer.Option(0.1, help="Доля тикетов с папкой изображений"),
+):
+    paths = generate_corpus(Path(out), tickets=tickets, seed=seed, size=size, image_ratio=image_ratio)
+    total = sum(p.stat().st_size for p in paths)
+    rprint(f"[bold green]Сгенерировано[/bold green]: {len(paths)} тикетов, {total} байт → {out}")
+
+
+@app.command("run")
+def cli_run(
+    out: str = typer.Option("bench_results.json", help="Файл результатов JSON"),
+    baseline: str = typer.Option(None, help="Файл базовой линии для сравнения"),
+    threshold: float = typer.Option(DEFAULT_THRESHOLD, help="Допустимое замедление (доля), например 0.15 = 15%"),
+    tickets: int = typer.Option(200, help="Число тикетов в корпусе"),
+    seed: int = typer.Option(42, help="Seed генератора"),
+    size: str = typer.Option("medium", help=f"Размер тикетов: {', '.join(SIZE_PRESETS)}"),
+    repeat: int = typer.Option(5, help="Повторов каждого микробенчмарка (берётся медиана)"),
+    e2e: bool = typer.Option(True, "--e2e/--no-e2e", help="Сквозной прогон конвейера (LLM и vision выключены)"),
+    workers: int = typer.Option(1, help="Процессов для сквозного прогона"),
+    config: str = typer.Option("config/pipeline.yaml", help="Конфигурация пайплайна"),
+    only: List[str] = typer.Option(None, help="Только указанные микробенчмарки (можно несколько раз)"),
+):
+    result = run_suite(tickets=tickets, seed=seed, size=size, repeat=repeat, e2e=e2e, workers=workers, config_path=Path(config), only=only or None)
+    save_results(Path(out), result)
+    _print_results(result)
+    rprint(f"Результаты: {out}")
+    if baseline:
+        _compare_and_exit(result, load_results(Path(baseline)), threshold)
+
+
+@app.command("compare")
+def cli_compare(
+    current: str = typer.Argument(..., help="Файл результатов"),
+    baseline: str = typer.Argument(..., help="Файл базовой линии"),
+    threshold: float = typer.Option(DEFAULT_THRESHOLD, help="Допустимое замедление (доля)"),
+):
+    _compare_and_exit(load_results(Path(current)), load_results(Path(baseline)), threshold)
+
+
+def _print_results(result: dict) -> None:
+    meta = result["meta"]
+    table = Table(title=f"Микробенчмарки: {meta['tickets']} тикетов ({meta['size']}), {meta['corpus_bytes']} байт")
+    table.add_column("Функция")
+    table.add_column("Медиана, с", justify="right")
+    table.add_column("мкс/вызов", justify="right")
+    table.add_column("МБ/с", justify="right")
+    for name, d in result["micro"].items():
+        table.add_row(name, f"{d['seconds']:.4f}", f"{d['us_per_call']:.1f}", str(d["mb_per_sec"]))
+    rprint(table)
+    if result.get("e2e"):
+        e = result["e2e"]
+        rprint(f"Сквозной прогон: {e['files']} файлов за {e['seconds']} с ({e['files_per_sec']} файл/с, workers={e['workers']})")
+
+
+def _compare_and_exit(current: dict, baseline: dict, threshold: float) -> None:
+    rows = compare(current, baseline, threshold)
+    table = Table(title="Сравнение с базовой линией")
+    table.add_column("Бенчмарк")
+    table.add_column("Было, с", justify="right")
+    table.add_column("Стало, с", justify="right")
+    table.add_column("Изменение", justify="right")
+    for row in rows:
+        change = "—" if row["change"] is None else f"{row['change'] * 100:+.1f}%"
+        if row["regression"]:
+            change = f"[red]{change}[/red]"
+        table.add_row(row["name"], "—" if row["baseline"] is None else f"{row['baseline']:.4f}", f"{row['current']:.4f}", change)
+    rprint(table)
+    regressions = [r["name"] for r in rows if r["regression"]]
+    if regressions:
+        rprint(f"[red]Регрессии производительности[/red]: {', '.join(regressions)}")
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+import random
+import struct
+import zlib
+
+
+# Средний размер тикета в символах для пресетов --size
+SIZE_PRESETS: Dict[str, int] = {
+    "small": 1_500,
+    "medium": 6_000,
+    "large": 30_000,
+}
+
+_FIRST_NAMES = ["Иван", "Пётр", "Анна", "Мария", "Алексей", "Ольга", "Дмитрий", "Елена", "Сергей", "Наталья"]
+_LAST_NAMES = ["Петров", "Иванов", "Смирнов", "Кузнецов", "Соколов", "Попов", "Лебедев", "Козлов", "Новиков", "Морозов"]
+_TRANSLIT = {"Иван": "ivan", "Пётр": "petr", "Анна": "anna", "Мария": "maria", "Алексей": "alexey", "Ольга": "olga",
+             "Дмитрий": "dmitry", "Елена": "elena", "Сергей": "sergey", "Наталья": "natalia"}
+_SERVICES = ["billing", "auth", "gateway", "orders", "catalog", "notifications", "reports", "search"]
+_COMPONENTS = ["api", "worker", "scheduler", "db", "cache", "frontend", "kafka-consumer"]
+_ENVS = ["prod", "stage", "dev", "qa"]
+_DOMAINS = ["example.com", "corp.local", "mail.ru", "yandex.ru", "company.org"]
+_PROJECTS = ["SUP", "OPS", "BILL", "AUTH", "CORE"]
+_SYMPTOMS = [
+    "не проходит оплата заказа",
+    "пользователь не может войти в личный кабинет",
+    "отчёт формируется с пустыми строками",
+    "таймаут при обращении к внешнему API",
+    "дублируются уведомления в почте",
+    "поиск возвращает устаревшие данные",
+    "падает воркер после деплоя",
+    "не обновляется статус заявки",
+]
+_PHRASES = [
+    "Проблема воспроизводится стабильно после обновления",
+    "Проверили на тестовом стенде — там всё работает",
+    "Логи приложены ниже, обратите внимание на время",
+    "Клиент просит решить до конца недели",
+    "Похоже, проблема связана с последним релизом",
+    "Откатили конфигурацию, но ошибка осталась",
+    "Нужна помощь команды инфраструктуры",
+    "Временное решение: перезапуск сервиса раз в час",
+    "Повторно проверил после исправления — ошибка не воспроизводится",
+    "Прошу уточнить, какие данные передаются в запросе",
+]
+_STEPS = [
+    "Открыть страницу заказа",
+    "Нажать кнопку «Оплатить»",
+    "Ввести данные тестовой карты",
+    "Дождаться ответа платёжного шлюза",
+    "Обновить страницу",
+    "Проверить статус в админке",
+]
+_LIST_MARKERS = ["- ", "* ", "• ", "1) ", "1. "]
+_SIGNATURES = ["С уважением,", "Отправлено с iPhone", "-----Original Message-----"]
+
+
+def generate_corpus(out_dir: Path, tickets: int = 200, seed: int = 42, size: str = "medium", image_ratio: float = 0.1) -> List[Path]:
+    """Детерминированный синтетический экспорт YouTrack: out_dir/<PROJ-N>.txt (+ папка с изображениями).
+
+    Один и тот же seed всегда даёт побайтно одинаковый корпус.
+    """
+    rng = random.Random(seed)
+    avg_chars = SIZE_PRESETS.get(size, SIZE_PRESETS["medium"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths: List[Path] = []
+    base_time = datetime(2025, 1, 15, 9, 0, 0)
+    for i in range(tickets):
+        project = rng.choice(_PROJECTS)
+        issue_id = f"{project}-{1000 + i}"
+        target = max(400, int(rng.lognormvariate(0, 0.5) * avg_chars))
+        text = ticket_text(rng, issue_id, target, base_time + timedelta(hours=i))
+        path = out_dir / f"{issue_id}.txt"
+        path.write_text(text, encoding="utf-8")
+        paths.append(path)
+        if rng.random() < image_ratio:
+            folder = out_dir / issue_id
+            folder.mkdir(exist_ok=True)
+            for j in range(rng.randint(1, 3)):
+                (folder / f"screenshot_{j + 1}.png").write_bytes(_tiny_png(rng))
+    return paths
+
+
+def ticket_text(rng: random.Random, issue_id: str, target_chars: int, created: datetime) -> str:
+    service = rng.choice(_SERVICES)
+    env = rng.choice(_ENVS)
+    version = f"{rng.randint(1, 5)}.{rng.randint(0, 20)}.{rng.randint(0, 50)}"
+    reporter = _person(rng)
+    parts: List[str] = [
+        f"{issue_id} [{service}] {rng.choice(_SYMPTOMS)}",
+        f"Создано: {created:%Y-%m-%d %H:%M:%S} Автор: {reporter['name']}",
+        f"Среда: {env}, версия {version}, компонент {rng.choice(_COMPONENTS)}",
+        "",
+        "Описание:",
+        f"{rng.choice(_PHRASES)}. Пользователь {reporter['email']} сообщил об ошибке,",
+        f"телефон для связи {_phone(rng)}, сервер {_ip(rng)}.",
+        "",
+    ]
+    size = sum(len(p) + 1 for p in parts)
+    moment = created
+    while size < target_chars:
+        moment += timedelta(minutes=rng.randint(1, 600))
+        block = _comment_block(rng, moment, service)
+        parts.append(block)
+        size += len(block) + 1
+    return "\n".join(parts) + "\n"
+
+
+def _comment_block(rng: random.Random, moment: datetime, service: str) -> str:
+    author = _person(rng)
+    kind = rng.random()
+    lines = [f"Комментарий {author['name']} ({author['login']}) {moment:%Y-%m-%d %H:%M}:"]
+    if kind < 0.25:
+        lines.append(f"{rng.choice(_PHRASES)}.")
+        lines.extend(_stack_trace(rng, service))
+    elif kind < 0.45:
+        lines.append("Лог сервиса:")
+        lines.extend(_log_lines(rng, moment, service))
+    elif kind < 0.6:
+        lines.append("Шаги воспроизведения:")
+        marker = rng.choice(_LIST_MARKERS)
+        for step in rng.sample(_STEPS, rng.randint(2, len(_STEPS))):
+            lines.append(f"{marker}{step}")
+    elif kind < 0.75:
+        lines.append(f"Доступ к стенду: login: {author['login']}")
+        lines.append(f"пароль: {_password(rng)}")
+        lines.append(f"token= {_token(rng)}")
+        lines.append(f"Строка подключения: postgres://{author['login']}:{_password(rng)}@{_ip(rng)}:5432/{service}")
+    elif kind < 0.85:
+        lines.append(f"> {rng.choice(_PHRASES)}")
+        lines.append(f"> MAC адрес устройства {_mac(rng)}")
+        lines.append(f"Ответил на почту {_person(rng)['email']}, перезвоню на {_phone(rng)}.")
+    else:
+        # Длинный абзац, разорванный переносами как в письмах
+        words = " ".join(rng.choice(_PHRASES).lower() for _ in range(rng.randint(3, 8)))
+        width = rng.randint(50, 80)
+        lines.extend(words[k:k + width] for k in range(0, len(words), width))
+    if rng.random() < 0.3:
+        lines.append("")
+        lines.append(rng.choice(_SIGNATURES))
+        lines.append(author["name"])
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _stack_trace(rng: random.Random, service: str) -> List[str]:
+    if rng.random() < 0.5:
+        lines = ["Traceback (most recent call last):"]
+        for depth in range(rng.randint(3, 8)):
+            lines.append(f'  File "/srv/{service}/app/module_{depth}.py", line {rng.randint(10, 900)}, in handler_{depth}')
+            lines.append(f"    result = process(request, timeout={rng.randint(1, 60)})")
+        lines.append(f"TimeoutError: upstream {_ip(rng)} did not respond")
+        return lines
+    lines = [f"java.lang.IllegalStateException: {service} connection pool exhausted"]
+    for depth in range(rng.randint(4, 12)):
+        lines.append(f"\tat ru.company.{service}.Service{depth}.call(Service{depth}.java:{rng.randint(10, 500)})")
+    lines.append(f"Caused by: java.net.SocketTimeoutException: connect timed out to {_ip(rng)}:8080")
+    return lines
+
+
+def _log_lines(rng: random.Random, moment: datetime, service: str) -> List[str]:
+    lines = []
+    for _ in range(rng.randint(3, 15)):
+        moment += timedelta(seconds=rng.randint(0, 30))
+        level = rng.choice(["INFO", "WARN", "ERROR", "DEBUG"])
+        payload = ",".join(f'"k{j}":"{_token(rng)[:rng.randint(4, 24)]}"' for j in range(rng.randint(1, 30)))
+        lines.append(
+            f"{moment:%Y-%m-%d %H:%M:%S} {level} [{service}-{rng.randint(1, 9)}] request_id={rng.getrandbits(64):016x} "
+            f"client={_ip(rng)} HTTP/1.1 {rng.choice([200, 404, 500, 502, 503])} payload={{{payload}}}"
+        )
+    return lines
+
+
+def _person(rng: random.Random) -> Dict[str, str]:
+    first = rng.choice(_FIRST_NAMES)
+    last = rng.choice(_LAST_NAMES)
+    login = f"{_TRANSLIT[first]}.{rng.choice(['p', 'k', 's', 'm'])}{rng.randint(1, 99)}"
+    return {"name": f"{first} {last}", "login": login, "email": f"{login}@{rng.choice(_DOMAINS)}"}
+
+
+def _phone(rng: random.Random) -> str:
+    d = [rng.randint(0, 9) for _ in range(10)]
+    fmt = rng.choice([
+        "+7 ({0}{1}{2}) {3}{4}{5}-{6}{7}-{8}{9}",
+        "8 {0}{1}{2} {3}{4}{5} {6}{7} {8}{9}",
+        "+7{0}{1}{2}{3}{4}{5}{6}{7}{8}{9}",
+    ])
+    return fmt.format(*d)
+
+
+def _ip(rng: random.Random) -> str:
+    return ".".join(str(rng.randint(1, 254)) for _ in range(4))
+
+
+def _mac(rng: random.Random) -> str:
+    return ":".join(f"{rng.randint(0, 255):02x}" for _ in range(6))
+
+
+def _password(rng: random.Random) -> str:
+    alphabet = "abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789!#%"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(8, 14)))
+
+
+def _token(rng: random.Random) -> str:
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    return "".join(rng.choice(alphabet) for _ in range(32))
+
+
+def _tiny_png(rng: random.Random) -> bytes:
+    """Валидный PNG 1x1 со случайным цветом (разные байты — разные ключи кэша vision)."""
+    raw = b"\x00" + bytes(rng.randint(0, 255) for _ in range(3))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
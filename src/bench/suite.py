@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from src.pipeline.anonymize import anonymize_text, detect_residual_pii
+from src.pipeline.config import load_pipeline_config
+from src.pipeline.dedup import simhash_value
+from src.pipeline.markdown import format_markdown, render_markdown
+from src.pipeline.metadata import extract_metadata
+from src.pipeline.normalize import normalize_text
+from src.pipeline.run import process_directory
+from src.pipeline.secret_scan import EntropySecretDetector
+
+from .corpus import generate_corpus
+
+
+# Допустимое замедление относительно базовой линии (доля), если не задано иное
+DEFAULT_THRESHOLD = 0.15
+
+
+def micro_benchmarks(texts: List[str]) -> Dict[str, Tuple[Callable[[str], object], List[str]]]:
+    """Функции под замер и их входы; входы готовятся заранее и в замер не входят."""
+    normalized = [normalize_text(t) for t in texts]
+    anonymized = [anonymize_text(t)[0] for t in normalized]
+    markdown = [render_markdown("Инцидент", ["Резюме"], {"Резюме": t}) for t in anonymized]
+    return {
+        "normalize_text": (normalize_text, texts),
+        "anonymize_text": (anonymize_text, normalized),
+        "detect_residual_pii": (detect_residual_pii, anonymized),
+        "detect_secrets": (EntropySecretDetector().find, normalized),
+        "simhash_value": (simhash_value, normalized),
+        "extract_metadata": (extract_metadata, anonymized),
+        "format_markdown": (format_markdown, markdown),
+    }
+
+
+def run_micro(texts: List[str], repeat: int = 5, only: Optional[List[str]] = None) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    for name, (func, inputs) in micro_benchmarks(texts).items():
+        if only and name not in only:
+            continue
+        n_bytes = sum(len(t.encode("utf-8")) for t in inputs)
+        timings: List[float] = []
+        func(inputs[0])  # прогрев (компиляция регулярных выражений, ленивые импорты)
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for t in inputs:
+                func(t)
+            timings.append(time.perf_counter() - t0)
+        median = statistics.median(timings)
+        results[name] = {
+            "seconds": round(median, 6),
+            "min_seconds": round(min(timings), 6),
+            "calls": len(inputs),
+            "us_per_call": round(median / len(inputs) * 1e6, 2),
+            "mb_per_sec": round(n_bytes / median / 1e6, 3) if median > 0 else None,
+        }
+    return results
+
+
+def run_e2e(corpus_dir: Path, config_path: Path, workers: int = 1, io_pipeline: bool = False) -> Dict:
+    """Полный прогон конвейера без LLM и vision во временные каталоги."""
+    cfg = load_pipeline_config(config_path)
+    cfg["llm"]["enabled"] = False
+    cfg.setdefault("images", {})["enabled"] = False
+    with tempfile.TemporaryDirectory(prefix="bench-e2e-") as tmp:
+        tmp_path = Path(tmp)
+        cfg["io"]["state_dir"] = str(tmp_path / "state")
+        cfg["io"]["reports_dir"] = str(tmp_path / "reports")
+        t0 = time.perf_counter()
+        stats = process_directory(corpus_dir, tmp_path / "out", cfg, workers=workers, io_pipeline=io_pipeline, force=True, keep_results=False)
+        elapsed = time.perf_counter() - t0
+    perf = stats.get("perf") or {}
+    return {
+        "seconds": round(elapsed, 4),
+        "files": stats.get("processed", 0),
+        "files_per_sec": round(stats.get("processed", 0) / elapsed, 2) if elapsed > 0 else None,
+        "workers": workers,
+        "io_pipeline": io_pipeline,
+        "stages": {name: d.get("total_sec") for name, d in (perf.get("stages") or {}).items()},
+    }
+
+
+def run_suite(
+    tickets: int = 200,
+    seed: int = 42,
+    size: str = "medium",
+    repeat: int = 5,
+    e2e: bool = True,
+    workers: int = 1,
+    config_path: Path = Path("config/pipeline.yaml"),
+    only: Optional[List[str]] = None,
+) -> Dict:
+    with tempfile.TemporaryDirectory(prefix="bench-corpus-") as tmp:
+        corpus_dir = Path(tmp)
+        paths = generate_corpus(corpus_dir, tickets=tickets, seed=seed, size=size)
+        texts = [p.read_text(encoding="utf-8") for p in paths]
+        result = {
+            "meta": {
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "tickets": tickets,
+                "seed": seed,
+                "size": size,
+                "corpus_bytes": sum(len(t.encode("utf-8")) for t in texts),
+                "repeat": repeat,
+            },
+            "micro": run_micro(texts, repeat=repeat, only=only),
+        }
+        if e2e and not only:
+            result["e2e"] = run_e2e(corpus_dir, config_path, workers=workers)
+    return result
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD, thresholds: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """Сравнение с базовой линией по медианному времени. Возвращает строки сравнения;
+    regression=True, если бенчмарк замедлился больше допустимого порога."""
+    thresholds = thresholds or {}
+    rows: List[Dict] = []
+    pairs = [(f"micro.{name}", d, (baseline.get("micro") or {}).get(name)) for name, d in (current.get("micro") or {}).items()]
+    if current.get("e2e"):
+        pairs.append(("e2e", current["e2e"], baseline.get("e2e")))
+    for name, cur, base in pairs:
+        if not base or not base.get("seconds"):
+            rows.append({"name": name, "current": cur["seconds"], "baseline": None, "change": None, "regression": False})
+            continue
+        limit = thresholds.get(name, threshold)
+        change = cur["seconds"] / base["seconds"] - 1.0
+        rows.append({
+            "name": name,
+            "current": cur["seconds"],
+            "baseline": base["seconds"],
+            "change": round(change, 4),
+            "threshold": limit,
+            "regression": change > limit,
+        })
+    return rows
+
+
+def save_results(path: Path, result: Dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def load_results(path: Path) -> Dict:
+    return json.loads(path.read_text(encoding="utf-8"))
@@ -3,13 +3,17 @@ import sys
 from pathlib import Path
 import typer
 from rich import print as rprint
+from rich.table import Table
 from dotenv import load_dotenv
 
 from src.pipeline.config import load_pipeline_config
-from src.pipeline.run import process_directory
+from src.pipeline.run import process_directory, resolve_workers
+from src.pipeline.reports import ReportStore
 
 
 app = typer.Typer(add_completion=False, help="Конвейер TXT → Markdown с обезличиванием и LLM‑постобработкой")
+report_app = typer.Typer(add_completion=False, help="Просмотр отчётов запусков (reports.sqlite)")
+app.add_typer(report_app, name="report")
 
 
 @app.command("process")
@@ -19,6 +23,10 @@ def cli_process(
     config: str = typer.Option("config/pipeline.yaml", help="Конфигурация пайплайна"),
     llm: bool = typer.Option(False, help="Включить LLM‑постобработку"),
     dry_run: bool = typer.Option(False, help="Только отчёт, без записи файлов"),
+    workers: int = typer.Option(None, help="Число процессов для CPU‑стадий (0 — по числу ядер; по умолчанию из execution.workers)"),
+    pipeline: bool = typer.Option(None, "--pipeline/--no-pipeline", help="Перекрывать запросы LLM/vision с CPU‑стадиями (по умолчанию из execution.io_pipeline)"),
+    force: bool = typer.Option(False, help="Обработать все файлы заново, игнорируя манифест state_dir/manifest.sqlite"),
+    profile: bool = typer.Option(False, help="Профилирование (cProfile + tracemalloc, последовательно) с отчётом в reports/profile/"),
 ):
     load_dotenv(override=True)
     config_path = Path(config)
@@ -33,9 +41,46 @@ def cli_process(
     out_path = Path(out or output_dir_env)
     out_path.mkdir(parents=True, exist_ok=True)
 
-    rprint(f"[bold green]Запуск обработки[/bold green]: input={input_path} out={out_path} llm={cfg['llm'].get('enabled', False)}")
-    stats = process_directory(input_path, out_path, cfg, dry_run=dry_run)
+    rprint(f"[bold green]Запуск обработки[/bold green]: input={input_path} out={out_path} llm={cfg['llm'].get('enabled', False)} workers={resolve_workers(cfg, workers)}")
+    stats = process_directory(input_path, out_path, cfg, dry_run=dry_run, workers=workers, io_pipeline=pipeline, force=force, profile=profile)
+    perf = stats.pop("perf", None)
+    prof = stats.pop("profile", None)
     rprint("[bold]Готово[/bold]", stats)
+    if perf:
+        _print_perf(perf)
+    if prof:
+        _print_profile(prof)
+
+
+def _print_perf(perf: dict) -> None:
+    table = Table(title=f"Производительность: {perf['files']} файлов за {perf['wall_sec']} с ({perf.get('files_per_sec')} файл/с)")
+    table.add_column("Стадия")
+    table.add_column("Вызовов", justify="right")
+    table.add_column("Всего, с", justify="right")
+    table.add_column("p50, мс", justify="right")
+    table.add_column("p95, мс", justify="right")
+    table.add_column("max, мс", justify="right")
+    for name, d in perf.get("stages", {}).items():
+        table.add_row(name, str(d["count"]), f"{d['total_sec']:.3f}", f"{d['p50_ms']:.2f}", f"{d['p95_ms']:.2f}", f"{d['max_ms']:.2f}")
+    for kind, d in perf.get("calls", {}).items():
+        table.add_row(f"{kind} (запросы, ошибок {d['errors']})", str(d["count"]), f"{d['total_sec']:.3f}", f"{d['p50_ms']:.2f}", f"{d['p95_ms']:.2f}", f"{d['max_ms']:.2f}")
+    rprint(table)
+    rprint(f"Байт прочитано: {perf['bytes_in']}, записано: {perf['bytes_out']}")
+
+
+def _print_profile(prof: dict) -> None:
+    table = Table(title="Самые медленные файлы (профилирование)")
+    table.add_column("Файл")
+    table.add_column("Время, с", justify="right")
+    table.add_column("Размер, байт", justify="right")
+    table.add_column("Пик памяти, МБ", justify="right")
+    for row in prof.get("slowest_files", [])[:10]:
+        table.add_row(row["file"], f"{row['seconds']:.3f}", str(row["size_bytes"]), f"{row['peak_memory_bytes'] / 1e6:.1f}")
+    rprint(table)
+    for name, st in prof.get("stages", {}).items():
+        top = ", ".join(h["function"].split(" (")[0] for h in st["hotspots"][:3])
+        rprint(f"  {name}: {st['seconds']} с — {top}")
+    rprint(f"Профили: {prof.get('dir')} (python -m pstats <файл>.pstats)")
 
 
 @app.command("validate")
@@ -55,6 +100,72 @@ def cli_validate(out: str = typer.Option("output/md", help="Папка Markdown"
     rprint({"total": total, "missing_front_matter": missing_front})
 
 
+def _open_reports(reports: str, config: str) -> ReportStore:
+    reports_dir = Path(reports) if reports else Path(load_pipeline_config(Path(config))["io"].get("reports_dir", "reports"))
+    if not (reports_dir / "reports.sqlite").exists():
+        rprint(f"[red]Нет базы отчётов[/red]: {reports_dir / 'reports.sqlite'}")
+        raise typer.Exit(code=1)
+    return ReportStore(reports_dir)
+
+
+@report_app.command("summary")
+def cli_report_summary(
+    reports: str = typer.Option(None, help="Папка отчётов (по умолчанию io.reports_dir из конфига)"),
+    config: str = typer.Option("config/pipeline.yaml", help="Конфигурация пайплайна"),
+    run_id: str = typer.Option(None, help="Только документы указанного запуска"),
+):
+    store = _open_reports(reports, config)
+    try:
+        rprint(store.summary(run_id))
+    finally:
+        store.close()
+
+
+@report_app.command("show")
+def cli_report_show(
+    doc_id: str = typer.Argument(..., help="Идентификатор документа"),
+    reports: str = typer.Option(None, help="Папка отчётов (по умолчанию io.reports_dir из конфига)"),
+    config: str = typer.Option("config/pipeline.yaml", help="Конфигурация пайплайна"),
+):
+    store = _open_reports(reports, config)
+    try:
+        doc = store.get(doc_id)
+    finally:
+        store.close()
+    if doc is None:
+        rprint(f"[red]Нет документа[/red]: {doc_id}")
+        raise typer.Exit(code=1)
+    rprint(doc)
+
+
+@report_app.command("leaks")
+def cli_report_leaks(
+    reports: str = typer.Option(None, help="Папка отчётов (по умолчанию io.reports_dir из конфига)"),
+    config: str = typer.Option("config/pipeline.yaml", help="Конфигурация пайплайна"),
+    limit: int = typer.Option(50, help="Сколько документов показать (0 — все)"),
+):
+    store = _open_reports(reports, config)
+    try:
+        for doc in store.iter_documents(leaking_only=True, limit=limit):
+            rprint({"doc_id": doc["doc_id"], "source_path": doc["source_path"], "residual": doc["residual"]})
+    finally:
+        store.close()
+
+
+@report_app.command("export-legacy")
+def cli_report_export(
+    out: str = typer.Option(..., help="Куда выгрузить отчёты в прежней раскладке"),
+    reports: str = typer.Option(None, help="Папка отчётов (по умолчанию io.reports_dir из конфига)"),
+    config: str = typer.Option("config/pipeline.yaml", help="Конфигурация пайплайна"),
+):
+    store = _open_reports(reports, config)
+    try:
+        written = store.export_legacy(Path(out))
+    finally:
+        store.close()
+    rprint("[bold]Выгружено[/bold]", written)
+
+
 if __name__ == "__main__":
     app()
 
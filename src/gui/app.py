@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 from typing import Optional
 
@@ -9,13 +10,13 @@ from PySide6.QtCore import Qt, QThread, Signal, QUrl
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
     QFileDialog, QLineEdit, QTextEdit, QCheckBox, QProgressBar, QListWidget,
-    QListWidgetItem, QTabWidget, QSplitter, QDialog, QDialogButtonBox
+    QListWidgetItem, QTabWidget, QSplitter, QDialog, QDialogButtonBox, QSpinBox
 )
 from PySide6.QtGui import QTextOption, QDesktopServices, QColor, QTextCursor, QTextCharFormat
 from markdown_it import MarkdownIt
 
 from src.pipeline.config import load_pipeline_config
-from src.pipeline.run import process_directory
+from src.pipeline.run import iter_process
 from src.pipeline.llm import check_llm_ready
 from pathlib import Path
 
@@ -24,12 +25,16 @@ class Worker(QThread):
     progress = Signal(dict)
     finished = Signal(dict)
 
-    def __init__(self, input_dir: Path, output_dir: Path, cfg: dict, dry_run: bool = False):
+    def __init__(self, input_dir: Path, output_dir: Path, cfg: dict, dry_run: bool = False, workers: Optional[int] = None, io_pipeline: Optional[bool] = None, force: bool = False, profile: bool = False):
         super().__init__()
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.cfg = cfg
         self.dry_run = dry_run
+        self.workers = workers
+        self.io_pipeline = io_pipeline
+        self.force = force
+        self.profile = profile
         self._paused = False
         self._stop = False
 
@@ -39,10 +44,16 @@ class Worker(QThread):
         class Control:
             def should_stop(inner_self):
                 return self._stop
+            def is_paused(inner_self):
+                return self._paused
             def wait_if_paused(inner_self):
                 while self._paused and not self._stop:
                     self.msleep(100)
-        stats = process_directory(self.input_dir, self.output_dir, self.cfg, dry_run=self.dry_run, progress_cb=cb, control=Control())
+        # Результаты не накапливаем: список в UI наполняется по событиям прогресса
+        stats: dict = {}
+        for _ in iter_process(self.input_dir, self.output_dir, self.cfg, dry_run=self.dry_run, progress_cb=cb, control=Control(),
+                              workers=self.workers, io_pipeline=self.io_pipeline, force=self.force, stats=stats, profile=self.profile):
+            pass
         self.finished.emit(stats)
 
     def pause(self):
@@ -96,6 +107,27 @@ class MainWindow(QWidget):
         cfg_row.addWidget(QLabel("Конфиг:"))
         cfg_row.addWidget(self.config_edit)
         cfg_row.addWidget(self.llm_checkbox)
+        # Число процессов для CPU‑стадий (0 — по числу ядер)
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(0, max(1, os.cpu_count() or 1) * 4)
+        self.workers_spin.setValue(1)
+        cfg_row.addWidget(QLabel("Процессы:"))
+        cfg_row.addWidget(self.workers_spin)
+        self.pipeline_checkbox = QCheckBox("Параллельные запросы LLM/vision")
+        cfg_row.addWidget(self.pipeline_checkbox)
+        # Пока пользователь не менял «Процессы» и «Параллельные запросы», действуют
+        # execution.workers и execution.io_pipeline из конфига (как в CLI без флагов)
+        self._workers_changed = False
+        self._pipeline_changed = False
+        self._load_execution_defaults()
+        self.workers_spin.valueChanged.connect(lambda _: setattr(self, "_workers_changed", True))
+        self.pipeline_checkbox.toggled.connect(lambda _: setattr(self, "_pipeline_changed", True))
+        self.config_edit.editingFinished.connect(self._load_execution_defaults)
+        self.force_checkbox = QCheckBox("Обработать всё заново")
+        cfg_row.addWidget(self.force_checkbox)
+        # Профилирование: последовательный прогон под cProfile/tracemalloc, отчёт в reports/profile/
+        self.profile_checkbox = QCheckBox("Профилирование")
+        cfg_row.addWidget(self.profile_checkbox)
         layout.addLayout(cfg_row)
 
         # Кнопка управления промптом (модальное окно) и открытие отчётов
@@ -224,7 +256,10 @@ class MainWindow(QWidget):
             tmp_prompt.parent.mkdir(parents=True, exist_ok=True)
             tmp_prompt.write_text(user_prompt, encoding="utf-8")
             cfg["llm"]["user_prompt_path"] = str(tmp_prompt)
-        self.worker = Worker(Path(self.input_edit.text()), Path(self.output_edit.text()), cfg, dry_run=False)
+        # None — значение из execution конфига
+        workers = self.workers_spin.value() if self._workers_changed else None
+        io_pipeline = self.pipeline_checkbox.isChecked() if self._pipeline_changed else None
+        self.worker = Worker(Path(self.input_edit.text()), Path(self.output_edit.text()), cfg, dry_run=False, workers=workers, io_pipeline=io_pipeline, force=self.force_checkbox.isChecked(), profile=self.profile_checkbox.isChecked())
         self.worker.progress.connect(self._on_progress)
         self.worker.finished.connect(self._on_finished)
         self.run_btn.setEnabled(False)
@@ -254,9 +289,14 @@ class MainWindow(QWidget):
 
     def _on_progress(self, evt: dict):
         if evt.get("event") == "file_start":
-            idx, total = evt.get("index", 0), evt.get("total", 1)
-            self.progress.setValue(int((idx - 1) / max(total, 1) * 100))
-            self.status_lbl.setText(f"Файл {idx}/{total}: {evt.get('file')}")
+            idx, total = evt.get("index", 0), evt.get("total")
+            if total:
+                self.progress.setValue(int((idx - 1) / max(total, 1) * 100))
+                self.status_lbl.setText(f"Файл {idx}/{total}: {evt.get('file')}")
+            else:
+                # Файлы обнаруживаются лениво, общее число неизвестно — «бегущий» индикатор
+                self.progress.setRange(0, 0)
+                self.status_lbl.setText(f"Файл {idx}: {evt.get('file')}")
             # Добавляем файл в очередь сразу
             in_path = evt.get('file')
             if in_path and in_path not in self._items_by_input:
@@ -276,7 +316,7 @@ class MainWindow(QWidget):
                 pass
         elif evt.get("event") == "file_end":
             idx = evt.get("index")
-            total = evt.get("total") or max(1, self.file_list.count())
+            total = evt.get("total")
             if idx and total:
                 self.progress.setValue(int(idx / total * 100))
             self.status_lbl.setText(f"Готов: {evt.get('file')}")
@@ -296,33 +336,27 @@ class MainWindow(QWidget):
                 data = item.data(Qt.UserRole) or {}
                 data["output_path"] = out_path
                 item.setData(Qt.UserRole, data)
-            # Подгружаем логи изображений из reports/images/<doc_id>.json
-            try:
-                reports_dir = Path(os.getenv("REPORTS_DIR", "reports"))
-                doc_id = None
-                # Попытаемся восстановить doc_id из пути отчёта PII (известен формат), иначе из исходника не получить напрямую
-                # Для простоты: сканируем reports/images по времени и берём последний созданный
-                images_dir = reports_dir / "images"
-                latest = None
-                if images_dir.exists():
-                    latest = max(images_dir.glob("*.json"), key=lambda p: p.stat().st_mtime, default=None)
-                if latest:
-                    log_text = latest.read_text(encoding="utf-8", errors="ignore")
-                    self._image_logs[in_path] = log_text
-                    # Если выбран именно этот элемент — отрисуем сразу
-                    current = self.file_list.currentItem()
-                    if current and (current.data(Qt.UserRole) or {}).get("input_path") == in_path:
-                        self._render_preview()
-            except Exception:
-                pass
+            # Если выбран именно этот элемент — обновим превью (логи изображений приходят до file_end)
+            current = self.file_list.currentItem()
+            if in_path in self._image_logs and current and (current.data(Qt.UserRole) or {}).get("input_path") == in_path:
+                self._render_preview()
+        elif evt.get("event") == "images" and evt.get("substage") == "report_written":
+            # Отчёт по изображениям приходит прямо в событии (reports.sqlite, без отдельных файлов)
+            report = evt.get("report")
+            if report:
+                self._image_logs[evt.get("file")] = json.dumps(report, ensure_ascii=False, indent=2)
         elif evt.get("event") == "error":
             self.status_lbl.setText(f"Ошибка: {evt.get('file')} — {evt.get('message')}")
             # ошибки не добавляем в список файлов, чтобы не ломать соответствие
 
     def _on_finished(self, stats: dict):
+        self.progress.setRange(0, 100)
         self.progress.setValue(100)
         self.run_btn.setEnabled(True)
         # Список уже наполнен по мере обработки
+        prof = stats.get("profile")
+        if prof:
+            self.status_lbl.setText(f"Готово. Профиль: {prof.get('dir')}")
 
     def _on_item_clicked(self, item):
         r = item.data(Qt.UserRole) or {}
@@ -420,6 +454,26 @@ class MainWindow(QWidget):
             pass
         QDesktopServices.openUrl(QUrl.fromLocalFile(str(p)))
 
+    def _load_execution_defaults(self):
+        """Начальные «Процессы» и «Параллельные запросы» — из execution текущего конфига (если их не меняли)."""
+        try:
+            from ruamel.yaml import YAML
+            yaml = YAML(typ="safe")
+            with Path(self.config_edit.text()).open("r", encoding="utf-8") as f:
+                execution = ((yaml.load(f) or {}).get("execution") or {})
+            workers = execution.get("workers", 1)
+            workers = 1 if workers is None else max(0, int(workers))
+        except Exception:
+            return
+        if not self._workers_changed:
+            self.workers_spin.blockSignals(True)
+            self.workers_spin.setValue(workers)
+            self.workers_spin.blockSignals(False)
+        if not self._pipeline_changed:
+            self.pipeline_checkbox.blockSignals(True)
+            self.pipeline_checkbox.setChecked(bool(execution.get("io_pipeline", False)))
+            self.pipeline_checkbox.blockSignals(False)
+
     def _open_prompt_dialog(self):
         # Определяем текущий эффективный промпт: пользовательский или из конфига
         current_text = (self._custom_prompt_text or "").strip()
@@ -1,18 +1,31 @@
 import re
-from dataclasses import dataclass
-from typing import Dict, List, Tuple
-
-
-EMAIL_RE = re.compile(r"(?i)\b[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}\b")
-PHONE_RE = re.compile(r"(?:(?<=\D)|^)\+?\d[\d\s().-]{7,}\d(?=\D|$)")
-IP_RE = re.compile(r"\b(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}(?:25[0-5]|2[0-4]\d|1?\d?\d)\b")
-MAC_RE = re.compile(r"\b([0-9A-Fa-f]{2}[:\-]){5}[0-9A-Fa-f]{2}\b")
-LOGIN_RE = re.compile(r"(?i)\b(?:login|user|uid|account|acc|логин|пользователь)[:=]\s*([\w.\-@]+)")
-URL_CRED_RE = re.compile(r"(?i)\b[a-z][a-z0-9+.-]*://[^\s]+:[^\s]+@[^\s]+")
-SECRET_RE = re.compile(r"(?i)\b(?:(?:api|access|secret|private|bearer|token|key|pwd|pass(?:word)?)\s*[:=]\s*[A-Za-z0-9._\-]{16,})\b")
-TIMESTAMP_RE = re.compile(r"\b\d{4}[-/.]\d{2}[-/.]\d{2}[ T]\d{2}:\d{2}(:\d{2})?\b")
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Collection, Dict, List, Optional, Tuple
+
+import regex
+
+from .safe_regex import RegexPolicy, split_lines
+from .secret_scan import EntropySecretDetector
+from .whitelist import PiiWhitelist
+
+
+# Правила компилируются модулем regex: совпадения те же, что у re, но есть timeout=
+# (бюджет regex.timeouts["pii.<ПРАВИЛО>"]) и нет экспоненциального перебора на логах
+EMAIL_RE = regex.compile(r"(?i)\b[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}\b")
+PHONE_RE = regex.compile(r"(?:(?<=\D)|^)\+?\d[\d\s().-]{7,}\d(?=\D|$)")
+IP_RE = regex.compile(r"\b(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}(?:25[0-5]|2[0-4]\d|1?\d?\d)\b")
+MAC_RE = regex.compile(r"\b([0-9A-Fa-f]{2}[:\-]){5}[0-9A-Fa-f]{2}\b")
+LOGIN_RE = regex.compile(r"(?i)\b(?:login|user|uid|account|acc|логин|пользователь)[:=]\s*([\w.\-@]+)")
+URL_CRED_RE = regex.compile(r"(?i)\b[a-z][a-z0-9+.-]*://[^\s]+:[^\s]+@[^\s]+")
+SECRET_RE = regex.compile(r"(?i)\b(?:(?:api|access|secret|private|bearer|token|key|pwd|pass(?:word)?)\s*[:=]\s*[A-Za-z0-9._\-]{16,})\b")
+TIMESTAMP_RE = regex.compile(r"\b\d{4}[-/.]\d{2}[-/.]\d{2}[ T]\d{2}:\d{2}(:\d{2})?\b")
 # Русский маркер "пароль: <значение>" — маскируем только значение
-PASSWORD_WORD_RE = re.compile(r"(?iu)(пароль\s*(?:[:=\-–—]?\s*))([^<\s]\S*)")
+PASSWORD_WORD_RE = regex.compile(r"(?iu)(пароль\s*(?:[:=\-–—]?\s*))([^<\s]\S*)")
+# Блок кода Markdown: от строки ``` до закрывающей (или до конца текста)
+CODE_FENCE_RE = regex.compile(r"(?ms)^ {0,3}```.*?(?:^ {0,3}```[^\n]*$|\Z)")
 
 
 MASKS = {
@@ -24,12 +37,84 @@ MASKS = {
     "URL_CRED": "<SECRET:URI>",
     "SECRET": "<SECRET:GENERIC>",
     "PASSWORD": "<SECRET:PASSWORD>",
+    "PERSON": "<PERSON>",
 }
 
 
+# Сущности из pii.entities, к которым относятся правила: URL с учётными данными и пароли — виды SECRET
+ENTITY_FAMILY = {"URL_CRED": "SECRET", "PASSWORD": "SECRET"}
+# Сущности, которые ищет проверка остаточной PII (ключи отчёта residual_pii). PERSON
+# добавляется, только когда имена ищутся (person_spans передан, PersonDetector включён)
+RESIDUAL_ENTITIES = ("EMAIL", "PHONE", "IP", "MAC", "URL_CRED", "SECRET", "LOGIN")
+
+
+@dataclass
+class PiiSpan:
+    start: int
+    end: int
+    entity: str
+    replacement: str
+    # False — сущность найдена, но её тип выключен в pii.entities или значение в белом списке:
+    # текст остаётся как есть
+    masked: bool = True
+    whitelisted: bool = False
+
+
 @dataclass
 class AnonymizeReport:
     counts: Dict[str, int]
+    # Все найденные фрагменты (смещения — во входном тексте) и остаточная PII:
+    # найденное, но не замаскированное, в формате отчёта residual_pii
+    spans: List[PiiSpan] = field(default_factory=list)
+    residual: Dict[str, int] = field(default_factory=dict)
+    # Правила, которые префильтр не запускал: в тексте нет нужных символов или ключевых слов
+    skipped: List[str] = field(default_factory=list)
+    # Найдено, но оставлено по белому списку (pii.whitelists) — не маска и не остаточная PII
+    whitelisted: Dict[str, int] = field(default_factory=dict)
+    # Превышения бюджета времени правилами (RegexPolicy): {"pattern": "pii.PHONE", "lines": ...}
+    timeouts: List[Dict] = field(default_factory=list)
+    # Где осталась остаточная PII: (начало, конец, ключ residual) — смещения в выходном тексте
+    residual_at: List[Tuple[int, int, str]] = field(default_factory=list)
+
+
+class SpanProtector:
+    """Что обезличивание оставляет как есть.
+
+    Защищённые интервалы: всегда временные метки (иначе их съедает PHONE), по настройке —
+    блоки кода ```; правила маскирования и поиск остаточной PII их пропускают. Белый
+    список (pii.whitelists) проверяется по каждому найденному значению (PiiWhitelist).
+    """
+
+    def __init__(self, code_fences: bool = False, whitelist: Optional[PiiWhitelist] = None):
+        self.code_fences = code_fences
+        self.whitelist = whitelist
+
+    @classmethod
+    def from_config(cls, pii_cfg: Dict) -> "SpanProtector":
+        return cls(
+            code_fences=bool(pii_cfg.get("protect_code_fences", False)),
+            whitelist=PiiWhitelist.from_config(pii_cfg),
+        )
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        spans = [m.span() for m in TIMESTAMP_RE.finditer(text)]
+        if self.code_fences and "```" in text:
+            spans.extend(m.span() for m in CODE_FENCE_RE.finditer(text))
+        return _merge(spans)
+
+
+DEFAULT_PROTECTOR = SpanProtector()
+
+
+def _merge(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
 
 
 def replace_pattern(text: str, pattern: re.Pattern, mask: str) -> Tuple[str, int]:
@@ -40,62 +125,462 @@ def replace_pattern(text: str, pattern: re.Pattern, mask: str) -> Tuple[str, int
     return new_text, n
 
 
-def anonymize_text(text: str) -> Tuple[str, AnonymizeReport]:
-    counts: Dict[str, int] = {k: 0 for k in MASKS.keys()}
-    # Защита временных меток от ложного срабатывания PHONE: заменяем на плейсхолдеры
-    protected: List[Tuple[str, str]] = []
-    def _protect_timestamps(t: str) -> str:
-        idx = 0
-        def _sub(m: re.Match) -> str:
-            nonlocal idx
-            orig = m.group(0)
-            token = f"<TS_{idx}>"
-            protected.append((token, orig))
-            idx += 1
-            return token
-        return TIMESTAMP_RE.sub(_sub, t)
-
-    def _restore_timestamps(t: str) -> str:
-        for token, orig in protected:
-            t = t.replace(token, orig)
-        return t
-
-    text = _protect_timestamps(text)
-    for name, (pattern, mask) in {
-        "EMAIL": (EMAIL_RE, MASKS["EMAIL"]),
-        "PHONE": (PHONE_RE, MASKS["PHONE"]),
-        "IP": (IP_RE, MASKS["IP"]),
-        "MAC": (MAC_RE, MASKS["MAC"]),
-        "URL_CRED": (URL_CRED_RE, MASKS["URL_CRED"]),
-        "SECRET": (SECRET_RE, MASKS["SECRET"]),
-    }.items():
-        text, n = replace_pattern(text, pattern, mask)
-        counts[name] += n
-    # PASSWORD (рус.): сохраняем префикс, маскируем только значение
-    def _pwd_sub(m: re.Match) -> str:
-        return m.group(1) + MASKS["PASSWORD"]
-    text, n = PASSWORD_WORD_RE.subn(_pwd_sub, text)
-    counts["PASSWORD"] = counts.get("PASSWORD", 0) + n
-    # LOGIN: замена только значения после маркера
-    text, n = LOGIN_RE.subn(lambda m: m.group(0).split("=")[0].split(":")[0] + ": " + MASKS["LOGIN"], text)
-    counts["LOGIN"] += n
-    text = _restore_timestamps(text)
-    return text, AnonymizeReport(counts=counts)
-
-
-def detect_residual_pii(text: str) -> Dict[str, int]:
-    # Перед подсчётом игнорируем валидные временные метки, чтобы не считать их как PHONE
-    sanitized = TIMESTAMP_RE.sub("", text)
-    residual = {
-        "EMAIL": len(EMAIL_RE.findall(text)),
-        "PHONE": len(PHONE_RE.findall(sanitized)),
-        "IP": len(IP_RE.findall(text)),
-        "MAC": len(MAC_RE.findall(text)),
-        "URL_CRED": len(URL_CRED_RE.findall(text)),
-        "SECRET": len(SECRET_RE.findall(text)),
+# Правила маскирования в порядке приоритета: более раннее правило «забирает» фрагмент,
+# следующие видят на его месте маску
+MASK_RULES: List[Tuple[str, "regex.Pattern"]] = [
+    ("EMAIL", EMAIL_RE),
+    ("PHONE", PHONE_RE),
+    ("IP", IP_RE),
+    ("MAC", MAC_RE),
+    ("URL_CRED", URL_CRED_RE),
+    ("SECRET", SECRET_RE),
+    ("PASSWORD", PASSWORD_WORD_RE),
+    ("LOGIN", LOGIN_RE),
+]
+# Группа со значением, которое сверяется с белым списком (остальные правила — совпадение целиком)
+_VALUE_GROUP = {"PASSWORD": 2, "LOGIN": 1}
+
+
+# Префильтр. Совпадения SECRET/PASSWORD/LOGIN начинаются с ключевого слова — их ищем только
+# в позициях ключевых слов (поиск подстрок в C, а не регулярное выражение по всему тексту)
+_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "SECRET": ("api", "access", "secret", "private", "bearer", "token", "key", "pwd", "pass"),
+    "PASSWORD": ("пароль",),
+    "LOGIN": ("login", "user", "uid", "acc", "логин", "пользователь"),
+}
+# Символы, которые (?i) сопоставляет с латиницей ключевых слов, а str.lower() — нет
+_FOLD_CHARS = ("\u0131", "\u0130", "\u017f", "\u212a")
+_FOLD = str.maketrans({"\u0131": "i", "\u0130": "i", "\u017f": "s", "\u212a": "k"})
+_DIGIT_RE = re.compile(r"\d")
+
+
+def _plan(text: str) -> Dict[str, Optional[List[int]]]:
+    """Какие правила запускать: None — по всему тексту, [] — пропустить (совпадение
+    невозможно), список — только с этих позиций (ключевые слова)."""
+    has_digit = _DIGIT_RE.search(text) is not None
+    plan: Dict[str, Optional[List[int]]] = {
+        "EMAIL": None if "@" in text else [],
+        "PHONE": None if has_digit else [],
+        "IP": None if has_digit and text.count(".") >= 3 else [],
+        "MAC": None if text.count(":") + text.count("-") >= 5 else [],
+        "URL_CRED": None if "://" in text and "@" in text else [],
     }
-    # LOGIN: проверяем наличие шаблонов логина с явным значением
-    residual["LOGIN"] = len(LOGIN_RE.findall(text))
+    folded = text.lower()
+    if any(ch in text for ch in _FOLD_CHARS):
+        folded = text.translate(_FOLD).lower()
+    # позиции годятся, только если при понижении регистра длина не изменилась
+    exact = len(folded) == len(text)
+    for name, words in _KEYWORDS.items():
+        positions: List[int] = []
+        for word in words:
+            i = folded.find(word)
+            while i >= 0:
+                positions.append(i)
+                i = folded.find(word, i + 1)
+        if not positions:
+            plan[name] = []
+        else:
+            plan[name] = sorted(set(positions)) if exact else None
+    return plan
+
+
+def _finditer(
+    pattern: "regex.Pattern",
+    text: str,
+    positions: Optional[List[int]],
+    timeout: Optional[float] = None,
+) -> List["regex.Match"]:
+    """Как pattern.finditer(text), но при заданных позициях пробует совпадение только в них.
+
+    timeout — общий бюджет на проход в секундах (TimeoutError при превышении).
+    """
+    if positions is None:
+        return list(pattern.finditer(text, timeout=timeout))
+    deadline = None if timeout is None else time.monotonic() + timeout
+    matches: List["regex.Match"] = []
+    end = 0
+    for pos in positions:
+        if pos < end:
+            continue
+        left = None if deadline is None else deadline - time.monotonic()
+        if left is not None and left <= 0:
+            raise TimeoutError("regex timed out")
+        m = pattern.match(text, pos, timeout=left)
+        if m is not None:
+            matches.append(m)
+            end = m.end()
+    return matches
+
+
+def _rule_matches(
+    name: str,
+    pattern: "regex.Pattern",
+    text: str,
+    positions: Optional[List[int]],
+    policy: Optional[RegexPolicy],
+    timeouts: Optional[List[Dict]],
+) -> List["regex.Match"]:
+    """Совпадения правила с бюджетом времени policy (pii.<ПРАВИЛО>).
+
+    Не уложилось — повтор по строкам с тем же бюджетом на все строки: совпадения через
+    перевод строки (PHONE) теряются, зато документ не стоит. Строки, на которые бюджета
+    не хватило, остаются непроверенными и попадают в отчёт о таймаутах (при
+    regex.on_timeout: fail — RegexTimeoutError).
+    """
+    if policy is None:
+        return _finditer(pattern, text, positions)
+    key = f"pii.{name}"
+    timeout = policy.timeout_for(key)
+    try:
+        return _finditer(pattern, text, positions, timeout)
+    except TimeoutError:
+        pass
+    deadline = None if timeout is None else time.monotonic() + timeout
+    matches: List["regex.Match"] = []
+    lost = 0
+    for start, end in split_lines(text):
+        left = None if deadline is None else deadline - time.monotonic()
+        if left is not None and left <= 0:
+            lost += 1
+            continue
+        try:
+            matches.extend(pattern.finditer(text, start, end, timeout=left))
+        except TimeoutError:
+            lost += 1
+    if lost:
+        policy.timed_out(key, timeouts, lines=lost)
+    return matches
+
+
+def _replacement(name: str, m: "regex.Match") -> str:
+    if name == "LOGIN":
+        # LOGIN: замена только значения после маркера
+        return m.group(0).split("=")[0].split(":")[0] + ": " + MASKS["LOGIN"]
+    return MASKS[name]
+
+
+def _blank(text: str, spans: List[Tuple[int, int]]) -> str:
+    """Закрывает фрагменты заглушкой «<...>» той же длины (внутри — NUL).
+
+    Для следующих правил заглушка ведёт себя как настоящая маска: границы `<`/`>` дают
+    те же \\b и (?<=\\D), внутри нет пробелов и символов, с которых начинается какое‑либо
+    правило. Смещения остальных фрагментов при этом не сдвигаются.
+    """
+    parts: List[str] = []
+    pos = 0
+    for start, end in spans:
+        parts.append(text[pos:start])
+        parts.append("<" + "\0" * (end - start - 2) + ">" if end - start > 1 else "<")
+        pos = end
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+def enabled_entities(pii_cfg: Dict) -> Optional[frozenset]:
+    """pii.entities → множество включённых сущностей; None — маскировать всё."""
+    entities = pii_cfg.get("entities")
+    if entities is None:
+        return None
+    return frozenset(str(e).upper() for e in entities)
+
+
+def mask_spans(
+    text: str,
+    protector: SpanProtector = DEFAULT_PROTECTOR,
+    entities: Optional[Collection[str]] = None,
+    secret_detector: Optional[EntropySecretDetector] = None,
+    person_spans: Optional[List[Tuple[int, int]]] = None,
+) -> List[PiiSpan]:
+    """Фрагменты PII исходного текста по порядку правил.
+
+    Каждое правило проходит по тексту один раз; защищённые интервалы и уже найденные
+    фрагменты закрыты заглушками, поэтому результат тот же, что при последовательных
+    заменах, но без перестройки текста после каждого правила. Фрагмент более позднего
+    правила может целиком накрыть ранние (URL_CRED и значение PASSWORD проходят сквозь
+    маски), частично — никогда. Секреты по энтропии (secret_detector) ищутся последними,
+    в тексте, где все найденные правилами фрагменты уже закрыты, и считаются как SECRET.
+    Имена (person_spans — результат PersonDetector по этому тексту) идут после всего
+    остального; имя, задевающее уже найденный или защищённый фрагмент, отбрасывается.
+    """
+    return _mask_spans(text, protector, entities, _plan(text), secret_detector, person_spans)
+
+
+def _mask_spans(
+    text: str,
+    protector: SpanProtector,
+    entities: Optional[Collection[str]],
+    plan: Dict[str, Optional[List[int]]],
+    secret_detector: Optional[EntropySecretDetector] = None,
+    person_spans: Optional[List[Tuple[int, int]]] = None,
+    regex_policy: Optional[RegexPolicy] = None,
+    timeouts: Optional[List[Dict]] = None,
+) -> List[PiiSpan]:
+    shadow = _blank(text, protector.spans(text))
+    whitelist = protector.whitelist
+    spans: List[PiiSpan] = []
+    last = len(MASK_RULES) - 1 if secret_detector is None and not person_spans else len(MASK_RULES)
+    for i, (name, pattern) in enumerate(MASK_RULES):
+        if plan[name] == []:
+            continue
+        matches = _rule_matches(name, pattern, shadow, plan[name], regex_policy, timeouts)
+        if not matches:
+            continue
+        masked = entities is None or ENTITY_FAMILY.get(name, name) in entities
+        # PASSWORD (рус.): префикс «пароль:» остаётся в тексте, фрагмент — только значение
+        group = 2 if name == "PASSWORD" else 0
+        if whitelist is None:
+            spans.extend(PiiSpan(m.start(group), m.end(group), name, _replacement(name, m), masked) for m in matches)
+        else:
+            value_group = _VALUE_GROUP.get(name, 0)
+            for m in matches:
+                allowed = whitelist.allows(text[m.start(value_group):m.end(value_group)])
+                spans.append(PiiSpan(m.start(group), m.end(group), name, _replacement(name, m), masked and not allowed, allowed))
+        # оставленные по белому списку фрагменты тоже закрываются: внутри них другие правила не ищут
+        if i < last:
+            shadow = _blank(shadow, [m.span(group) for m in matches])
+    if secret_detector is not None:
+        masked = entities is None or "SECRET" in entities
+        found = secret_detector.find(shadow)
+        for start, end in found:
+            allowed = whitelist is not None and whitelist.allows(text[start:end])
+            spans.append(PiiSpan(start, end, "SECRET", MASKS["SECRET"], masked and not allowed, allowed))
+        if found and person_spans:
+            shadow = _blank(shadow, found)
+    if person_spans:
+        masked = entities is None or "PERSON" in entities
+        for start, end in _free_spans(text, shadow, person_spans):
+            allowed = whitelist is not None and whitelist.allows(text[start:end])
+            spans.append(PiiSpan(start, end, "PERSON", MASKS["PERSON"], masked and not allowed, allowed))
+    return spans
+
+
+def _free_spans(text: str, shadow: str, spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Интервалы, не задевающие закрытых фрагментов shadow (там текст отличается от исходного)."""
+    return [(start, end) for start, end in spans if shadow[start:end] == text[start:end]]
+
+
+def anonymize_text(
+    text: str,
+    protector: SpanProtector = DEFAULT_PROTECTOR,
+    entities: Optional[Collection[str]] = None,
+    secret_detector: Optional[EntropySecretDetector] = None,
+    person_spans: Optional[List[Tuple[int, int]]] = None,
+    regex_policy: Optional[RegexPolicy] = None,
+) -> Tuple[str, AnonymizeReport]:
+    """Маскирование PII. Отчёт содержит найденные фрагменты и остаточную PII — отдельный
+    поиск по результату (detect_residual_pii) для этого не нужен.
+
+    regex_policy — бюджеты времени правил (секция regex); превышения — в report.timeouts.
+    """
+    counts: Dict[str, int] = {k: 0 for k in MASKS.keys()}
+    residual = _empty_residual(person_spans is not None)
+    whitelisted: Dict[str, int] = {k: 0 for k in MASKS.keys()}
+    timeouts: List[Dict] = []
+    plan = _plan(text)
+    spans = _mask_spans(text, protector, entities, plan, secret_detector, person_spans, regex_policy, timeouts)
+    spans.sort(key=lambda sp: sp.start)
+    parts: List[str] = []
+    pos = 0
+    # заменённые интервалы входа и сдвиг смещений выхода после каждого (маски другой длины)
+    replaced: List[Tuple[int, int]] = []
+    shifts: List[int] = []
+    unmasked: List[Tuple[int, int, str]] = []
+    for sp in spans:
+        if sp.whitelisted:
+            whitelisted[sp.entity] += 1
+            continue
+        if not sp.masked:
+            key = sp.entity if sp.entity in residual else ENTITY_FAMILY.get(sp.entity, sp.entity)
+            residual[key] += 1
+            unmasked.append((sp.start, sp.end, key))
+            continue
+        counts[sp.entity] += 1
+        if sp.start < pos:
+            # фрагмент целиком внутри уже заменённого (например, IP внутри URL_CRED)
+            continue
+        parts.append(text[pos:sp.start])
+        parts.append(sp.replacement)
+        replaced.append((sp.start, sp.end))
+        shifts.append((shifts[-1] if shifts else 0) + len(sp.replacement) - (sp.end - sp.start))
+        pos = sp.end
+    parts.append(text[pos:])
+    residual_at: List[Tuple[int, int, str]] = []
+    replaced_starts = [start for start, _ in replaced]
+    for start, end, key in unmasked:
+        i = bisect_right(replaced_starts, start) - 1
+        if i >= 0 and start < replaced[i][1]:
+            # оставленное правилом внутри маски другого правила в выход не попало
+            continue
+        shift = shifts[i] if i >= 0 else 0
+        residual_at.append((start + shift, end + shift, key))
+    skipped = [name for name, _ in MASK_RULES if plan[name] == []]
+    report = AnonymizeReport(
+        counts=counts, spans=spans, residual=residual, skipped=skipped, whitelisted=whitelisted, timeouts=timeouts,
+        residual_at=residual_at,
+    )
+    return "".join(parts), report
+
+
+def changed_regions(before: str, after: str, margin_lines: int = 2) -> List[Tuple[int, int]]:
+    """Интервалы `after`, изменённые относительно `before` (построчный diff), с запасом
+    margin_lines строк с каждой стороны — совпадение PHONE может переходить через строку.
+
+    Удалённые строки тоже дают интервал: соседние строки сходятся и могут образовать новое совпадение.
+    """
+    return diff_lines(before, after, margin_lines)[0]
+
+
+def diff_lines(
+    before: str, after: str, margin_lines: int = 2
+) -> Tuple[List[Tuple[int, int]], Optional[Dict[int, int]]]:
+    """changed_regions и соответствие строк: номер неизменённой строки `before` → её номер
+    в `after` (None — тексты совпадают, номера те же). Строки — как у str.splitlines."""
+    if before == after:
+        return [], None
+    a = before.splitlines(keepends=True)
+    b = after.splitlines(keepends=True)
+    offsets = [0]
+    for line in b:
+        offsets.append(offsets[-1] + len(line))
+    ranges: List[Tuple[int, int]] = []
+    line_map: Dict[int, int] = {}
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b).get_opcodes():
+        if tag == "equal":
+            line_map.update(zip(range(i1, i2), range(j1, j2)))
+        else:
+            ranges.append((max(0, j1 - margin_lines), min(len(b), j2 + margin_lines)))
+    return [(offsets[lo], offsets[hi]) for lo, hi in _merge(ranges)], line_map
+
+
+def line_numbers(text: str, offsets: List[int]) -> List[int]:
+    """Номера строк text (как у str.splitlines) для смещений."""
+    starts = _line_starts(text)
+    return [bisect_right(starts, off) - 1 for off in offsets]
+
+
+def _line_starts(text: str) -> List[int]:
+    starts = [0]
+    for line in text.splitlines(keepends=True):
+        starts.append(starts[-1] + len(line))
+    return starts
+
+
+def carry_residual(
+    residual_lines: List[Tuple[int, str]],
+    line_map: Optional[Dict[int, int]],
+    after: str,
+    regions: List[Tuple[int, int]],
+) -> Dict[str, int]:
+    """Остаточная PII прохода 1 (номер строки текста до LLM, ключ residual), которая
+    осталась в тексте после LLM: строка не изменена и лежит вне regions. Удалённые и
+    переписанные строки выпадают, строки внутри regions пересчитывает проход 2."""
+    residual = _empty_residual(False)
+    starts = _line_starts(after) if regions else []
+    region_starts = [start for start, _ in regions]
+    for line, key in residual_lines:
+        moved = line if line_map is None else line_map.get(line)
+        if moved is None:
+            continue
+        if regions:
+            at = starts[moved]
+            i = bisect_right(region_starts, at) - 1
+            if i >= 0 and at < regions[i][1]:
+                continue
+        residual[key] = residual.get(key, 0) + 1
     return residual
 
 
+def anonymize_regions(
+    text: str,
+    regions: List[Tuple[int, int]],
+    protector: SpanProtector = DEFAULT_PROTECTOR,
+    entities: Optional[Collection[str]] = None,
+    secret_detector: Optional[EntropySecretDetector] = None,
+    person_spans: Optional[List[Tuple[int, int]]] = None,
+    regex_policy: Optional[RegexPolicy] = None,
+) -> Tuple[str, AnonymizeReport]:
+    """Обезличивание только заданных интервалов (границы — по строкам).
+
+    Остальной текст считается уже обезличенным и копируется как есть. Фрагменты и
+    остаточная PII в отчёте — по этим интервалам, смещения — во входном тексте
+    (как и у person_spans — PersonDetector.find_regions по тем же интервалам).
+    """
+    counts: Dict[str, int] = {k: 0 for k in MASKS.keys()}
+    residual = _empty_residual(person_spans is not None)
+    whitelisted: Dict[str, int] = {k: 0 for k in MASKS.keys()}
+    spans: List[PiiSpan] = []
+    timeouts: List[Dict] = []
+    residual_at: List[Tuple[int, int, str]] = []
+    skipped = {name for name, _ in MASK_RULES}
+    parts: List[str] = []
+    pos = 0
+    # длина уже собранного выхода: смещения residual_at — в выходном тексте
+    out_len = 0
+    for start, end in regions:
+        parts.append(text[pos:start])
+        out_len += start - pos
+        names = None if person_spans is None else [(s - start, e - start) for s, e in person_spans if start <= s and e <= end]
+        masked, report = anonymize_text(text[start:end], protector, entities, secret_detector, names, regex_policy)
+        parts.append(masked)
+        residual_at.extend((s + out_len, e + out_len, key) for s, e, key in report.residual_at)
+        out_len += len(masked)
+        for k, v in report.counts.items():
+            counts[k] += v
+        for k, v in report.residual.items():
+            residual[k] += v
+        for k, v in report.whitelisted.items():
+            whitelisted[k] += v
+        for sp in report.spans:
+            sp.start += start
+            sp.end += start
+            spans.append(sp)
+        skipped.intersection_update(report.skipped)
+        timeouts.extend(report.timeouts)
+        pos = end
+    parts.append(text[pos:])
+    report = AnonymizeReport(
+        counts=counts, spans=spans, residual=residual, whitelisted=whitelisted, timeouts=timeouts, residual_at=residual_at
+    )
+    report.skipped = [name for name, _ in MASK_RULES if name in skipped]
+    return "".join(parts), report
+
+
+def detect_residual_pii(
+    text: str,
+    protector: SpanProtector = DEFAULT_PROTECTOR,
+    secret_detector: Optional[EntropySecretDetector] = None,
+    person_spans: Optional[List[Tuple[int, int]]] = None,
+    regex_policy: Optional[RegexPolicy] = None,
+    timeouts: Optional[List[Dict]] = None,
+) -> Dict[str, int]:
+    # Защищённые интервалы (временные метки и т.п.) не считаем: иначе метка попадает в PHONE
+    shadow = _blank(text, protector.spans(text))
+    whitelist = protector.whitelist
+    plan = _plan(text)
+    residual = {}
+    for name, pattern in MASK_RULES:
+        if name not in RESIDUAL_ENTITIES:
+            continue
+        matches = _rule_matches(name, pattern, shadow, plan[name], regex_policy, timeouts) if plan[name] != [] else []
+        if whitelist is not None:
+            value_group = _VALUE_GROUP.get(name, 0)
+            matches = [m for m in matches if not whitelist.allows(text[m.start(value_group):m.end(value_group)])]
+        residual[name] = len(matches)
+    if secret_detector is not None:
+        found = secret_detector.find(shadow)
+        if whitelist is not None:
+            found = [(start, end) for start, end in found if not whitelist.allows(text[start:end])]
+        residual["SECRET"] += len(found)
+    if person_spans is not None:
+        names = _free_spans(text, shadow, person_spans)
+        if whitelist is not None:
+            names = [(start, end) for start, end in names if not whitelist.allows(text[start:end])]
+        residual["PERSON"] = len(names)
+    return residual
+
+
+def _empty_residual(person: bool) -> Dict[str, int]:
+    residual = {k: 0 for k in RESIDUAL_ENTITIES}
+    if person:
+        residual["PERSON"] = 0
+    return residual
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Optional
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def cache_key(*parts) -> str:
+    """Ключ кэша: sha256 от JSON‑представления составных частей (порядок важен)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Персистентный кэш ответов моделей (SQLite, ключ — хэш содержимого запроса).
+
+    Соединение открывается лениво отдельно в каждом потоке/процессе, поэтому объект
+    можно передавать в пул процессов и использовать из пулов потоков. Вытеснение —
+    по возрасту записи и по объёму (наименее давно использованные уходят первыми).
+    """
+
+    def __init__(self, db_path: Path, max_entries: int = 0, max_bytes: int = 0, max_age_days: float = 0):
+        self.db_path = db_path
+        self.max_entries = int(max_entries or 0)
+        self.max_bytes = int(max_bytes or 0)
+        self.max_age_days = float(max_age_days or 0)
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        con = self._connect()
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at)")
+        con.commit()
+
+    @classmethod
+    def from_config(cls, state_dir: Path, name: str, cfg: Optional[Dict]) -> Optional["ResponseCache"]:
+        """Кэш state_dir/<name>.sqlite по секции конфига вида {enabled, max_entries, max_mb, max_age_days}."""
+        cfg = cfg or {}
+        if not cfg.get("enabled", True):
+            return None
+        return cls(
+            state_dir / f"{name}.sqlite",
+            max_entries=cfg.get("max_entries", 0),
+            max_bytes=int(float(cfg.get("max_mb", 0) or 0) * 1024 * 1024),
+            max_age_days=cfg.get("max_age_days", 0),
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_local", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def get(self, key: str) -> Optional[str]:
+        con = self._connect()
+        row = con.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.max_age_days and now - row[1] > self.max_age_days * 86400:
+            return None
+        con.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        con.commit()
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        con = self._connect()
+        con.execute(
+            "INSERT OR REPLACE INTO entries(key, value, size, created_at, accessed_at) VALUES(?,?,?,?,?)",
+            (key, value, len(value.encode("utf-8")), now, now),
+        )
+        con.commit()
+
+    def evict(self) -> int:
+        """Удаляет просроченные записи и вытесняет лишние по LRU. Возвращает число удалённых."""
+        con = self._connect()
+        removed = 0
+        if self.max_age_days:
+            cur = con.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age_days * 86400,))
+            removed += cur.rowcount
+        if self.max_entries:
+            cur = con.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            removed += cur.rowcount
+        if self.max_bytes:
+            total = con.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                rows = con.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC").fetchall()
+                doomed = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                con.executemany("DELETE FROM entries WHERE key = ?", doomed)
+                removed += len(doomed)
+        con.commit()
+        return removed
+
+    def close(self) -> None:
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
+
+
+class EncodingCache:
+    """Кодировки не‑UTF‑8 входных файлов (state_dir/encodings.sqlite).
+
+    Запись действует, пока у файла те же размер и mtime: повторный запуск не определяет
+    кодировку заново. Соединения — как у ResponseCache: лениво в каждом потоке/процессе.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        con = self._connect()
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS encodings ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " encoding TEXT NOT NULL)"
+        )
+        con.commit()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_local", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def get(self, path: Path, size: int, mtime_ns: int) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT encoding FROM encodings WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (str(path), int(size), int(mtime_ns)),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, path: Path, size: int, mtime_ns: int, encoding: str) -> None:
+        con = self._connect()
+        con.execute(
+            "INSERT OR REPLACE INTO encodings(path, size, mtime_ns, encoding) VALUES(?,?,?,?)",
+            (str(path), int(size), int(mtime_ns), encoding),
+        )
+        con.commit()
+
+    def close(self) -> None:
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
@@ -1,10 +1,21 @@
 import re
-from typing import List
+from typing import Dict, List, Optional
 
+from .safe_regex import RegexPolicy, compile_pattern
 
-def remove_templates(text: str, templates: List[str]) -> str:
-    for pattern in templates:
-        text = re.sub(pattern, "", text)
+
+def remove_templates(
+    text: str,
+    templates: List[str],
+    policy: Optional[RegexPolicy] = None,
+    timeouts: Optional[List[Dict]] = None,
+) -> str:
+    # Пользовательские шаблоны — через модуль regex; с policy у каждого свой бюджет времени
+    for i, pattern in enumerate(templates):
+        if policy is None:
+            text = compile_pattern(pattern).sub("", text)
+        else:
+            text = policy.sub(f"cleaning.remove_templates[{i}]", pattern, "", text, timeouts)
     # Очистка лишних пустых строк после вырезки
     text = re.sub(r"\n{3,}", "\n\n", text)
     return text.strip()
@@ -17,16 +28,44 @@ def normalize_lists(text: str) -> str:
     return text
 
 
-def filter_user_comments(text: str, users: List[str]) -> str:
+def user_comment_patterns(users: List[str]) -> Dict[str, str]:
+    """Шаблоны filter_user_comments по именам (для бюджетов regex.timeouts и предпроверки)."""
+    pattern_users = "|".join(re.escape(u) for u in users)
+    return {
+        # Удаление строк "user: ..."
+        "filtering.user_lines": rf"(?im)^\s*(?:{pattern_users})\s*:\s*.*$",
+        # Удаление блоков вида "Автор: user" + до следующего пустого раздела (осторожно, минимально)
+        "filtering.user_blocks": rf"(?is)(?:Автор\s*:\s*(?:{pattern_users}).*?)(?:\n\s*\n|$)",
+    }
+
+
+def configured_patterns(cfg: Dict) -> Dict[str, str]:
+    """Пользовательские шаблоны конфига по именам бюджетов regex.timeouts — для предпроверки."""
+    patterns = {
+        f"cleaning.remove_templates[{i}]": str(p)
+        for i, p in enumerate((cfg.get("cleaning") or {}).get("remove_templates") or [])
+    }
+    users = (cfg.get("filtering") or {}).get("users_to_filter") or []
+    if users:
+        patterns.update(user_comment_patterns(users))
+    return patterns
+
+
+def filter_user_comments(
+    text: str,
+    users: List[str],
+    policy: Optional[RegexPolicy] = None,
+    timeouts: Optional[List[Dict]] = None,
+) -> str:
     if not users:
         return text
     # Простая эвристика: удаляем блоки комментариев формата "Автор: <user>" до пустой строки/разделителя
     # И/или строки, начинающиеся с "<user>:". Кейс-инсенситив, нормализуем пробелы
-    pattern_users = "|".join(re.escape(u) for u in users)
-    # Удаление строк "user: ..."
-    text = re.sub(rf"(?im)^\s*(?:{pattern_users})\s*:\s*.*$", "", text)
-    # Удаление блоков вида "Автор: user" + до следующего пустого раздела (осторожно, минимально)
-    text = re.sub(rf"(?is)(?:Автор\s*:\s*(?:{pattern_users}).*?)(?:\n\s*\n|$)", "\n", text)
+    for (name, pattern), repl in zip(user_comment_patterns(users).items(), ("", "\n")):
+        if policy is None:
+            text = compile_pattern(pattern).sub(repl, text)
+        else:
+            text = policy.sub(name, pattern, repl, text, timeouts)
     text = re.sub(r"\n{3,}", "\n\n", text)
     return text.strip()
 
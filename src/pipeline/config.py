@@ -1,7 +1,12 @@
 from pathlib import Path
 from typing import Any, Dict
+import warnings
 from ruamel.yaml import YAML
 
+from .clean import configured_patterns
+from .dedup import MAX_N_GRAMS
+from .safe_regex import DEFAULT_TIMEOUT_SEC, preflight
+
 
 def load_pipeline_config(path: Path) -> Dict[str, Any]:
     yaml = YAML(typ="safe")
@@ -9,6 +14,7 @@ def load_pipeline_config(path: Path) -> Dict[str, Any]:
         data = yaml.load(f) or {}
     # Минимальные значения по умолчанию
     data.setdefault("io", {})
+    data.setdefault("execution", {"workers": 1, "io_pipeline": False})
     data.setdefault("formatting", {})
     data.setdefault("cleaning", {})
     data.setdefault("metadata", {})
@@ -28,6 +34,10 @@ def load_pipeline_config(path: Path) -> Dict[str, Any]:
         # Ретраи при временных ошибках/пустых ответах
         "retry_count": 2,
         "retry_backoff_sec": 2.0,
+        # Одновременных запросов к vision‑модели в режиме execution.io_pipeline
+        "concurrency": 2,
+        # Кэш пояснений в state/vision_cache.sqlite: ключ — sha256 изображения, модель и версия промпта
+        "cache": {"enabled": True, "max_age_days": 365},
         # Фолбэк‑модели (по порядку), используются если основная вернула ошибку
         "fallback_models": [
             "qwen/qwen2.5-vl-7b-instruct:free",
@@ -35,6 +45,40 @@ def load_pipeline_config(path: Path) -> Dict[str, Any]:
         ],
     })
     data.setdefault("validation", {})
+    # Бюджеты времени регулярных выражений и предпроверка шаблонов конфига
+    data.setdefault("regex", {})
+    data["regex"].setdefault("timeout_sec", DEFAULT_TIMEOUT_SEC)
+    data["regex"].setdefault("on_timeout", "skip")
+    data["regex"].setdefault("preflight", "warn")
+    check_regex_patterns(data)
+    check_dedup(data)
     return data
 
 
+def check_dedup(cfg: Dict[str, Any]) -> None:
+    """dedup.n_grams — от 1 до MAX_N_GRAMS: более длинные шинглы не поддерживаются, ValueError."""
+    n_grams = (cfg.get("dedup") or {}).get("n_grams", 5)
+    try:
+        ok = 1 <= int(n_grams) <= MAX_N_GRAMS
+    except (TypeError, ValueError):
+        ok = False
+    if not ok:
+        raise ValueError(f"dedup.n_grams: от 1 до {MAX_N_GRAMS}, получено {n_grams!r}")
+
+
+def check_regex_patterns(cfg: Dict[str, Any]) -> None:
+    """Предпроверка шаблонов cleaning.remove_templates и filtering.users_to_filter:
+    regex.preflight warn — предупреждение, fail — ValueError, off — без проверки."""
+    mode = str(cfg["regex"].get("preflight", "warn")).lower()
+    if mode == "off":
+        return
+    findings = preflight(configured_patterns(cfg))
+    if not findings:
+        return
+    lines = [f"{f['name']}: {f['problem']} — {f['detail']} ({f['pattern']})" for f in findings]
+    message = "опасные регулярные выражения в конфиге:\n" + "\n".join(lines)
+    if mode == "fail":
+        raise ValueError(message)
+    warnings.warn(message, stacklevel=3)
+
+
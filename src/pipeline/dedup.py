@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from itertools import combinations
 from pathlib import Path
+import json
 import re
 import sqlite3
-from typing import Optional
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 import hashlib
 
+import numpy as np
+
 
 def canonicalize(text: str) -> str:
     text = text.lower()
@@ -16,17 +22,38 @@ def canonicalize(text: str) -> str:
     return text.strip()
 
 
-def simhash_value(text: str) -> int:
-    """Безопасный 64-битный simhash для текста.
-    Токены приводятся к md5, используем нижние 64 бита, агрегируем по битам.
+# Хэш токена для simhash. fnv1a64_fmix — FNV-1a 64 по байтам UTF-8 с финализатором fmix64
+# (без него у коротких токенов почти не меняются старшие биты), считается numpy по всем
+# токенам сразу; md5 — нижние 64 бита md5 (прежние отпечатки, хэшлиб на каждый токен)
+SIMHASH_HASHES = ("fnv1a64_fmix", "md5")
+DEFAULT_SIMHASH_HASH = "fnv1a64_fmix"
+_FNV_OFFSET = 0xCBF29CE484222325
+_FNV_PRIME = 0x100000001B3
+_FMIX_C1 = 0xFF51AFD7ED558CCD
+_FMIX_C2 = 0xC4CEB9FE1A85EC53
+_MASK64 = (1 << 64) - 1
+# Пока токенов длиннее текущей позиции меньше, чем столько, они дохэшируются в Python
+_FNV_VECTOR_MIN = 64
+# Сколько уникальных хэшей раскладывать на биты за один шаг (матрица x 64 байт)
+_TOKEN_BATCH = 65536
+
+
+def simhash_reference(text: str, token_hash: str = DEFAULT_SIMHASH_HASH) -> int:
+    """Эталонный 64-битный simhash: по нему проверяется simhash_batch.
+
+    Токены — text.split(), байты — UTF-8 без непредставимых символов. Хэш токена:
+    fnv1a64_fmix — h = 0xcbf29ce484222325, для каждого байта h = ((h ^ байт) * 0x100000001b3)
+    mod 2^64, затем fmix64 из MurmurHash3 (h ^= h >> 33; h *= 0xff51afd7ed558ccd;
+    h ^= h >> 33; h *= 0xc4ceb9fe1a85ec53; h ^= h >> 33, умножения mod 2^64);
+    md5 — нижние 64 бита md5. Бит i отпечатка установлен, если у токенов (с повторами)
+    бит i хэша установлен не реже, чем сброшен (при равенстве — установлен). Нет токенов — 0.
     """
     tokens = text.split()
     if not tokens:
         return 0
     bits = [0] * 64
     for t in tokens:
-        h128 = int(hashlib.md5(t.encode('utf-8', errors='ignore')).hexdigest(), 16)
-        h = h128 & ((1 << 64) - 1)
+        h = _token_hash(t.encode("utf-8", errors="ignore"), token_hash)
         for i in range(64):
             if (h >> i) & 1:
                 bits[i] += 1
@@ -39,63 +66,657 @@ def simhash_value(text: str) -> int:
     return fingerprint
 
 
+def simhash_value(text: str, token_hash: str = DEFAULT_SIMHASH_HASH) -> int:
+    """64-битный simhash текста (совпадает с simhash_reference бит в бит)."""
+    return simhash_batch([text], token_hash)[0]
+
+
+def simhash_batch(texts: List[str], token_hash: str = DEFAULT_SIMHASH_HASH) -> List[int]:
+    """simhash сразу для нескольких текстов.
+
+    Токены всех текстов собираются в один буфер байтов и хэшируются за один проход
+    (fnv1a64_fmix — numpy по всем токенам сразу). Голоса по битам — матрично: число
+    установленных битов i в документе — произведение вектора повторов хэшей на матрицу
+    битов этих хэшей.
+    """
+    if token_hash not in SIMHASH_HASHES:
+        raise ValueError(f"неизвестный хэш токенов simhash: {token_hash}")
+    counts: List[int] = []
+    chunks: List[bytes] = []
+    for text in texts:
+        tokens = text.split()
+        counts.append(len(tokens))
+        if tokens:
+            chunks.append(" ".join(tokens).encode("utf-8", errors="ignore"))
+    if not chunks:
+        return [0] * len(texts)
+    # Токены без пробельных символов: границы в буфере — пробелы (пустой токен — два пробела подряд)
+    data = np.frombuffer(b" ".join(chunks), dtype=np.uint8)
+    spaces = np.flatnonzero(data == 32)
+    starts = np.concatenate(([0], spaces + 1))
+    lengths = np.concatenate((spaces, [len(data)])) - starts
+    if token_hash == "fnv1a64_fmix":
+        hashes = _fmix64(_fnv1a64_batch(data, starts, lengths))
+    else:
+        raw = data.tobytes()
+        hashes = np.fromiter(
+            (_token_hash(raw[a:a + n], "md5") for a, n in zip(starts.tolist(), lengths.tolist())),
+            dtype=np.uint64,
+            count=len(starts),
+        )
+    out: List[int] = []
+    pos = 0
+    for n in counts:
+        if not n:
+            out.append(0)
+            continue
+        uniq, repeats = np.unique(hashes[pos:pos + n], return_counts=True)
+        pos += n
+        ones = np.zeros(64, dtype=np.int64)
+        for lo in range(0, len(uniq), _TOKEN_BATCH):
+            ones += np.einsum("i,ij->j", repeats[lo:lo + _TOKEN_BATCH], _hash_bits(uniq[lo:lo + _TOKEN_BATCH]))
+        # установленных не меньше, чем сброшенных: ones >= n - ones
+        packed = np.packbits(2 * ones >= n, bitorder="little")
+        out.append(int.from_bytes(packed.tobytes(), "little"))
+    return out
+
+
+def _token_hash(data: bytes, token_hash: str) -> int:
+    if token_hash == "md5":
+        return int.from_bytes(hashlib.md5(data).digest()[8:], "big")
+    h = _FNV_OFFSET
+    for byte in data:
+        h = ((h ^ byte) * _FNV_PRIME) & _MASK64
+    h ^= h >> 33
+    h = (h * _FMIX_C1) & _MASK64
+    h ^= h >> 33
+    h = (h * _FMIX_C2) & _MASK64
+    return h ^ (h >> 33)
+
+
+def _fnv1a64_batch(data: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """FNV-1a 64 для токенов data[start:start + length]: шаг по позиции байта сразу для всех токенов не короче.
+
+    Токены упорядочены по убыванию длины, поэтому на позиции j активен префикс массива.
+    Хвост немногих длинных токенов (base64, хэши) досчитывается поштучно.
+    """
+    order = np.argsort(-lengths, kind="stable")
+    starts, lengths = starts[order], lengths[order]
+    h = np.full(len(order), _FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(_FNV_PRIME)
+    neg = -lengths
+    for j in range(int(lengths[0]) if len(lengths) else 0):
+        active = int(np.searchsorted(neg, -j, side="left"))
+        if active < _FNV_VECTOR_MIN:
+            raw = data.tobytes()
+            for k in range(active):
+                value = int(h[k])
+                for byte in raw[starts[k] + j:starts[k] + lengths[k]]:
+                    value = ((value ^ byte) * _FNV_PRIME) & _MASK64
+                h[k] = value
+            break
+        h[:active] ^= data[starts[:active] + j]
+        h[:active] *= prime
+    out = np.empty_like(h)
+    out[order] = h
+    return out
+
+
+def _fmix64(h: np.ndarray) -> np.ndarray:
+    shift = np.uint64(33)
+    h = h ^ (h >> shift)
+    h *= np.uint64(_FMIX_C1)
+    h ^= h >> shift
+    h *= np.uint64(_FMIX_C2)
+    return h ^ (h >> shift)
+
+
+def _hash_bits(hashes: np.ndarray) -> np.ndarray:
+    """Матрица битов хэшей (len x 64, uint8): столбец i — бит i."""
+    return np.unpackbits(hashes.astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+
+
+# MinHash: универсальное хэширование (a·x + b) mod p над 32-битными хэшами шинглов.
+# a, b < 2^32 и x < 2^32, поэтому a·x + b помещается в uint64 без переполнения
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_MINHASH_SEED = 1
+# Сколько шинглов обрабатывать за один шаг: матрица num_perm x _SHINGLE_BATCH
+_SHINGLE_BATCH = 4096
+# Множители позиций слова в шингле (нечётные 64-битные константы)
+_POSITION_MULTIPLIERS = (
+    0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+    0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9,
+)
+# Наибольшая длина шингла (dedup.n_grams) — по одному множителю на позицию слова
+MAX_N_GRAMS = len(_POSITION_MULTIPLIERS)
+
+
+def shingle_hashes(text: str, n_grams: int = 5) -> np.ndarray:
+    """32-битные хэши словесных n-грамм канонизированного текста (без повторов).
+
+    Хэш слова — blake2b (по разу на словарь документа), хэш шингла — сумма хэшей слов
+    с множителями позиций по модулю 2^64, старшие 32 бита. Текст короче n слов — один шингл.
+    n_grams — от 1 до MAX_N_GRAMS (8), иначе ValueError.
+    """
+    n_grams = _check_n_grams(n_grams)
+    tokens = text.split()
+    if not tokens:
+        return np.zeros(0, dtype=np.uint64)
+    n = min(n_grams, len(tokens))
+    vocab: Dict[str, int] = {}
+    ids = np.fromiter((vocab.setdefault(t, len(vocab)) for t in tokens), dtype=np.int64, count=len(tokens))
+    word_hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(w.encode("utf-8", errors="ignore"), digest_size=8).digest(), "little") for w in vocab),
+        dtype=np.uint64,
+        count=len(vocab),
+    )[ids]
+    count = len(tokens) - n + 1
+    acc = np.zeros(count, dtype=np.uint64)
+    for j in range(n):
+        acc += word_hashes[j:j + count] * np.uint64(_POSITION_MULTIPLIERS[j])
+    return np.unique(acc >> np.uint64(32))
+
+
+def _check_n_grams(n_grams: int) -> int:
+    n = int(n_grams)
+    if not 1 <= n <= MAX_N_GRAMS:
+        raise ValueError(f"dedup.n_grams: от 1 до {MAX_N_GRAMS}, получено {n_grams}")
+    return n
+
+
+class Fingerprinter:
+    """Отпечатки документа для индекса дубликатов: simhash и (если включён) MinHash.
+
+    Подпись MinHash — минимумы num_perm перестановок по множеству шинглов; перестановки
+    применяются матрично, пачками по _SHINGLE_BATCH шинглов. Параметры перестановок
+    фиксированы (seed), поэтому подписи из state_dir сравнимы между запусками.
+    Длина шингла n_grams — не больше MAX_N_GRAMS.
+    """
+
+    def __init__(self, n_grams: int = 5, num_perm: int = 128, minhash: bool = True, simhash_hash: str = DEFAULT_SIMHASH_HASH):
+        self.n_grams = _check_n_grams(n_grams)
+        # Хэш токенов simhash задаёт индекс: отпечатки сравнимы только при одном хэше
+        self.simhash_hash = simhash_hash
+        self.num_perm = int(num_perm)
+        self.minhash = bool(minhash)
+        rng = np.random.RandomState(_MINHASH_SEED)
+        self._a = rng.randint(1, 1 << 32, size=self.num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.randint(0, 1 << 32, size=self.num_perm, dtype=np.uint64)[:, None]
+
+    @classmethod
+    def from_config(cls, dedup_cfg: Dict) -> "Fingerprinter":
+        return cls(
+            n_grams=dedup_cfg.get("n_grams", 5),
+            num_perm=dedup_cfg.get("minhash_num_perm", 128),
+            minhash=bool(dedup_cfg.get("minhash_jaccard_threshold") or 0),
+        )
+
+    def fingerprint(self, text: str) -> "DedupFingerprint":
+        canon = canonicalize(text)
+        signature = self.signature(canon) if self.minhash else None
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        canonical_hash = hashlib.sha256(canon.encode("utf-8")).digest()
+        return DedupFingerprint(key, simhash_value(canon, self.simhash_hash), signature, canonical_hash)
+
+    def signature(self, canon: str) -> Optional[np.ndarray]:
+        """Подпись MinHash канонизированного текста (uint32 x num_perm); None — нет слов."""
+        shingles = shingle_hashes(canon, self.n_grams)
+        if not len(shingles):
+            return None
+        mins = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        for lo in range(0, len(shingles), _SHINGLE_BATCH):
+            batch = shingles[lo:lo + _SHINGLE_BATCH][None, :]
+            permuted = ((self._a * batch + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+            np.minimum(mins, permuted.min(axis=1), out=mins)
+        return mins.astype(np.uint32)
+
+
+@dataclass
+class DedupFingerprint:
+    """Отпечатки документа: считаются в CPU‑стадии, сверяются с индексом в родителе."""
+
+    # sha256 текста — идентификатор документа в индексе и группе дубликатов
+    key: str
+    simhash: int
+    minhash: Optional[np.ndarray] = None
+    # sha256 канонизированного текста: точные дубликаты находятся до поиска по simhash/MinHash
+    canonical_hash: Optional[bytes] = None
+
+
 @dataclass
 class DedupDecision:
     is_duplicate: bool
     canonical_id: Optional[str]
+    # Для дубликата: исходный файл канонического документа и чем найдено сходство —
+    # bytes (побайтовая копия файла), canonical (тот же канонизированный текст),
+    # simhash (distance — расстояние Хэмминга) или minhash (similarity — оценка Жаккара)
+    canonical_path: Optional[str] = None
+    distance: Optional[int] = None
+    method: Optional[str] = None
+    similarity: Optional[float] = None
+
+
+class SimhashBands:
+    """Раскладка 64-битного отпечатка на блоки для поиска в пределах threshold_bits.
+
+    Отпечаток делится на m = threshold_bits + 2 блока (не меньше 3). Если отпечатки
+    отличаются не больше чем в threshold_bits битах, различия задевают не больше
+    threshold_bits блоков, и хотя бы два блока совпадают целиком. Ключ — пара блоков
+    с номером пары, всего C(m, 2) ключей на отпечаток; поиск кандидатов — точные
+    совпадения ключей по индексу, расстояние проверяется только у них.
+    """
+
+    def __init__(self, threshold_bits: int):
+        self.threshold_bits = max(0, int(threshold_bits))
+        blocks = max(self.threshold_bits + 2, 3)
+        self.widths = [64 // blocks + (1 if i < 64 % blocks else 0) for i in range(blocks)]
+        self.shifts = [sum(self.widths[:i]) for i in range(blocks)]
+        self.pairs = list(combinations(range(blocks), 2))
+        # номер пары — в старших битах ключа, над двумя блоками
+        self._pair_shift = 2 * max(self.widths)
+
+    @property
+    def layout(self) -> str:
+        return f"pairs:{len(self.widths)}"
+
+    def keys(self, fingerprint: int) -> List[int]:
+        blocks = [(fingerprint >> s) & ((1 << w) - 1) for s, w in zip(self.shifts, self.widths)]
+        return [
+            (n << self._pair_shift) | (blocks[a] << self.widths[b]) | blocks[b]
+            for n, (a, b) in enumerate(self.pairs)
+        ]
+
+
+class MinHashBands:
+    """LSH по подписи MinHash: b полос по r значений, ключ — номер полосы и хэш её значений.
+
+    b и r подбираются datasketch под порог Жаккара и число перестановок (минимум
+    ложных срабатываний и пропусков); кандидаты проверяются оценкой сходства подписей.
+    """
+
+    def __init__(self, threshold: float, num_perm: int):
+        from datasketch import MinHashLSH
+
+        self.threshold = float(threshold)
+        self.num_perm = int(num_perm)
+        lsh = MinHashLSH(threshold=self.threshold, num_perm=self.num_perm)
+        self.b, self.r = int(lsh.b), int(lsh.r)
+
+    @property
+    def layout(self) -> str:
+        return f"{self.num_perm}:{self.b}x{self.r}"
+
+    def keys(self, signature: np.ndarray) -> List[int]:
+        return [
+            (band << 56) | int.from_bytes(
+                hashlib.blake2b(signature[band * self.r:(band + 1) * self.r].tobytes(), digest_size=7).digest(), "little"
+            )
+            for band in range(self.b)
+        ]
 
 
 class DedupIndex:
-    def __init__(self, state_dir: Path):
-        self.db_path = state_dir / "fingerprints.sqlite"
-        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+    """Индекс отпечатков в state_dir/fingerprints.sqlite.
+
+    Одна строка на исходный файл (повторная обработка файла обновляет её, и сам с собой
+    файл дубликатом не считается). Ключи блоков simhash (SimhashBands) и полос MinHash
+    (MinHashBands) — в таблицах с индексом: поиск читает только кандидатов с общими
+    ключами, а не все отпечатки. Каждый добавленный документ дописывается в базу,
+    индекс не перестраивается между запусками. state_dir=None — индекс в памяти (dry-run).
+    Хэш токенов simhash фиксируется в meta при создании базы, fingerprinter следует ему.
+
+    Точные дубликаты — по sha256 сырых байтов файла (kind raw) и канонизированного текста
+    (kind canonical) в таблице exact_hashes: один поиск по первичному ключу. Индекс общий
+    для главного потока (побайтовые копии до обработки) и стадии dedup — под блокировкой.
+
+    Одно соединение на весь запуск, WAL. Записи копятся в открытой транзакции и фиксируются
+    пачками — каждые commit_every документов или commit_interval_sec секунд. Писатель один:
+    родительский процесс (в процессы‑воркеры индекс не передаётся). Транзакция пачки
+    открывается как BEGIN IMMEDIATE до поиска, поэтому проверка и добавление атомарны и
+    для другого запуска с тем же state_dir: его запись ждёт фиксации пачки (timeout 30 с).
+
+    Прежняя таблица documents (simhash строкой, path пустой) переносится при открытии.
+    Значения от 2^63, которые SQLite сохранил как REAL с потерей младших битов, не
+    переносятся. У перенесённых строк нет исходного файла: первый документ в пределах
+    порога считается тем же документом и занимает строку, а не становится дубликатом.
+    """
+
+    def __init__(
+        self,
+        state_dir: Optional[Path],
+        threshold_bits: int = 4,
+        jaccard_threshold: float = 0.0,
+        fingerprinter: Optional[Fingerprinter] = None,
+        commit_every: int = 200,
+        commit_interval_sec: float = 5.0,
+    ):
+        if state_dir is None:
+            self.db_path = None
+            self._con = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            self.db_path = state_dir / "fingerprints.sqlite"
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # Индекс живёт весь запуск; обращения идут из одного потока за раз (self._lock)
+            self._con = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute("PRAGMA synchronous=NORMAL")
+        self.commit_every = commit_every
+        self.commit_interval_sec = commit_interval_sec
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self.fingerprinter = fingerprinter or Fingerprinter(minhash=bool(jaccard_threshold))
+        self.bands = SimhashBands(threshold_bits)
+        self.minhash_bands = (
+            MinHashBands(jaccard_threshold, self.fingerprinter.num_perm)
+            if jaccard_threshold and self.fingerprinter.minhash
+            else None
+        )
+        self._lock = threading.Lock()
+        self._lookup_sql = (
+            "SELECT s.id, s.doc_id, s.path, s.simhash FROM simhash_bands b"
+            " JOIN simhashes s ON s.id = b.doc"
+            f" WHERE b.key IN ({','.join('?' * len(self.bands.pairs))})"
+        )
         self._ensure_schema()
 
+    @classmethod
+    def from_config(cls, state_dir: Optional[Path], dedup_cfg: Dict) -> "DedupIndex":
+        return cls(
+            state_dir,
+            threshold_bits=int(dedup_cfg.get("simhash_threshold_bits", 4)),
+            jaccard_threshold=float(dedup_cfg.get("minhash_jaccard_threshold") or 0),
+            fingerprinter=Fingerprinter.from_config(dedup_cfg),
+        )
+
+    def __getstate__(self):
+        raise TypeError("DedupIndex не передаётся в другие процессы: писатель индекса — родительский процесс")
+
     def _ensure_schema(self):
-        con = sqlite3.connect(self.db_path)
-        try:
-            con.execute(
-                "CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, simhash TEXT, path TEXT)"
+        con = self._con
+        # path — исходный файл; NULL только у строк, перенесённых из таблицы documents
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS simhashes ("
+            " id INTEGER PRIMARY KEY,"
+            " doc_id TEXT NOT NULL,"
+            " path TEXT UNIQUE,"
+            " simhash INTEGER NOT NULL)"
+        )
+        if any(row[1] == "path" and row[3] for row in con.execute("PRAGMA table_info(simhashes)")):
+            # Базы, где path был NOT NULL: таблица пересоздаётся с теми же id
+            con.execute("CREATE TABLE simhashes_new (id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, path TEXT UNIQUE, simhash INTEGER NOT NULL)")
+            con.execute("INSERT INTO simhashes_new(id, doc_id, path, simhash) SELECT id, doc_id, path, simhash FROM simhashes")
+            con.execute("DROP TABLE simhashes")
+            con.execute("ALTER TABLE simhashes_new RENAME TO simhashes")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS simhash_bands ("
+            " key INTEGER NOT NULL,"
+            " doc INTEGER NOT NULL,"
+            " PRIMARY KEY (key, doc)) WITHOUT ROWID"
+        )
+        con.execute("CREATE TABLE IF NOT EXISTS minhashes (doc INTEGER PRIMARY KEY, signature BLOB NOT NULL)")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS minhash_bands ("
+            " key INTEGER NOT NULL,"
+            " doc INTEGER NOT NULL,"
+            " PRIMARY KEY (key, doc)) WITHOUT ROWID"
+        )
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS exact_hashes ("
+            " kind TEXT NOT NULL,"
+            " hash BLOB NOT NULL,"
+            " doc INTEGER NOT NULL,"
+            " PRIMARY KEY (kind, hash)) WITHOUT ROWID"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS exact_hashes_doc ON exact_hashes(doc)")
+        con.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        simhash_hash = self._layout("simhash_hash")
+        if simhash_hash is None:
+            # Отпечатки, записанные до выбора хэша (и в прежней таблице documents), посчитаны
+            # по md5 — база остаётся на нём, чтобы они оставались сравнимы с новыми
+            has_rows = con.execute("SELECT 1 FROM simhashes LIMIT 1").fetchone() is not None
+            legacy = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'documents'").fetchone()
+            has_rows = has_rows or (legacy is not None and con.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is not None)
+            simhash_hash = "md5" if has_rows else DEFAULT_SIMHASH_HASH
+            con.execute("INSERT OR REPLACE INTO meta(name, value) VALUES('simhash_hash', ?)", (simhash_hash,))
+        self.fingerprinter.simhash_hash = simhash_hash
+        if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'documents'").fetchone():
+            self._migrate_documents()
+        if self._layout("band_layout") != self.bands.layout:
+            # Порог изменился — ключи пересчитываются по сохранённым отпечаткам
+            rows = [
+                (key, doc)
+                for doc, sh in con.execute("SELECT id, simhash FROM simhashes").fetchall()
+                for key in self.bands.keys(_unsigned(sh))
+            ]
+            self._rebuild("simhash_bands", rows, "band_layout", self.bands.layout)
+        if self.minhash_bands is not None and self._layout("minhash_layout") != self.minhash_bands.layout:
+            num_perm = self.fingerprinter.num_perm
+            stored = self._layout("minhash_layout")
+            if stored is not None and not stored.startswith(f"{num_perm}:"):
+                # Другое число перестановок — прежние подписи несравнимы (текстов для пересчёта нет)
+                con.execute("DELETE FROM minhashes")
+            rows = [
+                (key, doc)
+                for doc, blob in con.execute("SELECT doc, signature FROM minhashes").fetchall()
+                for key in self.minhash_bands.keys(np.frombuffer(blob, dtype=np.uint32))
+            ]
+            self._rebuild("minhash_bands", rows, "minhash_layout", self.minhash_bands.layout)
+        con.commit()
+
+    def _migrate_documents(self) -> None:
+        """Перенос прежней таблицы documents(doc_id, simhash, path) в simhashes; ключи блоков — пересчётом."""
+        con = self._con
+        rows: List[Tuple[str, int]] = []
+        lossy = 0
+        for doc_id, value in con.execute("SELECT doc_id, simhash FROM documents").fetchall():
+            if isinstance(value, str) and value.strip().isdigit():
+                value = int(value)
+            if not isinstance(value, int) or not 0 <= value < (1 << 64):
+                # REAL (значение от 2^63, младшие биты потеряны), NULL, мусор
+                lossy += 1
+                continue
+            rows.append((doc_id, _signed(value)))
+        con.executemany("INSERT INTO simhashes(doc_id, path, simhash) VALUES(?, NULL, ?)", rows)
+        con.execute("DROP TABLE documents")
+        con.execute(
+            "INSERT OR REPLACE INTO meta(name, value) VALUES('legacy_documents', ?)",
+            (json.dumps({"migrated": len(rows), "skipped_lossy": lossy}),),
+        )
+        # Ключи блоков пересчитываются по всем отпечаткам, включая перенесённые
+        con.execute("DELETE FROM meta WHERE name = 'band_layout'")
+
+    def _layout(self, name: str) -> Optional[str]:
+        row = self._con.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _rebuild(self, table: str, rows: List[Tuple[int, int]], layout_name: str, layout: str) -> None:
+        self._con.execute(f"DELETE FROM {table}")
+        rows.sort()
+        self._con.executemany(f"INSERT OR IGNORE INTO {table}(key, doc) VALUES(?, ?)", rows)
+        self._con.execute("INSERT OR REPLACE INTO meta(name, value) VALUES(?, ?)", (layout_name, layout))
+
+    def find_exact(self, kind: str, digest: bytes, exclude_path: Optional[str] = None) -> Optional[DedupDecision]:
+        """Документ с тем же хэшем (kind: raw — сырые байты, canonical — канонизированный текст)."""
+        row = self._con.execute(
+            "SELECT s.doc_id, s.path FROM exact_hashes e JOIN simhashes s ON s.id = e.doc"
+            " WHERE e.kind = ? AND e.hash = ?",
+            (kind, digest),
+        ).fetchone()
+        if row is None or row[1] == exclude_path:
+            return None
+        return DedupDecision(True, row[0], row[1], 0, method="bytes" if kind == "raw" else "canonical")
+
+    def check_raw(self, digest: bytes, path: str) -> Optional[DedupDecision]:
+        """Побайтовая копия уже проиндексированного файла (до чтения и обработки); в индекс не пишет."""
+        with self._lock:
+            return self.find_exact("raw", digest, exclude_path=path)
+
+    def find(self, fingerprint: int, exclude_path: Optional[str] = None) -> Optional[DedupDecision]:
+        """Ближайший отпечаток simhash в пределах порога (при равенстве — записанный раньше)."""
+        best = None
+        for doc, doc_id, path, sh in self._con.execute(self._lookup_sql, self.bands.keys(fingerprint)):
+            if path is None or path == exclude_path:
+                continue
+            dist = hamming_distance(fingerprint, _unsigned(sh))
+            if dist <= self.bands.threshold_bits and (best is None or (dist, doc) < best[0]):
+                best = ((dist, doc), doc_id, path)
+        if best is None:
+            return None
+        return DedupDecision(True, best[1], best[2], best[0][0], method="simhash")
+
+    def find_minhash(self, signature: np.ndarray, exclude_path: Optional[str] = None) -> Optional[DedupDecision]:
+        """Документ с наибольшей оценкой сходства Жаккара не ниже порога среди кандидатов LSH."""
+        if self.minhash_bands is None:
+            return None
+        keys = self.minhash_bands.keys(signature)
+        rows = self._con.execute(
+            "SELECT s.id, s.doc_id, s.path, m.signature FROM minhash_bands b"
+            " JOIN minhashes m ON m.doc = b.doc JOIN simhashes s ON s.id = b.doc"
+            f" WHERE b.key IN ({','.join('?' * len(keys))}) GROUP BY s.id",
+            keys,
+        ).fetchall()
+        best = None
+        for doc, doc_id, path, blob in rows:
+            if path == exclude_path:
+                continue
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= self.minhash_bands.threshold and (best is None or (-similarity, doc) < best[0]):
+                best = ((-similarity, doc), doc_id, path)
+        if best is None:
+            return None
+        return DedupDecision(True, best[1], best[2], method="minhash", similarity=round(-best[0][0], 4))
+
+    def check(self, fp: DedupFingerprint, path: str, raw_hash: Optional[bytes] = None) -> DedupDecision:
+        """Дубликат ли документ уже проиндексированного; если нет — документ добавляется.
+
+        Сначала точное совпадение канонизированного текста, затем simhash, затем MinHash.
+        Дубликаты в индекс не попадают: каноническим остаётся первый документ группы.
+        """
+        with self._lock:
+            self._begin()
+            found = self.find_exact("canonical", fp.canonical_hash, exclude_path=path) if fp.canonical_hash else None
+            if found is None:
+                found = self.find(fp.simhash, exclude_path=path)
+            if found is None and fp.minhash is not None:
+                found = self.find_minhash(fp.minhash, exclude_path=path)
+            if found is not None:
+                self._tick()
+                return found
+            legacy = self._find_legacy(fp.simhash)
+            if legacy is not None:
+                # Перенесённая строка без исходного файла — этот же документ из прежних запусков
+                self._con.execute("DELETE FROM simhash_bands WHERE doc = ?", (legacy,))
+                self._con.execute("DELETE FROM simhashes WHERE id = ?", (legacy,))
+            self.add(fp.key, fp.simhash, path, fp.minhash, raw_hash, fp.canonical_hash)
+        return DedupDecision(False, fp.key)
+
+    def _find_legacy(self, fingerprint: int) -> Optional[int]:
+        """Ближайшая перенесённая строка (без path) в пределах порога."""
+        best = None
+        for doc, _, path, sh in self._con.execute(self._lookup_sql, self.bands.keys(fingerprint)):
+            if path is not None:
+                continue
+            dist = hamming_distance(fingerprint, _unsigned(sh))
+            if dist <= self.bands.threshold_bits and (best is None or (dist, doc) < best):
+                best = (dist, doc)
+        return best[1] if best is not None else None
+
+    def add(
+        self,
+        doc_id: str,
+        fingerprint: int,
+        path: str,
+        signature: Optional[np.ndarray] = None,
+        raw_hash: Optional[bytes] = None,
+        canonical_hash: Optional[bytes] = None,
+    ) -> None:
+        con = self._con
+        self._begin()
+        row = con.execute("SELECT id FROM simhashes WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            for table in ("simhash_bands", "minhash_bands", "minhashes", "exact_hashes"):
+                con.execute(f"DELETE FROM {table} WHERE doc = ?", (row[0],))
+            con.execute("DELETE FROM simhashes WHERE id = ?", (row[0],))
+        cur = con.execute(
+            "INSERT INTO simhashes(doc_id, path, simhash) VALUES(?, ?, ?)", (doc_id, path, _signed(fingerprint))
+        )
+        doc = cur.lastrowid
+        con.executemany(
+            "INSERT OR IGNORE INTO exact_hashes(kind, hash, doc) VALUES(?, ?, ?)",
+            [(kind, digest, doc) for kind, digest in (("raw", raw_hash), ("canonical", canonical_hash)) if digest is not None],
+        )
+        con.executemany(
+            "INSERT OR IGNORE INTO simhash_bands(key, doc) VALUES(?, ?)",
+            [(key, doc) for key in self.bands.keys(fingerprint)],
+        )
+        if signature is not None and self.minhash_bands is not None:
+            con.execute("INSERT INTO minhashes(doc, signature) VALUES(?, ?)", (doc, signature.astype(np.uint32).tobytes()))
+            con.executemany(
+                "INSERT OR IGNORE INTO minhash_bands(key, doc) VALUES(?, ?)",
+                [(key, doc) for key in self.minhash_bands.keys(signature)],
             )
-            # Простейшая миграция: гарантировать, что столбцы соответствуют ожиданиям
-            # (если старая схема, создаем временную таблицу и переносим данные)
-        finally:
-            con.close()
+        self._tick()
 
-    def check_and_add(self, doc_id: str, text: str, policy: str = "drop") -> DedupDecision:
-        canon = canonicalize(text)
-        sh = simhash_value(canon)
-        con = sqlite3.connect(self.db_path)
+    def check_and_add(self, doc_id: str, text: str, policy: str = "drop", path: str = "") -> DedupDecision:
+        fp = self.fingerprinter.fingerprint(text)
+        fp.key = doc_id
+        return self.check(fp, path or doc_id)
+
+    def _begin(self) -> None:
+        if not self._con.in_transaction:
+            self._con.execute("BEGIN IMMEDIATE")
+
+    def _tick(self) -> None:
+        self._pending += 1
+        if self._pending >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval_sec:
+            self._commit()
+
+    def _commit(self) -> None:
+        self._con.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def flush_if_due(self) -> None:
+        """Фиксация пачки по времени, пока новых документов нет (не держать блокировку записи)."""
+        with self._lock:
+            if self._con.in_transaction and time.monotonic() - self._last_commit >= self.commit_interval_sec:
+                self._commit()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM simhashes").fetchone()[0]
+
+    def close(self) -> None:
         try:
-            cur = con.execute("SELECT doc_id, simhash FROM documents")
-            for row in cur.fetchall():
-                try:
-                    other_id = row[0]
-                    other_sh = row[1]
-                except Exception:
-                    continue
-                try:
-                    other_sh_int = int(other_sh)
-                except Exception:
-                    continue
-                if hamming_distance(sh, other_sh_int) <= 4:  # порог из конфига можно добавить
-                    return DedupDecision(True, other_id)
-            con.execute(
-                "INSERT OR REPLACE INTO documents(doc_id, simhash, path) VALUES(?,?,?)",
-                (doc_id, str(int(sh)), ""),
-            )
-            con.commit()
-            return DedupDecision(False, doc_id)
+            self.flush()
         finally:
-            con.close()
+            self._con.close()
+
+
+def write_clusters_report(reports_dir: Path, run_id: str, clusters: Dict[str, Dict]) -> Path:
+    """Группы дубликатов запуска: канонический документ и найденные к нему дубликаты."""
+    out = reports_dir / "dedup" / f"{run_id}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    payload = {"run_id": run_id, "clusters": sorted(clusters.values(), key=lambda c: c["canonical_path"] or "")}
+    out.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    return out
+
+
+def _signed(value: int) -> int:
+    """Беззнаковый 64-битный отпечаток → INTEGER SQLite (знаковый 64-битный)."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _unsigned(value: int) -> int:
+    return value & ((1 << 64) - 1)
 
 
 def hamming_distance(a: int, b: int) -> int:
-    x = a ^ b
-    count = 0
-    while x:
-        x &= x - 1
-        count += 1
-    return count
+    return (a ^ b).bit_count()
 
 
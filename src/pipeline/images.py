@@ -7,8 +7,12 @@ from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
 import base64
+import hashlib
 import requests
 import mimetypes
+import time
+
+from .cache import ResponseCache, cache_key, text_digest
 
 
 # Поддерживаемые расширения изображений (легко расширяемо)
@@ -36,9 +40,13 @@ def _find_sidecar_images_for_text_file(text_path: Path) -> List[Path]:
     return images
 
 
-def _read_image_as_base64(path: Path) -> str:
-    with path.open("rb") as f:
-        return base64.b64encode(f.read()).decode("ascii")
+def _encode_base64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _vision_cache_key(image_sha256: str, model: str, prompt: str) -> str:
+    # Версия промпта — хэш его текста: правка промпта автоматически инвалидирует кэш
+    return cache_key("vision", image_sha256, model, text_digest(prompt))
 
 
 def _guess_mime_type(path: Path) -> str:
@@ -137,7 +145,18 @@ def _build_vision_prompt_ru() -> str:
     )
 
 
-def explain_images_for_text_file(text_path: Path, cfg: Dict, report: Optional[Dict] = None) -> List[ImageExplanation]:
+def explain_images_for_text_file(
+    text_path: Path,
+    cfg: Dict,
+    report: Optional[Dict] = None,
+    cache: Optional[ResponseCache] = None,
+) -> List[ImageExplanation]:
+    """Пояснения к изображениям из соседней папки.
+
+    При переданном cache пояснение сначала ищется по sha256 содержимого изображения,
+    модели и версии промпта (для основной и фолбэк‑моделей по порядку); изображение
+    кодируется и отправляется в модель только при промахе.
+    """
     images = _find_sidecar_images_for_text_file(text_path)
     if not images:
         if report is not None:
@@ -153,36 +172,64 @@ def explain_images_for_text_file(text_path: Path, cfg: Dict, report: Optional[Di
     if report is not None:
         report["images"] = [str(p) for p in images]
         report.setdefault("calls", [])
+        report.setdefault("cache", [])
+        report.setdefault("cache_hits", 0)
+        report.setdefault("cache_misses", 0)
     retry_count = int((cfg.get("images", {}) or {}).get("retry_count", 0))
     backoff = float((cfg.get("images", {}) or {}).get("retry_backoff_sec", 0))
     fallbacks: List[str] = list((cfg.get("images", {}) or {}).get("fallback_models", []) or [])
+    primary_model = (cfg.get("images", {}) or {}).get("vision_model") or os.getenv("OPENROUTER_VISION_MODEL", "qwen-2.5-7b-instruct")
     for img in images:
-        img_b64 = _read_image_as_base64(img)
+        img_bytes = img.read_bytes()
+        img_sha256 = hashlib.sha256(img_bytes).hexdigest()
+        if cache is not None:
+            explanation = ""
+            for model_name in [primary_model] + fallbacks:
+                explanation = cache.get(_vision_cache_key(img_sha256, model_name, prompt)) or ""
+                if explanation:
+                    break
+            if report is not None:
+                report["cache"].append({
+                    "image": str(img),
+                    "sha256": img_sha256,
+                    "status": "hit" if explanation else "miss",
+                    "model": model_name if explanation else None,
+                })
+                report["cache_hits" if explanation else "cache_misses"] += 1
+            if explanation:
+                results.append(ImageExplanation(image_path=img, explanation=explanation, matched_reference=None))
+                continue
+        img_b64 = _encode_base64(img_bytes)
         mime = _guess_mime_type(img)
         # Основная попытка + ретраи
         attempts: List[Dict] = []
+        answered_by: List[str] = []
         def attempt_with_model(model_name: str) -> Optional[str]:
             call = {"image": str(img), "status": "pending"}
             if report is not None:
                 attempts.append(call)
             # Временная подмена модели
             cfg_local = {"vision_model": model_name}
+            t0 = time.perf_counter()
             out = _call_openrouter_vision(prompt, img_b64, cfg_local, call_entry=call, mime_type=mime)
+            call["latency_ms"] = round((time.perf_counter() - t0) * 1000, 1)
             if report is not None:
                 call["status"] = "ok" if out else ("error" if call.get("error") or call.get("http_status") or call.get("exception") else "empty")
                 if out:
                     call["response_preview"] = (out[:200] + ("…" if len(out) > 200 else ""))
+            if out:
+                answered_by.append(model_name)
             return out
 
         # Попытка с основной моделью
-        explanation = attempt_with_model((cfg.get("images", {}) or {}).get("vision_model") or os.getenv("OPENROUTER_VISION_MODEL", "qwen-2.5-7b-instruct")) or ""
+        explanation = attempt_with_model(primary_model) or ""
         # Ретраи при 5xx/исключениях/empty
         if not explanation and retry_count > 0 and attempts:
             from time import sleep
             for i in range(retry_count):
                 if backoff:
                     sleep(backoff)
-                explanation = attempt_with_model((cfg.get("images", {}) or {}).get("vision_model") or os.getenv("OPENROUTER_VISION_MODEL", "qwen-2.5-7b-instruct")) or ""
+                explanation = attempt_with_model(primary_model) or ""
                 if explanation:
                     break
         # Фолбэк‑модели
@@ -199,6 +246,8 @@ def explain_images_for_text_file(text_path: Path, cfg: Dict, report: Optional[Di
             # Разворачиваем attempts в calls
             report["calls"].extend(attempts)
         if explanation:
+            if cache is not None and answered_by:
+                cache.put(_vision_cache_key(img_sha256, answered_by[-1], prompt), explanation)
             results.append(ImageExplanation(image_path=img, explanation=explanation, matched_reference=None))
     return results
 
@@ -263,14 +312,14 @@ def _insert_at_logical_place(text: str, explanation: str) -> str:
     return text.rstrip() + f"\n\n> Пояснение к изображению:\n\n{explanation}\n"
 
 
-def enrich_text_with_image_explanations(text: str, text_path: Path, cfg: Dict) -> str:
+def enrich_text_with_image_explanations(text: str, text_path: Path, cfg: Dict, cache: Optional[ResponseCache] = None) -> str:
     """Главная точка входа: находит изображения, снимает пояснения и встраивает их в текст.
 
     - Буквальные референсы: вставить рядом с упоминанием
     - Семантические: якоря типа "см. скриншот" → сопоставить подходящее изображение
     - Нет референсов, но есть упоминания вложений → вставить в логичное место
     """
-    explanations = explain_images_for_text_file(text_path, cfg)
+    explanations = explain_images_for_text_file(text_path, cfg, cache=cache)
     if not explanations:
         return text
 
@@ -307,10 +356,10 @@ def enrich_text_with_image_explanations(text: str, text_path: Path, cfg: Dict) -
     return text
 
 
-def enrich_text_with_image_explanations_report(text: str, text_path: Path, cfg: Dict) -> Tuple[str, Dict]:
+def enrich_text_with_image_explanations_report(text: str, text_path: Path, cfg: Dict, cache: Optional[ResponseCache] = None) -> Tuple[str, Dict]:
     """То же, что enrich_text_with_image_explanations, но с подробным отчётом событий."""
     report: Dict = {"input": str(text_path), "events": [], "images": [], "calls": [], "insertions": []}
-    explanations = explain_images_for_text_file(text_path, cfg, report=report)
+    explanations = explain_images_for_text_file(text_path, cfg, report=report, cache=cache)
     if not explanations:
         return text, report
 
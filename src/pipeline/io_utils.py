@@ -1,26 +1,137 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Iterable, List, Tuple
-from charset_normalizer import from_path
+from typing import Iterable, Iterator, List, Optional, Tuple
+from charset_normalizer import from_bytes
+import codecs
 import hashlib
+import os
+import re
 import ftfy
 
+from .cache import EncodingCache
+
+
+# BOM в начале файла → кодек, который его снимает (UTF-32 проверяется раньше UTF-16:
+# BOM UTF-32 LE начинается с BOM UTF-16 LE)
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+# Определение кодировки не‑UTF‑8 файла — по началу файла (чётная длина: UTF-16 без BOM)
+DETECT_SAMPLE_BYTES = 64 * 1024
+# Символы, которых ftfy не меняет ни одним исправлением: печатный ASCII без «&» (HTML‑сущности),
+# табуляция, перевод строки и русский алфавит. Все шаблоны mojibake в ftfy.badness требуют
+# хотя бы одного символа вне этого набора, кавычки‑«ёлочки», тире и № в них тоже входят.
+# Исключение — UTF-8, прочитанный как cp1251: «и» → «Рё», «Ш» → «РЁ» целиком из набора,
+# такие пары тоже отдаются ftfy (в обычном русском тексте они почти не встречаются)
+_FTFY_SUSPECT_RE = re.compile(r"[^\t\n -%'-~А-яЁё]|Р[Ёё]")
+# Граница сегментов ftfy.fix_text в строке без переводов строки
+_FTFY_SEGMENT = ftfy.TextFixerConfig().max_decode_length
+
 
 def discover_input_files(input_root: Path) -> List[Path]:
-    if input_root.is_file() and input_root.suffix.lower() == ".txt":
-        return [input_root]
-    return sorted([p for p in input_root.rglob("*.txt") if p.is_file()])
+    return list(iter_input_files(input_root))
+
+
+def iter_input_files(input_root: Path) -> Iterator[Path]:
+    """Ленивый обход: *.txt в том же порядке, что sorted(rglob), без построения полного списка.
+
+    В памяти держится только листинг текущих каталогов на пути обхода.
+    """
+    if input_root.is_file():
+        if input_root.suffix.lower() == ".txt":
+            yield input_root
+        return
+    try:
+        with os.scandir(input_root) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+    for entry in entries:
+        # Как и rglob, не заходим в каталоги‑симлинки (защита от циклов)
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_input_files(Path(entry.path))
+        elif entry.name.endswith(".txt") and entry.is_file():
+            yield Path(entry.path)
+
+
+def read_text_file(path: Path, encoding_cache: Optional[EncodingCache] = None) -> str:
+    """Текст файла: декодирование, переводы строк → \\n, исправления ftfy.
+
+    Сначала строгий UTF-8 (и BOM UTF-8/16/32) — без определения кодировки. Иначе
+    кодировка из encoding_cache (файл с тем же размером и mtime), иначе
+    charset_normalizer по первым DETECT_SAMPLE_BYTES байтам; если весь файл в ней не
+    декодируется — по всему файлу. Найденная кодировка запоминается в encoding_cache.
+    """
+    data = path.read_bytes()
+    text = _decode_known(data)
+    if text is None:
+        stat = path.stat()
+        encoding = encoding_cache.get(path, stat.st_size, stat.st_mtime_ns) if encoding_cache is not None else None
+        text = _decode_as(data, encoding) if encoding else None
+        if text is None:
+            text, encoding = _detect_and_decode(data, path)
+            if encoding_cache is not None:
+                encoding_cache.put(path, stat.st_size, stat.st_mtime_ns, encoding)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return fix_text(text)
+
+
+def _decode_known(data: bytes) -> Optional[str]:
+    for bom, codec in _BOMS:
+        if data.startswith(bom):
+            return _decode_as(data, codec)
+    return _decode_as(data, "utf-8")
+
+
+def _decode_as(data: bytes, encoding: str) -> Optional[str]:
+    try:
+        return data.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        return None
 
 
-def read_text_file(path: Path) -> str:
-    result = from_path(str(path)).best()
+def _detect_and_decode(data: bytes, path: Path) -> Tuple[str, str]:
+    if len(data) > DETECT_SAMPLE_BYTES:
+        sample = from_bytes(data[:DETECT_SAMPLE_BYTES]).best()
+        text = _decode_as(data, sample.encoding) if sample is not None else None
+        if text is not None:
+            return text, sample.encoding
+    result = from_bytes(data).best()
     if result is None:
         raise ValueError(f"Не удалось определить кодировку: {path}")
-    text = str(result)
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
-    text = ftfy.fix_text(text)
-    return text
+    return str(result), result.encoding
+
+
+def fix_text(text: str) -> str:
+    """ftfy.fix_text только для сегментов с символами, которые ftfy может изменить.
+
+    ftfy исправляет текст независимыми сегментами (строками); остальные сегменты
+    возвращаются как есть, поэтому результат совпадает с ftfy.fix_text(text).
+    Разбиение на сегменты и отключение unescape_html после первого «<» повторяют ftfy.
+    """
+    match = _FTFY_SUSPECT_RE.search(text)
+    if match is None:
+        return text
+    first_lt = text.find("<")
+    out: List[str] = []
+    pos = 0
+    while match is not None:
+        at = match.start()
+        line_start = text.rfind("\n", 0, at) + 1
+        start = line_start + (at - line_start) // _FTFY_SEGMENT * _FTFY_SEGMENT
+        end = min(text.find("\n", start) + 1 or len(text), start + _FTFY_SEGMENT)
+        html = "auto" if first_lt < 0 or first_lt >= end else False
+        out.append(text[pos:start])
+        out.append(ftfy.fix_text(text[start:end], unescape_html=html))
+        pos = end
+        match = _FTFY_SUSPECT_RE.search(text, pos)
+    out.append(text[pos:])
+    return "".join(out)
 
 
 def write_markdown_file(path: Path, content: str) -> None:
@@ -1,33 +1,89 @@
 from __future__ import annotations
 
 import os
-from typing import Optional, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
 import requests
 import re
 
-
-def postprocess_with_llm(markdown_text: str, system_prompt: str, user_prompt: str, cfg: dict) -> Optional[str]:
+from .cache import ResponseCache, cache_key, text_digest
+from .perf import DocPerf
+
+
+def postprocess_with_llm(
+    markdown_text: str,
+    system_prompt: str,
+    user_prompt: str,
+    cfg: dict,
+    cache: Optional[ResponseCache] = None,
+    stats: Optional[Dict[str, int]] = None,
+    perf: Optional[DocPerf] = None,
+) -> Optional[str]:
+    """Постобработка Markdown моделью с фолбэком между бэкендами.
+
+    Если передан cache, ответы ищутся по ключу (бэкенд, модель, хэши промптов,
+    параметры сэмплинга, хэш входа) для всех бэкендов в порядке приоритета до
+    первого сетевого запроса. В stats увеличиваются счётчики llm_cache_hits/llm_cache_misses,
+    в perf записывается длительность каждого обращения к бэкенду.
+    """
     if not cfg.get("enabled", False):
         return markdown_text
 
     priority = (cfg.get("priority") or "ollama").lower()
-    if priority == "ollama":
-        out = _try_ollama(markdown_text, system_prompt, user_prompt)
-        if out is not None:
-            return _sanitize_think(out)
-        out2 = _try_openrouter(markdown_text, system_prompt, user_prompt)
-        return _sanitize_think(out2) if out2 is not None else None
-    else:
-        out = _try_openrouter(markdown_text, system_prompt, user_prompt)
+    backends = ["ollama", "openrouter"] if priority == "ollama" else ["openrouter", "ollama"]
+    params = _sampling_params(cfg)
+    keys: List[str] = []
+    if cache is not None:
+        keys = [_response_cache_key(b, markdown_text, system_prompt, user_prompt, params) for b in backends]
+        for key in keys:
+            cached = cache.get(key)
+            if cached is not None:
+                _bump(stats, "llm_cache_hits")
+                return cached
+        _bump(stats, "llm_cache_misses")
+    for i, backend in enumerate(backends):
+        t0 = time.perf_counter()
+        out = _BACKENDS[backend](markdown_text, system_prompt, user_prompt, params)
+        if perf is not None:
+            perf.add_call("llm", time.perf_counter() - t0, out is not None)
         if out is not None:
-            return _sanitize_think(out)
-        out2 = _try_ollama(markdown_text, system_prompt, user_prompt)
-        return _sanitize_think(out2) if out2 is not None else None
+            cleaned = _sanitize_think(out)
+            if cache is not None and cleaned:
+                cache.put(keys[i], cleaned)
+            return cleaned
+    return None
+
+
+def _sampling_params(cfg: dict) -> Dict[str, float]:
+    return {
+        "temperature": float(cfg.get("temperature", 0.2)),
+        "top_p": float(cfg.get("top_p", 0.9)),
+    }
+
 
+def _backend_model(backend: str) -> str:
+    if backend == "ollama":
+        return os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
+    return os.getenv("OPENROUTER_MODEL", "qwen-2.5-7b-instruct")
 
-def _try_ollama(text: str, system_prompt: str, user_prompt: str) -> Optional[str]:
+
+def _response_cache_key(backend: str, text: str, system_prompt: str, user_prompt: str, params: Dict[str, float]) -> str:
+    return cache_key(
+        "llm", backend, _backend_model(backend),
+        text_digest(system_prompt), text_digest(user_prompt),
+        params, text_digest(text),
+    )
+
+
+def _bump(stats: Optional[Dict[str, int]], name: str, n: int = 1) -> None:
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + n
+
+
+def _try_ollama(text: str, system_prompt: str, user_prompt: str, params: Optional[Dict[str, float]] = None) -> Optional[str]:
+    params = params or {"temperature": 0.2, "top_p": 0.9}
     host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-    model = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
+    model = _backend_model("ollama")
     timeout = float(os.getenv("OLLAMA_TIMEOUT", "10"))
     url = f"{host.rstrip('/')}/api/chat"
     try:
@@ -39,8 +95,8 @@ def _try_ollama(text: str, system_prompt: str, user_prompt: str) -> Optional[str
             ],
             "stream": False,
             "options": {
-                "temperature": 0.2,
-                "top_p": 0.9,
+                "temperature": params["temperature"],
+                "top_p": params["top_p"],
             },
         }
         resp = requests.post(url, json=payload, timeout=timeout)
@@ -52,10 +108,11 @@ def _try_ollama(text: str, system_prompt: str, user_prompt: str) -> Optional[str
     return None
 
 
-def _try_openrouter(text: str, system_prompt: str, user_prompt: str) -> Optional[str]:
+def _try_openrouter(text: str, system_prompt: str, user_prompt: str, params: Optional[Dict[str, float]] = None) -> Optional[str]:
+    params = params or {"temperature": 0.2, "top_p": 0.9}
     api_key = os.getenv("OPENROUTER_API_KEY")
     base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
-    model = os.getenv("OPENROUTER_MODEL", "qwen-2.5-7b-instruct")
+    model = _backend_model("openrouter")
     timeout = float(os.getenv("OPENROUTER_TIMEOUT", "10"))
     if not api_key:
         return None
@@ -72,8 +129,8 @@ def _try_openrouter(text: str, system_prompt: str, user_prompt: str) -> Optional
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"{user_prompt}\n\nТекст для обработки:\n\n{text}"},
             ],
-            "temperature": 0.2,
-            "top_p": 0.9,
+            "temperature": params["temperature"],
+            "top_p": params["top_p"],
         }
         resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
         if resp.ok:
@@ -86,6 +143,12 @@ def _try_openrouter(text: str, system_prompt: str, user_prompt: str) -> Optional
     return None
 
 
+_BACKENDS = {
+    "ollama": _try_ollama,
+    "openrouter": _try_openrouter,
+}
+
+
 _THINK_BLOCK_RE = re.compile(r"(?is)<think>\s*[\s\S]*?\s*</think>")
 
 
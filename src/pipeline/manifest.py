@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+
+
+# Секции/ключи конфига, не влияющие на результат обработки: их изменение не должно
+# приводить к повторной обработке всего экспорта
+_VOLATILE_SECTIONS = {"execution"}
+_VOLATILE_KEYS = {"concurrency", "cache"}
+
+
+def config_fingerprint(cfg: Dict, system_prompt: str = "", user_prompt: str = "") -> str:
+    """sha256 эффективной конфигурации и текстов промптов."""
+
+    def _strip(node):
+        if isinstance(node, dict):
+            return {k: _strip(v) for k, v in node.items() if k not in _VOLATILE_KEYS}
+        if isinstance(node, list):
+            return [_strip(v) for v in node]
+        return node
+
+    effective = {k: _strip(v) for k, v in cfg.items() if k not in _VOLATILE_SECTIONS}
+    h = hashlib.sha256()
+    h.update(json.dumps(effective, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    h.update(b"\0")
+    h.update(system_prompt.encode("utf-8"))
+    h.update(b"\0")
+    h.update(user_prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+def sha256_of_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class InputFingerprint:
+    size: int
+    mtime_ns: int
+    sha256: Optional[str]
+
+
+@dataclass
+class ManifestEntry:
+    input_path: str
+    size: int
+    mtime_ns: int
+    input_sha256: str
+    config_hash: str
+    doc_id: str
+    title: str
+    outputs: List[str]
+
+
+class ProcessingManifest:
+    """Манифест обработанных файлов в state_dir/manifest.sqlite.
+
+    Файл считается неизменённым, если совпадают хэш конфигурации и содержимое входа,
+    а все записанные выходы на месте. Содержимое сначала сверяется по (size, mtime_ns)
+    без чтения файла; при расхождении — по sha256 сырых байтов.
+
+    before_commit вызывается перед каждой фиксацией: так зависимые хранилища (индекс
+    дубликатов) фиксируют свои записи не позже манифеста. Иначе после сбоя файл числился
+    бы обработанным, а его отпечатки откатились бы, и повторный запуск их не восстановил.
+    """
+
+    def __init__(self, state_dir: Path, commit_every: int = 100, before_commit: Optional[Callable[[], None]] = None):
+        self.db_path = state_dir / "manifest.sqlite"
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_every = commit_every
+        self.before_commit = before_commit
+        self._pending = 0
+        self._con = sqlite3.connect(self.db_path)
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " input_path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " input_sha256 TEXT NOT NULL,"
+            " config_hash TEXT NOT NULL,"
+            " doc_id TEXT,"
+            " title TEXT,"
+            " outputs TEXT,"
+            " updated_at TEXT)"
+        )
+        self._con.commit()
+
+    @staticmethod
+    def key(path: Path) -> str:
+        return str(path.resolve())
+
+    def get(self, path: Path) -> Optional[ManifestEntry]:
+        row = self._con.execute(
+            "SELECT input_path, size, mtime_ns, input_sha256, config_hash, doc_id, title, outputs FROM files WHERE input_path = ?",
+            (self.key(path),),
+        ).fetchone()
+        if row is None:
+            return None
+        return ManifestEntry(row[0], row[1], row[2], row[3], row[4], row[5] or "", row[6] or "", json.loads(row[7] or "[]"))
+
+    def check(self, path: Path, config_hash: str) -> Tuple[Optional[ManifestEntry], InputFingerprint]:
+        """Возвращает (запись, отпечаток входа); запись только если файл можно пропустить."""
+        st = path.stat()
+        entry = self.get(path)
+        if entry is None or entry.config_hash != config_hash:
+            return None, InputFingerprint(st.st_size, st.st_mtime_ns, None)
+        if not all(os.path.exists(p) for p in entry.outputs):
+            return None, InputFingerprint(st.st_size, st.st_mtime_ns, None)
+        if entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+            return entry, InputFingerprint(st.st_size, st.st_mtime_ns, entry.input_sha256)
+        if entry.size != st.st_size:
+            return None, InputFingerprint(st.st_size, st.st_mtime_ns, None)
+        digest = sha256_of_file(path)
+        fp = InputFingerprint(st.st_size, st.st_mtime_ns, digest)
+        if digest != entry.input_sha256:
+            return None, fp
+        # Содержимое то же (например, файл перезаписан копированием) — обновляем mtime
+        self._con.execute("UPDATE files SET mtime_ns = ? WHERE input_path = ?", (st.st_mtime_ns, entry.input_path))
+        self._tick()
+        return entry, fp
+
+    def record(self, path: Path, fp: InputFingerprint, config_hash: str, doc_id: str, title: str, outputs: List[str]) -> None:
+        digest = fp.sha256 or sha256_of_file(path)
+        self._con.execute(
+            "INSERT OR REPLACE INTO files(input_path, size, mtime_ns, input_sha256, config_hash, doc_id, title, outputs, updated_at)"
+            " VALUES(?,?,?,?,?,?,?,?,?)",
+            (
+                self.key(path), fp.size, fp.mtime_ns, digest, config_hash, doc_id, title,
+                json.dumps(outputs, ensure_ascii=False), datetime.utcnow().isoformat(timespec="seconds"),
+            ),
+        )
+        self._tick()
+
+    def _tick(self) -> None:
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._commit()
+
+    def _commit(self) -> None:
+        if self.before_commit is not None and self._con.in_transaction:
+            self.before_commit()
+        self._con.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        try:
+            self._commit()
+        finally:
+            self._con.close()
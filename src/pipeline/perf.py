@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import math
+import time
+
+
+# Порядок стадий в сводке (как они идут в конвейере)
+STAGE_ORDER = (
+    "dedup_exact",
+    "read",
+    "normalize",
+    "clean",
+    "fingerprint",
+    "dedup",
+    "images",
+    "person_ner",
+    "anonymize_pass1",
+    "extract_metadata",
+    "build_markdown",
+    "llm",
+    "anonymize_pass2",
+    "validate",
+    "format",
+    "write",
+)
+
+
+class DocPerf:
+    """Замеры одного документа: время стадий (monotonic), байты, сетевые вызовы.
+
+    Стадии переключаются через start(); stop() закрывает текущую — его вызывают на
+    границе группы стадий, чтобы ожидание в очередях конвейера не попадало в замер.
+    Объект сериализуется pickle вместе с состоянием документа.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # (вид вызова: llm/vision, длительность в секундах, успешен ли)
+        self.calls: List[Tuple[str, float, bool]] = []
+        self._current: Optional[str] = None
+        self._t0 = 0.0
+
+    def start(self, stage: str) -> None:
+        self.stop()
+        self._current = stage
+        self._t0 = time.perf_counter()
+
+    def stop(self) -> None:
+        if self._current is not None:
+            self.stages[self._current] = self.stages.get(self._current, 0.0) + time.perf_counter() - self._t0
+            self._current = None
+
+    def add_call(self, kind: str, seconds: float, ok: bool) -> None:
+        self.calls.append((kind, seconds, ok))
+
+    @property
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+
+class RunPerf:
+    """Агрегация замеров запуска в родительском процессе.
+
+    Значения хранятся компактно (array('d')), поэтому память на документ — десятки байт.
+    """
+
+    def __init__(self, top_n: int = 10):
+        self.top_n = top_n
+        self._t0 = time.perf_counter()
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._stages: Dict[str, array] = {}
+        self._calls: Dict[str, array] = {}
+        self._call_errors: Dict[str, int] = {}
+        self._slowest: List[Tuple[float, str]] = []
+
+    def add(self, file: str, perf: DocPerf) -> None:
+        self.files += 1
+        self.bytes_in += perf.bytes_in
+        self.bytes_out += perf.bytes_out
+        for stage, sec in perf.stages.items():
+            self._stages.setdefault(stage, array("d")).append(sec)
+        for kind, sec, ok in perf.calls:
+            self._calls.setdefault(kind, array("d")).append(sec)
+            if not ok:
+                self._call_errors[kind] = self._call_errors.get(kind, 0) + 1
+        self._slowest.append((perf.total, file))
+        if len(self._slowest) > self.top_n * 4:
+            self._slowest = sorted(self._slowest, reverse=True)[: self.top_n]
+
+    def summary(self) -> Dict:
+        wall = time.perf_counter() - self._t0
+        known = [s for s in STAGE_ORDER if s in self._stages]
+        extra = sorted(s for s in self._stages if s not in STAGE_ORDER)
+        stages = {s: _distribution(self._stages[s]) for s in known + extra}
+        calls = {}
+        for kind, values in sorted(self._calls.items()):
+            calls[kind] = _distribution(values)
+            calls[kind]["errors"] = self._call_errors.get(kind, 0)
+        return {
+            "files": self.files,
+            "wall_sec": round(wall, 3),
+            "files_per_sec": round(self.files / wall, 2) if wall > 0 else None,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "stages": stages,
+            "calls": calls,
+            "slowest_files": [
+                {"file": f, "total_ms": round(t * 1000, 2)}
+                for t, f in sorted(self._slowest, reverse=True)[: self.top_n]
+            ],
+        }
+
+
+def _distribution(values: array) -> Dict:
+    ordered = sorted(values)
+    n = len(ordered)
+
+    def pct(p: float) -> float:
+        # nearest-rank
+        return ordered[max(0, min(n - 1, math.ceil(p / 100.0 * n) - 1))]
+
+    return {
+        "count": n,
+        "total_sec": round(sum(ordered), 4),
+        "p50_ms": round(pct(50) * 1000, 3),
+        "p95_ms": round(pct(95) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def write_perf_report(reports_dir: Path, run_id: str, summary: Dict) -> Path:
+    out = reports_dir / "perf" / f"{run_id}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    return out
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from importlib.util import find_spec
+from typing import Dict, Iterator, List, Optional, Tuple
+import re
+import threading
+
+
+# Префильтр: слово кириллицей с заглавной буквы. Без него в строке имени быть не может,
+# и до модели она не доходит (логи, стектрейсы, таблицы)
+CAPITALIZED_RE = re.compile(r"(?<![А-Яа-яЁё])[А-ЯЁ][а-яё]+")
+
+# Модели NER загружаются один раз на процесс (в каждом воркере пула — при первом документе
+# с кандидатами) и переиспользуются всеми документами этого процесса
+_TAGGER = None
+_TAGGER_LOCK = threading.Lock()
+
+
+def natasha_available() -> bool:
+    return find_spec("natasha") is not None and find_spec("razdel") is not None
+
+
+def _tagger():
+    global _TAGGER
+    if _TAGGER is None:
+        with _TAGGER_LOCK:
+            if _TAGGER is None:
+                from natasha import NewsEmbedding, NewsNERTagger
+
+                _TAGGER = NewsNERTagger(NewsEmbedding())
+    return _TAGGER
+
+
+class PersonDetector:
+    """Имена людей (PERSON) через NER natasha.
+
+    Текст режется на строки, строки с кандидатами (слово кириллицей с заглавной) — на
+    предложения (razdel); в модель идут только предложения с кандидатами, пачками по
+    batch_size. Документ без кандидатов обрабатывается без модели. Сам объект лёгкий и
+    передаётся в процессы‑воркеры, модели живут в глобальном кэше процесса.
+    """
+
+    def __init__(self, batch_size: int = 32):
+        self.batch_size = max(1, int(batch_size))
+
+    @classmethod
+    def from_config(cls, pii_cfg: Dict) -> Optional["PersonDetector"]:
+        """Детектор, если PERSON включён в pii.entities (или список не задан) и natasha установлена."""
+        entities = pii_cfg.get("entities")
+        if entities is not None and "PERSON" not in {str(e).upper() for e in entities}:
+            return None
+        if not natasha_available():
+            return None
+        return cls(batch_size=(pii_cfg.get("person") or {}).get("batch_size", 32))
+
+    def find(self, text: str) -> List[Tuple[int, int]]:
+        """Интервалы имён в тексте, по возрастанию начала."""
+        return self.find_regions(text, [(0, len(text))])
+
+    def find_regions(self, text: str, regions: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Имена только внутри интервалов (смещения — в text); пачки собираются по всем интервалам."""
+        sentences = list(self._candidate_sentences(text, regions))
+        if not sentences:
+            return []
+        tagger = _tagger()
+        infer = getattr(tagger, "infer", tagger)
+        spans: List[Tuple[int, int]] = []
+        for lo in range(0, len(sentences), self.batch_size):
+            batch = sentences[lo:lo + self.batch_size]
+            texts = [sent for _, sent in batch]
+            # slovnet под natasha принимает пачку (map); иначе — по предложению
+            markups = infer.map(texts) if hasattr(infer, "map") else [tagger(t) for t in texts]
+            for (offset, _), markup in zip(batch, markups):
+                spans.extend((offset + sp.start, offset + sp.stop) for sp in markup.spans if sp.type == "PER")
+        return sorted(spans)
+
+    def _candidate_sentences(self, text: str, regions: List[Tuple[int, int]]) -> Iterator[Tuple[int, str]]:
+        from razdel import sentenize
+
+        for start, end in regions:
+            if not CAPITALIZED_RE.search(text, start, end):
+                continue
+            pos = start
+            for line in text[start:end].splitlines(keepends=True):
+                if CAPITALIZED_RE.search(line):
+                    for sent in sentenize(line):
+                        if CAPITALIZED_RE.search(sent.text):
+                            yield pos + sent.start, sent.text
+                pos += len(line)
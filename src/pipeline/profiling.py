@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+
+
+class PipelineProfiler:
+    """Профилирование запуска: cProfile по стадиям + пик памяти (tracemalloc) по файлам.
+
+    Работает только в последовательном режиме (один процесс, один поток): профили
+    разных стадий не пересекаются. Результат — reports/profile/<run_id>/:
+    <stage>.pstats и all.pstats (открываются pstats, snakeviz, gprof2dot) и summary.json.
+    """
+
+    def __init__(self, top_n: int = 20):
+        self.top_n = top_n
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._stage_seconds: Dict[str, float] = {}
+        # (секунды, пик памяти в байтах, размер входа, путь)
+        self._files: List[Tuple[float, int, int, str]] = []
+        self._file_t0 = 0.0
+        self._started_tracemalloc = False
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self) -> None:
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        prof = self._profiles.get(name)
+        if prof is None:
+            prof = self._profiles[name] = cProfile.Profile()
+        t0 = time.perf_counter()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            self._stage_seconds[name] = self._stage_seconds.get(name, 0.0) + time.perf_counter() - t0
+
+    def begin_file(self) -> None:
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._file_t0 = time.perf_counter()
+
+    def end_file(self, path: str, size: int) -> None:
+        elapsed = time.perf_counter() - self._file_t0
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        self._files.append((elapsed, peak, size, path))
+
+    def write(self, out_dir: Path) -> Dict:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        stages: Dict[str, Dict] = {}
+        combined: Optional[pstats.Stats] = None
+        for name, prof in self._profiles.items():
+            path = out_dir / f"{name}.pstats"
+            prof.dump_stats(str(path))
+            stats = pstats.Stats(prof)
+            combined = stats if combined is None else combined.add(prof)
+            stages[name] = {
+                "seconds": round(self._stage_seconds.get(name, 0.0), 4),
+                "pstats": str(path),
+                "hotspots": _hotspots(pstats.Stats(str(path)), self.top_n),
+            }
+        if combined is not None:
+            combined.dump_stats(str(out_dir / "all.pstats"))
+        by_time = sorted(self._files, reverse=True)[: self.top_n]
+        by_peak = sorted(self._files, key=lambda f: f[1], reverse=True)[: self.top_n]
+        summary = {
+            "files": len(self._files),
+            "stages": stages,
+            "slowest_files": [_file_row(f) for f in by_time],
+            "peak_memory_files": [_file_row(f) for f in by_peak],
+            "peak_memory_max_bytes": max((f[1] for f in self._files), default=0),
+        }
+        (out_dir / "summary.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+        summary["dir"] = str(out_dir)
+        return summary
+
+
+def _file_row(f: Tuple[float, int, int, str]) -> Dict:
+    return {"file": f[3], "seconds": round(f[0], 4), "peak_memory_bytes": f[1], "size_bytes": f[2]}
+
+
+def _hotspots(stats: pstats.Stats, top_n: int) -> List[Dict]:
+    """Топ функций стадии по собственному времени (tottime)."""
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, _callers) in stats.stats.items():  # type: ignore[attr-defined]
+        rows.append({
+            "function": f"{func} ({filename}:{line})",
+            "calls": nc,
+            "tottime": round(tt, 6),
+            "cumtime": round(ct, 6),
+        })
+    rows.sort(key=lambda r: r["tottime"], reverse=True)
+    return rows[:top_n]
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+import json
+import os
+import sqlite3
+import time
+
+
+def new_run_id() -> str:
+    return f"{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}-{os.getpid()}"
+
+
+class ReportStore:
+    """Отчёты запуска в одной базе reports_dir/reports.sqlite.
+
+    Одна строка на документ (doc_id): счётчики PII обоих проходов, остаточная PII,
+    оставленное по белому списку, пропуски префильтра PII и отчёт по изображениям. Повторная обработка документа обновляет строку, а не
+    дописывает дубликат. Записи копятся в открытой транзакции и фиксируются
+    пачками — каждые commit_every документов или commit_interval_sec секунд.
+    """
+
+    def __init__(self, reports_dir: Path, commit_every: int = 200, commit_interval_sec: float = 5.0):
+        self.reports_dir = reports_dir
+        self.db_path = reports_dir / "reports.sqlite"
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_every = commit_every
+        self.commit_interval_sec = commit_interval_sec
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._con = sqlite3.connect(self.db_path, timeout=30)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id TEXT PRIMARY KEY,"
+            " started_at TEXT,"
+            " finished_at TEXT,"
+            " stats TEXT)"
+        )
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY,"
+            " run_id TEXT,"
+            " source_path TEXT,"
+            " output_path TEXT,"
+            " counts_pass1 TEXT,"
+            " counts_pass2 TEXT,"
+            " residual TEXT,"
+            " leakage INTEGER NOT NULL DEFAULT 0,"
+            " images_report TEXT,"
+            " updated_at TEXT,"
+            " whitelisted TEXT,"
+            " prefilter TEXT)"
+        )
+        # Базы, созданные до появления белого списка и префильтра
+        columns = {row[1] for row in self._con.execute("PRAGMA table_info(documents)")}
+        for column in ("whitelisted", "prefilter"):
+            if column not in columns:
+                self._con.execute(f"ALTER TABLE documents ADD COLUMN {column} TEXT")
+        self._con.execute("CREATE INDEX IF NOT EXISTS idx_documents_leakage ON documents(leakage)")
+        self._con.execute("CREATE INDEX IF NOT EXISTS idx_documents_run ON documents(run_id)")
+        self._con.commit()
+
+    # --- запись ---------------------------------------------------------------
+
+    def begin_run(self, run_id: str) -> None:
+        self._con.execute(
+            "INSERT OR REPLACE INTO runs(run_id, started_at) VALUES(?, ?)",
+            (run_id, datetime.utcnow().isoformat(timespec="seconds")),
+        )
+
+    def finish_run(self, run_id: str, stats: Dict) -> None:
+        self._con.execute(
+            "UPDATE runs SET finished_at = ?, stats = ? WHERE run_id = ?",
+            (datetime.utcnow().isoformat(timespec="seconds"), json.dumps(stats, ensure_ascii=False, default=str), run_id),
+        )
+        self._con.commit()
+
+    def add_document(
+        self,
+        run_id: str,
+        doc_id: str,
+        source_path: str,
+        output_path: Optional[str],
+        counts_pass1: Dict[str, int],
+        counts_pass2: Dict[str, int],
+        residual: Dict[str, int],
+        images_report: Optional[Dict] = None,
+        whitelisted: Optional[Dict[str, int]] = None,
+        prefilter: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        self._con.execute(
+            "INSERT OR REPLACE INTO documents(doc_id, run_id, source_path, output_path, counts_pass1, counts_pass2,"
+            " residual, leakage, images_report, updated_at, whitelisted, prefilter) VALUES(?,?,?,?,?,?,?,?,?,?,?,?)",
+            (
+                doc_id, run_id, source_path, output_path,
+                json.dumps(counts_pass1, ensure_ascii=False),
+                json.dumps(counts_pass2, ensure_ascii=False),
+                json.dumps(residual, ensure_ascii=False),
+                int(sum(residual.values())),
+                json.dumps(images_report, ensure_ascii=False) if images_report else None,
+                datetime.utcnow().isoformat(timespec="seconds"),
+                json.dumps(whitelisted or {}, ensure_ascii=False),
+                json.dumps(prefilter or {}, ensure_ascii=False),
+            ),
+        )
+        self._pending += 1
+        if self._pending >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval_sec:
+            self.flush()
+
+    def flush(self) -> None:
+        self._con.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._con.close()
+
+    # --- чтение ---------------------------------------------------------------
+
+    def summary(self, run_id: Optional[str] = None) -> Dict:
+        where, args = ("WHERE run_id = ?", (run_id,)) if run_id else ("", ())
+        docs, leaking = self._con.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(leakage > 0), 0) FROM documents {where}", args
+        ).fetchone()
+        totals_pass1: Dict[str, int] = {}
+        totals_pass2: Dict[str, int] = {}
+        totals_residual: Dict[str, int] = {}
+        totals_whitelisted: Dict[str, int] = {}
+        rows = self._con.execute(f"SELECT counts_pass1, counts_pass2, residual, whitelisted FROM documents {where}", args)
+        for c1, c2, res, wl in rows:
+            for target, raw in ((totals_pass1, c1), (totals_pass2, c2), (totals_residual, res), (totals_whitelisted, wl)):
+                for k, v in json.loads(raw or "{}").items():
+                    target[k] = target.get(k, 0) + int(v)
+        runs = [
+            {"run_id": r[0], "started_at": r[1], "finished_at": r[2]}
+            for r in self._con.execute("SELECT run_id, started_at, finished_at FROM runs ORDER BY started_at DESC LIMIT 5")
+        ]
+        return {
+            "documents": docs,
+            "documents_with_leakage": leaking,
+            "counts_pass1": totals_pass1,
+            "counts_pass2": totals_pass2,
+            "residual": totals_residual,
+            "whitelisted": totals_whitelisted,
+            "recent_runs": runs,
+        }
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        row = self._con.execute(f"SELECT {_DOC_COLUMNS} FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return _row_to_dict(row) if row else None
+
+    def iter_documents(self, leaking_only: bool = False, run_id: Optional[str] = None, limit: int = 0) -> Iterator[Dict]:
+        clauses: List[str] = []
+        args: List = []
+        if leaking_only:
+            clauses.append("leakage > 0")
+        if run_id:
+            clauses.append("run_id = ?")
+            args.append(run_id)
+        sql = f"SELECT {_DOC_COLUMNS} FROM documents"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY doc_id"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        for row in self._con.execute(sql, args):
+            yield _row_to_dict(row)
+
+    def export_legacy(self, out_dir: Path) -> Dict[str, int]:
+        """Выгрузка в прежнюю раскладку: pii/<doc_id>.json, validation/residual_pii.jsonl, images/<doc_id>.json."""
+        (out_dir / "pii").mkdir(parents=True, exist_ok=True)
+        (out_dir / "validation").mkdir(parents=True, exist_ok=True)
+        written = {"pii": 0, "residual": 0, "images": 0}
+        with (out_dir / "validation" / "residual_pii.jsonl").open("w", encoding="utf-8") as residual_f:
+            for doc in self.iter_documents():
+                doc_id = doc["doc_id"]
+                (out_dir / "pii" / f"{doc_id}.json").write_text(
+                    json.dumps({
+                        "doc_id": doc_id,
+                        "counts_pass1": doc["counts_pass1"],
+                        "counts_pass2": doc["counts_pass2"],
+                        "whitelisted": doc["whitelisted"],
+                        "prefilter": doc["prefilter"],
+                    }, ensure_ascii=False, indent=2),
+                    encoding="utf-8",
+                )
+                written["pii"] += 1
+                if doc["leakage"]:
+                    residual_f.write(json.dumps({"doc_id": doc_id, "residual": doc["residual"]}, ensure_ascii=False) + "\n")
+                    written["residual"] += 1
+                if doc["images_report"]:
+                    (out_dir / "images").mkdir(parents=True, exist_ok=True)
+                    (out_dir / "images" / f"{doc_id}.json").write_text(
+                        json.dumps(doc["images_report"], ensure_ascii=False, indent=2), encoding="utf-8"
+                    )
+                    written["images"] += 1
+        return written
+
+
+class LegacyReportWriter:
+    """Прежняя раскладка отчётов: по файлу JSON на документ (io.report_backend: files)."""
+
+    def __init__(self, reports_dir: Path):
+        self.reports_dir = reports_dir
+        (reports_dir / "pii").mkdir(parents=True, exist_ok=True)
+        (reports_dir / "validation").mkdir(parents=True, exist_ok=True)
+
+    def begin_run(self, run_id: str) -> None:
+        pass
+
+    def finish_run(self, run_id: str, stats: Dict) -> None:
+        pass
+
+    def add_document(
+        self,
+        run_id: str,
+        doc_id: str,
+        source_path: str,
+        output_path: Optional[str],
+        counts_pass1: Dict[str, int],
+        counts_pass2: Dict[str, int],
+        residual: Dict[str, int],
+        images_report: Optional[Dict] = None,
+        whitelisted: Optional[Dict[str, int]] = None,
+        prefilter: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        (self.reports_dir / "pii" / f"{doc_id}.json").write_text(
+            json.dumps({
+                "doc_id": doc_id,
+                "counts_pass1": counts_pass1,
+                "counts_pass2": counts_pass2,
+                "whitelisted": whitelisted or {},
+                "prefilter": prefilter or {},
+            }, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+        if sum(residual.values()):
+            with (self.reports_dir / "validation" / "residual_pii.jsonl").open("a", encoding="utf-8") as f:
+                f.write(json.dumps({"doc_id": doc_id, "residual": residual}, ensure_ascii=False) + "\n")
+        if images_report:
+            (self.reports_dir / "images").mkdir(parents=True, exist_ok=True)
+            (self.reports_dir / "images" / f"{doc_id}.json").write_text(
+                json.dumps(images_report, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def open_report_store(reports_dir: Path, backend: str = "sqlite"):
+    if (backend or "sqlite").lower() == "files":
+        return LegacyReportWriter(reports_dir)
+    return ReportStore(reports_dir)
+
+
+_DOC_COLUMNS = (
+    "doc_id, run_id, source_path, output_path, counts_pass1, counts_pass2, residual, leakage, images_report,"
+    " updated_at, whitelisted, prefilter"
+)
+
+
+def _row_to_dict(row) -> Dict:
+    return {
+        "doc_id": row[0],
+        "run_id": row[1],
+        "source_path": row[2],
+        "output_path": row[3],
+        "counts_pass1": json.loads(row[4] or "{}"),
+        "counts_pass2": json.loads(row[5] or "{}"),
+        "residual": json.loads(row[6] or "{}"),
+        "leakage": row[7],
+        "images_report": json.loads(row[8]) if row[8] else None,
+        "updated_at": row[9],
+        "whitelisted": json.loads(row[10] or "{}"),
+        "prefilter": json.loads(row[11] or "{}"),
+    }
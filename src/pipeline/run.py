@@ -1,30 +1,211 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Dict, Callable, Optional, List
+from typing import Dict, Callable, Optional, List, Iterable, Iterator, Set, Tuple, Union
 from datetime import datetime
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Executor, Future, wait, FIRST_COMPLETED
 from rich import print as rprint
+import multiprocessing
+import os
+import shutil
 import time
 
-from .io_utils import discover_input_files, read_text_file, write_markdown_file, sha256_of_text, slugify_title
+from .io_utils import discover_input_files, iter_input_files, read_text_file, write_markdown_file, sha256_of_text, slugify_title
 from .normalize import normalize_text
-from .clean import remove_templates, normalize_lists, wrap_logs, filter_user_comments
-from .anonymize import anonymize_text
-## dedup отключён
+from .clean import remove_templates, normalize_lists, wrap_logs, filter_user_comments, configured_patterns
+from .anonymize import SpanProtector, anonymize_regions, anonymize_text, carry_residual, diff_lines, enabled_entities, line_numbers
+from .secret_scan import EntropySecretDetector
+from .person import PersonDetector
+from .safe_regex import RegexPolicy, RegexTimeoutError, preflight
+from .dedup import DedupDecision, DedupFingerprint, DedupIndex, Fingerprinter, write_clusters_report
 from .markdown import render_front_matter, render_markdown, FrontMatter, format_markdown
 from .llm import postprocess_with_llm
 from .images import enrich_text_with_image_explanations, enrich_text_with_image_explanations_report
 from .metadata import extract_metadata, metadata_section_ru
 from .anonymize import detect_residual_pii
+from .manifest import ProcessingManifest, InputFingerprint, ManifestEntry, config_fingerprint, sha256_of_file
+from .cache import EncodingCache, ResponseCache
+from .reports import open_report_store, new_run_id
+from .perf import DocPerf, RunPerf, write_perf_report
+from .profiling import PipelineProfiler
 
 
 class FileResult:
-    def __init__(self, input_path: Path, output_path: Optional[Path], doc_id: str, title: str, duplicate: bool):
+    def __init__(self, input_path: Path, output_path: Optional[Path], doc_id: str, title: str, duplicate: bool, skipped: bool = False):
         self.input_path = input_path
         self.output_path = output_path
         self.doc_id = doc_id
         self.title = title
         self.duplicate = duplicate
+        self.skipped = skipped
+
+    def to_dict(self) -> Dict:
+        return {
+            "input_path": str(self.input_path),
+            "output_path": str(self.output_path) if self.output_path else None,
+            "doc_id": self.doc_id,
+            "title": self.title,
+            "duplicate": self.duplicate,
+            "skipped": self.skipped,
+        }
+
+
+class _StopRequested(Exception):
+    """Остановка по запросу control.should_stop() посреди обработки файла."""
+
+
+class _RunContext:
+    """Неизменяемые параметры запуска; передаётся в процессы‑воркеры один раз."""
+
+    def __init__(
+        self,
+        output_dir: Path,
+        cfg: Dict,
+        dry_run: bool,
+        system_prompt: str,
+        user_prompt: str,
+        llm_cache: Optional[ResponseCache] = None,
+        vision_cache: Optional[ResponseCache] = None,
+    ):
+        self.output_dir = output_dir
+        self.cfg = cfg
+        self.dry_run = dry_run
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.llm_cache = llm_cache
+        self.vision_cache = vision_cache
+        # Что обезличивание оставляет: временные метки, блоки кода, белый список pii.whitelists
+        self.pii_protector = SpanProtector.from_config(cfg.get("pii") or {})
+        self.pii_entities = enabled_entities(cfg.get("pii") or {})
+        # Секреты по энтропии (secrets.detect_secrets); None — выключено
+        self.secret_detector = EntropySecretDetector.from_config(cfg)
+        # Имена (PERSON) через natasha; None — выключено в pii.entities или natasha не установлена
+        self.person_detector = PersonDetector.from_config(cfg.get("pii") or {})
+        # Бюджеты времени регулярных выражений (секция regex)
+        self.regex_policy = RegexPolicy.from_config(cfg)
+        # Отпечатки для дубликатов считаются в CPU‑стадии; индекс открывает iter_process,
+        # он работает только в родительском процессе
+        self.dedup_fingerprinter = Fingerprinter.from_config(cfg.get("dedup") or {}) if _dedup_enabled(cfg) else None
+        self.dedup_index: Optional[DedupIndex] = None
+        self.dedup_policy = str((cfg.get("dedup") or {}).get("policy", "drop")).lower()
+        # Побайтовые копии уже обработанных файлов: link — ссылка, copy — копия готовых выходов, off — общий путь
+        self.dedup_exact_output = str((cfg.get("dedup") or {}).get("exact_output", "link")).lower()
+        # Кодировки не‑UTF‑8 файлов между запусками; открывает iter_process (в dry-run — нет)
+        self.encoding_cache: Optional[EncodingCache] = None
+
+    def __getstate__(self) -> Dict:
+        # В процессы‑воркеры уходит без соединения с индексом: стадия dedup идёт в родителе
+        state = self.__dict__.copy()
+        state["dedup_index"] = None
+        return state
+
+
+class _FileOutcome:
+    """Результат обработки одного файла + данные для отчётов, которые пишет родительский процесс."""
+
+    def __init__(
+        self,
+        result: FileResult,
+        pii_counts1: Dict[str, int],
+        pii_counts2: Dict[str, int],
+        residual: Dict[str, int],
+        outputs: Optional[List[str]] = None,
+        fingerprint: Optional[InputFingerprint] = None,
+        counters: Optional[Dict[str, int]] = None,
+        images_report: Optional[Dict] = None,
+        perf: Optional[DocPerf] = None,
+        pii_whitelisted: Optional[Dict[str, int]] = None,
+        regex_timeouts: Optional[List[Dict]] = None,
+        short_circuit: bool = False,
+        duplicate_of: Optional[DedupDecision] = None,
+        pii_prefilter: Optional[Dict[str, List[str]]] = None,
+    ):
+        self.result = result
+        self.pii_counts1 = pii_counts1
+        self.pii_counts2 = pii_counts2
+        self.residual = residual
+        self.outputs = outputs or []
+        self.fingerprint = fingerprint
+        # Счётчики документа (попадания в кэши и т.п.), суммируются в статистике запуска
+        self.counters = counters or {}
+        self.images_report = images_report
+        self.perf = perf
+        # Найдено, но оставлено по белому списку pii.whitelists (оба прохода)
+        self.pii_whitelisted = pii_whitelisted or {}
+        # Превышения бюджета времени регулярными выражениями: шаблон, стадия, файл
+        self.regex_timeouts = regex_timeouts or []
+        # Дубликат при dedup.policy drop/link: стадии после dedup не выполнялись, отчётов PII нет
+        self.short_circuit = short_circuit
+        self.duplicate_of = duplicate_of
+        # Правила PII, которые префильтр не запускал, по проходам: {"pass1": [...], "pass2": [...]}
+        self.pii_prefilter = pii_prefilter or {}
+
+
+class _InputItem:
+    """Входной файл с решением манифеста: skip — запись о прошлой обработке, если файл не изменился.
+
+    exact — файл побайтово совпадает с уже проиндексированным (cached_outputs — его готовые выходы).
+    """
+
+    def __init__(
+        self,
+        index: int,
+        path: Path,
+        fingerprint: Optional[InputFingerprint] = None,
+        skip: Optional[ManifestEntry] = None,
+        raw_hash: Optional[bytes] = None,
+        exact: Optional[DedupDecision] = None,
+        cached_outputs: Optional[List[str]] = None,
+    ):
+        self.index = index
+        self.path = path
+        self.fingerprint = fingerprint
+        self.skip = skip
+        self.raw_hash = raw_hash
+        self.exact = exact
+        self.cached_outputs = cached_outputs or []
+
+
+class _DocState:
+    """Промежуточное состояние документа между стадиями (должно сериализоваться pickle)."""
+
+    def __init__(
+        self,
+        path: Path,
+        index: int,
+        total: Optional[int],
+        fingerprint: Optional[InputFingerprint] = None,
+        raw_hash: Optional[bytes] = None,
+    ):
+        self.path = path
+        self.index = index
+        self.total = total
+        self.fingerprint = fingerprint
+        # sha256 сырых байтов файла (для индекса точных дубликатов)
+        self.raw_hash = raw_hash
+        self.counters: Dict[str, int] = {}
+        self.perf = DocPerf()
+        self.failed = False
+        self.checksum = ""
+        self.text = ""
+        self.text_with_image_explanations = ""
+        self.images_report: Optional[Dict] = None
+        self.pii_counts1: Dict[str, int] = {}
+        # Остаточная PII прохода 1: (номер строки в md_pass1, ключ residual)
+        self.pii_residual1_lines: List[Tuple[int, str]] = []
+        self.pii_whitelisted: Dict[str, int] = {}
+        self.regex_timeouts: List[Dict] = []
+        # Отпечатки (стадия prepare), группа дубликатов и найденный оригинал, если документ — дубликат
+        self.dedup_fp: Optional[DedupFingerprint] = None
+        self.dedup_group_id: Optional[str] = None
+        self.duplicate_of: Optional[DedupDecision] = None
+        self.doc_id = ""
+        self.title = ""
+        self.md = ""
+        # Markdown до LLM (уже обезличенный проходом 1): проход 2 проверяет только отличия от него
+        self.md_pass1: Optional[str] = None
+        self.outcome: Optional[_FileOutcome] = None
 
 
 def process_directory(
@@ -34,255 +215,1074 @@ def process_directory(
     dry_run: bool = False,
     progress_cb: Optional[Callable[[Dict], None]] = None,
     control: Optional[object] = None,
+    workers: Optional[int] = None,
+    io_pipeline: Optional[bool] = None,
+    force: bool = False,
+    keep_results: bool = True,
+    profile: bool = False,
 ) -> Dict:
-    files: List[Path] = discover_input_files(input_dir)
+    """Обрабатывает папку целиком и возвращает статистику запуска.
+
+    keep_results=False не накапливает список результатов (для очень больших экспортов).
+    """
+    stats: Dict = {}
+    results: List[Dict] = []
+    for result in iter_process(input_dir, output_dir, cfg, dry_run=dry_run, progress_cb=progress_cb, control=control,
+                               workers=workers, io_pipeline=io_pipeline, force=force, stats=stats, profile=profile):
+        if keep_results:
+            results.append(result)
+    stats["results"] = results
+    return stats
+
+
+def iter_process(
+    input_dir: Path,
+    output_dir: Path,
+    cfg: Dict,
+    dry_run: bool = False,
+    progress_cb: Optional[Callable[[Dict], None]] = None,
+    control: Optional[object] = None,
+    workers: Optional[int] = None,
+    io_pipeline: Optional[bool] = None,
+    force: bool = False,
+    stats: Optional[Dict] = None,
+    profile: bool = False,
+) -> Iterator[Dict]:
+    """Потоковая обработка: файлы обнаруживаются лениво, результаты выдаются по мере готовности.
+
+    Память не растёт с размером корпуса: в работе одновременно не больше
+    execution.max_inflight документов. Общее число файлов заранее неизвестно,
+    поэтому в событиях прогресса total=None. Статистика запуска накапливается
+    в переданном словаре stats (итоговые поля дописываются по завершении).
+    profile=True — последовательный прогон под cProfile/tracemalloc с отчётом в reports/profile/<run_id>/.
+    """
+    stats = stats if stats is not None else {}
+    files = iter_input_files(input_dir)
     state_dir = Path(cfg["io"].get("state_dir", "state"))
     reports_dir = Path(cfg["io"].get("reports_dir", "reports"))
-    (reports_dir / "pii").mkdir(parents=True, exist_ok=True)
-    (reports_dir / "validation").mkdir(parents=True, exist_ok=True)
-    # dedup отключён
-
-    processed = 0
-    # skipped_duplicates больше не используется
-    results: List[FileResult] = []
 
     # Загрузка промптов LLM
     system_prompt = Path(cfg["llm"]["system_prompt_path"]).read_text(encoding="utf-8") if cfg.get("llm", {}).get("enabled") else ""
     user_prompt = Path(cfg["llm"]["user_prompt_path"]).read_text(encoding="utf-8") if cfg.get("llm", {}).get("enabled") else ""
 
-    total = len(files)
-    for idx, path in enumerate(files, start=1):
-        if control:
-            if getattr(control, "should_stop", lambda: False)():
-                break
-            if hasattr(control, "wait_if_paused"):
-                control.wait_if_paused()
+    llm_cache = ResponseCache.from_config(state_dir, "llm_cache", cfg["llm"].get("cache")) if cfg.get("llm", {}).get("enabled") else None
+    vision_cache = ResponseCache.from_config(state_dir, "vision_cache", cfg["images"].get("cache")) if (cfg.get("images", {}) or {}).get("enabled", False) else None
+    ctx = _RunContext(output_dir, cfg, dry_run, system_prompt, user_prompt, llm_cache, vision_cache)
+    if not dry_run:
+        ctx.encoding_cache = EncodingCache(state_dir / "encodings.sqlite")
+    if _dedup_enabled(cfg):
+        # В dry-run индекс в памяти: дубликаты внутри запуска видны, state_dir не меняется
+        ctx.dedup_index = DedupIndex.from_config(None if dry_run else state_dir, cfg.get("dedup") or {})
+        # Хэш токенов simhash — тот, которым посчитаны отпечатки в индексе
+        ctx.dedup_fingerprinter = ctx.dedup_index.fingerprinter
+    counters: Dict[str, int] = {}
+    run_perf = RunPerf()
+    n_workers = resolve_workers(cfg, workers)
+    if io_pipeline is None:
+        io_pipeline = bool((cfg.get("execution", {}) or {}).get("io_pipeline", False))
+    profiler = PipelineProfiler() if profile else None
+    if profiler is not None:
+        # Профили стадий снимаются в одном процессе без перекрытия стадий
+        n_workers, io_pipeline = 1, False
+    run_id = new_run_id()
+    stats.update({"run_id": run_id, "processed": 0, "skipped_unchanged": 0, "workers": n_workers, "io_pipeline": bool(io_pipeline)})
+    stats["person_ner"] = ctx.person_detector is not None
+    # regex.preflight: off — без проверки, как и при загрузке конфига; иначе находки для событий
+    # и статистики (check_pattern кэширует результат, шаблоны не пробуются повторно)
+    preflight_mode = str((cfg.get("regex") or {}).get("preflight", "warn")).lower()
+    stats["regex_preflight"] = [] if preflight_mode == "off" else preflight(configured_patterns(cfg))
+    for found in stats["regex_preflight"]:
         if progress_cb:
-            progress_cb({"event": "file_start", "file": str(path), "index": idx, "total": total})
-        try:
-            raw = read_text_file(path)
-        except Exception as e:
+            progress_cb({"event": "warn", "file": None, "stage": "regex_preflight",
+                         "message": f"{found['name']}: {found['problem']} — {found['detail']}"})
+    regex_timeouts: List[Dict] = []
+    clusters: Dict[str, Dict] = {}
+    if ctx.person_detector is None and (ctx.pii_entities is None or "PERSON" in ctx.pii_entities) and progress_cb:
+        progress_cb({"event": "warn", "file": None, "stage": "person_ner",
+                     "message": "PERSON включён в pii.entities, но natasha не установлена — имена не маскируются"})
+    # Отчёты пишет только родительский процесс: одна база (или прежние файлы при io.report_backend: files)
+    report_store = open_report_store(reports_dir, cfg["io"].get("report_backend", "sqlite"))
+    report_store.begin_run(run_id)
+
+    # Манифест инкрементальных запусков: в dry-run ничего не пишется, поэтому и не пропускается.
+    # Перед его фиксацией фиксируется индекс дубликатов: отпечатки файла — не позже записи о нём
+    before_commit = ctx.dedup_index.flush if ctx.dedup_index is not None else None
+    manifest = ProcessingManifest(state_dir, before_commit=before_commit) if not dry_run else None
+    config_hash = config_fingerprint(cfg, system_prompt, user_prompt)
+    total = None
+    exact_index = ctx.dedup_index if ctx.dedup_exact_output in ("link", "copy") else None
+    items = _iter_input_items(files, manifest, config_hash, force, exact_index)
+
+    def exact_outputs(decision: DedupDecision) -> List[str]:
+        # Готовые выходы канонического документа — только от той же конфигурации. Смотрятся
+        # перед выдачей копии: канонический документ этого запуска к тому времени записан в манифест
+        canonical = manifest.get(Path(decision.canonical_path)) if manifest is not None else None
+        if canonical is not None and canonical.config_hash == config_hash and all(os.path.exists(p) for p in canonical.outputs):
+            return canonical.outputs
+        return []
+
+    if io_pipeline:
+        outcomes = _iter_staged(items, total, ctx, _pipeline_plan(cfg), n_workers, progress_cb, control, exact_outputs)
+    elif n_workers > 1:
+        outcomes = _iter_staged(items, total, ctx, _pipeline_plan(cfg, overlap_io=False), n_workers, progress_cb, control, exact_outputs)
+    else:
+        outcomes = _iter_sequential(items, total, ctx, progress_cb, control, profiler, exact_outputs)
+
+    if profiler is not None:
+        profiler.start()
+    try:
+        for idx, outcome in outcomes:
+            r = outcome.result
+            for name, n in outcome.counters.items():
+                counters[name] = counters.get(name, 0) + n
+            regex_timeouts.extend(outcome.regex_timeouts)
+            if outcome.duplicate_of is not None:
+                _add_to_cluster(clusters, str(r.input_path), outcome.duplicate_of)
+            if r.skipped:
+                stats["skipped_unchanged"] += 1
+            else:
+                if not outcome.short_circuit:
+                    _write_reports(report_store, run_id, outcome, progress_cb)
+                if outcome.perf is not None:
+                    run_perf.add(str(r.input_path), outcome.perf)
+                stats["processed"] += 1
+                if manifest is not None and outcome.fingerprint is not None:
+                    manifest.record(r.input_path, outcome.fingerprint, config_hash, r.doc_id, r.title, outcome.outputs)
+            if ctx.dedup_index is not None:
+                ctx.dedup_index.flush_if_due()
             if progress_cb:
-                progress_cb({"event": "error", "file": str(path), "message": str(e)})
+                progress_cb({
+                    "event": "file_end",
+                    "file": str(r.input_path),
+                    "duplicate": r.duplicate,
+                    "skipped": r.skipped,
+                    "index": idx,
+                    "total": total,
+                    "output_path": str(r.output_path) if r.output_path else None,
+                })
+            yield r.to_dict()
+    finally:
+        if manifest is not None:
+            manifest.close()
+        report_store.flush()
+        if llm_cache is not None:
+            stats["llm_cache"] = {
+                "hits": counters.get("llm_cache_hits", 0),
+                "misses": counters.get("llm_cache_misses", 0),
+                "evicted": llm_cache.evict(),
+            }
+            llm_cache.close()
+        if vision_cache is not None:
+            stats["vision_cache"] = {
+                "hits": counters.get("vision_cache_hits", 0),
+                "misses": counters.get("vision_cache_misses", 0),
+                "evicted": vision_cache.evict(),
+            }
+            vision_cache.close()
+        if ctx.encoding_cache is not None:
+            ctx.encoding_cache.close()
+        stats["pii_prefilter"] = _prefilter_stats(counters)
+        stats["regex_timeouts"] = {"total": len(regex_timeouts), "items": regex_timeouts[:_REGEX_TIMEOUTS_LIMIT]}
+        if ctx.dedup_index is not None:
+            stats["dedup"] = {
+                "policy": ctx.dedup_policy,
+                "simhash_threshold_bits": ctx.dedup_index.bands.threshold_bits,
+                "minhash_jaccard_threshold": ctx.dedup_index.minhash_bands.threshold if ctx.dedup_index.minhash_bands else None,
+                "duplicates": counters.get("dedup_duplicates", 0),
+                "exact": counters.get("dedup_exact", 0),
+                "clusters": len(clusters),
+                "indexed": len(ctx.dedup_index),
+            }
+            ctx.dedup_index.close()
+            try:
+                stats["dedup_report"] = str(write_clusters_report(reports_dir, run_id, clusters))
+            except OSError:
+                pass
+        if profiler is not None:
+            profiler.stop()
+            try:
+                stats["profile"] = profiler.write(reports_dir / "profile" / run_id)
+            except OSError:
+                pass
+        stats["perf"] = run_perf.summary()
+        try:
+            stats["perf_report"] = str(write_perf_report(reports_dir, run_id, stats["perf"]))
+        except OSError:
+            pass
+        report_store.finish_run(run_id, stats)
+        report_store.close()
+
+
+def _iter_input_items(
+    files: Iterable[Path],
+    manifest: Optional[ProcessingManifest],
+    config_hash: str,
+    force: bool,
+    exact_index: Optional[DedupIndex] = None,
+) -> Iterator[_InputItem]:
+    for idx, path in enumerate(files, start=1):
+        entry, fp = None, None
+        if manifest is not None:
+            try:
+                if force:
+                    st = path.stat()
+                    fp = InputFingerprint(st.st_size, st.st_mtime_ns, None)
+                else:
+                    entry, fp = manifest.check(path, config_hash)
+            except OSError:
+                # Ошибку чтения покажет стадия prepare
+                pass
+        if entry is not None or exact_index is None:
+            yield _InputItem(idx, path, fp, entry)
+            continue
+        # Побайтовая копия уже обработанного файла отсекается сразу после чтения — до
+        # декодирования и всех стадий. sha256 файла манифест всё равно считает при записи
+        try:
+            digest = fp.sha256 if fp is not None and fp.sha256 else sha256_of_file(path)
+        except OSError:
+            yield _InputItem(idx, path, fp, entry)
             continue
+        if fp is not None:
+            fp.sha256 = digest
+        raw_hash = bytes.fromhex(digest)
+        yield _InputItem(idx, path, fp, entry, raw_hash, exact_index.check_raw(raw_hash, str(path)))
 
-        # Нормализация
-        if progress_cb:
-            progress_cb({"event": "stage", "file": str(path), "stage": "normalize"})
-        if control:
-            if getattr(control, "should_stop", lambda: False)():
-                break
-            if hasattr(control, "wait_if_paused"):
-                control.wait_if_paused()
-        text = normalize_text(raw, cfg["formatting"].get("unwrap_broken_lines", True))
-        # Очистка
-        if progress_cb:
-            progress_cb({"event": "stage", "file": str(path), "stage": "clean"})
-        if control:
-            if getattr(control, "should_stop", lambda: False)():
+
+def _exact_outcome(item: _InputItem, ctx: _RunContext, emit: Callable[[Dict], None]) -> _FileOutcome:
+    """Побайтовая копия: вместо обработки — ссылка на канонический документ или копия его выходов."""
+    path, decision = item.path, item.exact
+    perf = DocPerf()
+    perf.start("dedup_exact")
+    counters = {"dedup_duplicates": 1, "dedup_exact": 1}
+    emit({
+        "event": "dedup",
+        "file": str(path),
+        "canonical_id": decision.canonical_id,
+        "canonical_path": decision.canonical_path,
+        "method": decision.method,
+        "distance": decision.distance,
+        "similarity": decision.similarity,
+        "policy": ctx.dedup_exact_output,
+    })
+    outputs: List[str] = []
+    if not ctx.dry_run:
+        canonical_stem = Path(decision.canonical_path).stem
+        if ctx.dedup_exact_output == "copy" and item.cached_outputs:
+            for src in item.cached_outputs:
+                # <stem>.md, <stem>_srs.md канонического документа → те же имена от имени копии
+                name = Path(src).name
+                dst = ctx.output_dir / (path.stem + name[len(canonical_stem):] if name.startswith(canonical_stem) else name)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(src, dst)
+                outputs.append(str(dst))
+                perf.bytes_out += dst.stat().st_size
+        else:
+            # link, а также copy, пока у канонического документа нет готовых выходов этой конфигурации
+            out_file = ctx.output_dir / f"{path.stem}.md"
+            link_text = _duplicate_link_markdown(path, decision.canonical_id or "", "", decision, ctx.cfg)
+            write_markdown_file(out_file, link_text)
+            outputs.append(str(out_file))
+            perf.bytes_out += len(link_text.encode("utf-8"))
+    perf.stop()
+    out_file = Path(outputs[0]) if outputs else None
+    title = f"Дубликат: {Path(decision.canonical_path).name}"
+    return _FileOutcome(
+        FileResult(path, out_file, decision.canonical_id or "", title, True),
+        {}, {}, {}, outputs, item.fingerprint, counters,
+        perf=perf, short_circuit=True, duplicate_of=decision,
+    )
+
+
+def _skipped_outcome(item: _InputItem) -> _FileOutcome:
+    entry = item.skip
+    out_file = Path(entry.outputs[0]) if entry.outputs else None
+    return _FileOutcome(FileResult(item.path, out_file, entry.doc_id, entry.title, False, skipped=True), {}, {}, {}, entry.outputs, item.fingerprint)
+
+
+def resolve_workers(cfg: Dict, workers: Optional[int] = None) -> int:
+    """Число процессов: явный аргумент > execution.workers из конфига > 1. 0 — по числу ядер."""
+    if workers is None:
+        workers = (cfg.get("execution", {}) or {}).get("workers", 1)
+        workers = 1 if workers is None else int(workers)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, workers)
+
+
+def _iter_sequential(
+    items: Iterator[_InputItem],
+    total: Optional[int],
+    ctx: _RunContext,
+    progress_cb: Optional[Callable[[Dict], None]],
+    control: Optional[object],
+    profiler: Optional[PipelineProfiler] = None,
+    exact_outputs: Optional[Callable[[DedupDecision], List[str]]] = None,
+) -> Iterator[Tuple[int, _FileOutcome]]:
+    emit = progress_cb or _noop_emit
+    for item in items:
+        try:
+            if item.skip is not None:
+                _check_control(control)
+                outcome = _skipped_outcome(item)
+            elif item.exact is not None:
+                _check_control(control)
+                if exact_outputs is not None:
+                    item.cached_outputs = exact_outputs(item.exact)
+                outcome = _exact_outcome(item, ctx, emit)
+            else:
+                if profiler is not None:
+                    profiler.begin_file()
+                outcome = _process_file(item, total, ctx, emit, lambda: _check_control(control), profiler)
+                if profiler is not None:
+                    profiler.end_file(str(item.path), outcome.perf.bytes_in if outcome is not None else 0)
+        except _StopRequested:
+            break
+        if outcome is not None:
+            yield item.index, outcome
+
+
+# --- Параллельный и конвейерный режимы ---------------------------------------
+# Документ проходит группы стадий (план). CPU‑группы выполняются в пуле
+# процессов (или в отдельном потоке при workers=1), сетевые (images, llm) —
+# в пулах потоков, размер которых задаёт лимит одновременных запросов к
+# каждому бэкенду. Пока файл N ждёт ответа LLM, для файлов N+k идут CPU‑стадии.
+# События прогресса буферизуются и воспроизводятся в порядке входных файлов,
+# поэтому progress_cb и результаты идут так же, как при последовательной
+# обработке. Пауза/остановка транслируются в стадии через multiprocessing.Event
+# и проверяются на тех же границах стадий.
+
+_ALL_STAGES = ("prepare", "dedup", "images", "build", "llm", "finalize")
+
+_WORKER_CTX: Optional[_RunContext] = None
+_WORKER_STOP = None
+_WORKER_PAUSE = None
+
+
+def _pipeline_plan(cfg: Dict, overlap_io: bool = True) -> List[Tuple[str, Tuple[str, ...]]]:
+    """Группы стадий: соседние CPU‑стадии объединяются в одно задание.
+
+    dedup — отдельная группа в родительском процессе (единственный писатель индекса).
+    overlap_io=False — images и llm выполняются вместе с CPU‑стадиями (режим без io_pipeline).
+    """
+    plan: List[Tuple[str, Tuple[str, ...]]] = []
+    cpu: List[str] = []
+    for stage in _ALL_STAGES:
+        if stage == "dedup" or (overlap_io and stage in ("images", "llm")):
+            enabled = _dedup_enabled(cfg) if stage == "dedup" else (cfg.get(stage, {}) or {}).get("enabled", False)
+            if not enabled:
+                continue
+            if cpu:
+                plan.append(("cpu", tuple(cpu)))
+                cpu = []
+            plan.append((stage, (stage,)))
+        else:
+            cpu.append(stage)
+    if cpu:
+        plan.append(("cpu", tuple(cpu)))
+    return plan
+
+
+def _dedup_enabled(cfg: Dict) -> bool:
+    return bool((cfg.get("dedup") or {}).get("enabled", True))
+
+
+def _init_worker(ctx: _RunContext, stop_evt, pause_evt) -> None:
+    global _WORKER_CTX, _WORKER_STOP, _WORKER_PAUSE
+    _WORKER_CTX = ctx
+    _WORKER_STOP = stop_evt
+    _WORKER_PAUSE = pause_evt
+
+
+def _wait_events(stop_evt, pause_evt) -> None:
+    if stop_evt is not None and stop_evt.is_set():
+        raise _StopRequested()
+    while pause_evt is not None and pause_evt.is_set():
+        if stop_evt is not None and stop_evt.is_set():
+            raise _StopRequested()
+        time.sleep(0.1)
+
+
+def _run_stages(
+    stages: Tuple[str, ...],
+    state: _DocState,
+    ctx: Optional[_RunContext] = None,
+    stop_evt=None,
+    pause_evt=None,
+) -> Tuple[_DocState, List[Dict], bool]:
+    """Выполняет группу стадий; в процессе‑воркере контекст берётся из инициализатора."""
+    if ctx is None:
+        ctx, stop_evt, pause_evt = _WORKER_CTX, _WORKER_STOP, _WORKER_PAUSE
+    events: List[Dict] = []
+    try:
+        for stage in stages:
+            _call_stage(stage, state, ctx, events.append, lambda: _wait_events(stop_evt, pause_evt))
+            if state.failed or state.outcome is not None:
                 break
-            if hasattr(control, "wait_if_paused"):
-                control.wait_if_paused()
-        text = remove_templates(text, cfg["cleaning"].get("remove_templates", []))
-        text = normalize_lists(text)
-        text = wrap_logs(text, cfg["formatting"].get("max_line_length", 160))
-        # Фильтрация комментариев от заданных пользователей
-        users_to_filter = (cfg.get("filtering", {}) or {}).get("users_to_filter", [])
-        if users_to_filter:
-            text = filter_user_comments(text, users_to_filter)
-        # Обогащение текстов пояснениями к изображениям
-        if (cfg.get("images", {}) or {}).get("enabled", False):
-            if progress_cb:
-                progress_cb({"event": "stage", "file": str(path), "stage": "images"})
-            if control:
-                if getattr(control, "should_stop", lambda: False)():
-                    break
-                if hasattr(control, "wait_if_paused"):
+    except _StopRequested:
+        return state, events, True
+    finally:
+        # Время ожидания между группами стадий в замер не попадает
+        state.perf.stop()
+    return state, events, False
+
+
+def _iter_staged(
+    items: Iterator[_InputItem],
+    total: Optional[int],
+    ctx: _RunContext,
+    plan: List[Tuple[str, Tuple[str, ...]]],
+    workers: int,
+    progress_cb: Optional[Callable[[Dict], None]],
+    control: Optional[object],
+    exact_outputs: Optional[Callable[[DedupDecision], List[str]]] = None,
+) -> Iterator[Tuple[int, _FileOutcome]]:
+    cfg = ctx.cfg
+    exec_cfg = cfg.get("execution", {}) or {}
+    mp_ctx = multiprocessing.get_context()
+    stop_evt = mp_ctx.Event()
+    pause_evt = mp_ctx.Event()
+
+    executors: Dict[str, Executor] = {}
+    if workers > 1:
+        executors["cpu"] = ProcessPoolExecutor(max_workers=workers, mp_context=mp_ctx, initializer=_init_worker, initargs=(ctx, stop_evt, pause_evt))
+    else:
+        executors["cpu"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cpu")
+    io_slots = 0
+    for kind, _ in plan:
+        if kind != "cpu" and kind not in executors:
+            # индекс дубликатов — один поток: решения принимаются по одному документу
+            limit = 1 if kind == "dedup" else max(1, int((cfg.get(kind, {}) or {}).get("concurrency", 2) or 1))
+            executors[kind] = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=kind)
+            io_slots += limit
+    # Лимит документов «в работе» (включая готовые, ждущие своей очереди на выдачу):
+    # ограничивает память буфера переупорядочивания
+    max_inflight = int(exec_cfg.get("max_inflight") or (workers * 2 + io_slots))
+
+    def submit(state: _DocState, step: int) -> Future:
+        kind, stages = plan[step]
+        if kind == "cpu" and workers > 1:
+            fut = executors["cpu"].submit(_run_stages, stages, state)
+        else:
+            fut = executors[kind].submit(_run_stages, stages, state, ctx, stop_evt, pause_evt)
+        running[fut] = (state.index, step)
+        return fut
+
+    # Решения индекса дубликатов принимаются в порядке входных файлов, как при
+    # последовательной обработке: документ i уходит в dedup, только когда все j < i
+    # его прошли (или завершились раньше). Иначе канонический документ группы
+    # зависел бы от того, чья подготовка закончилась первой
+    dedup_step = next((step for step, (kind, _) in enumerate(plan) if kind == "dedup"), None)
+    waiting: Dict[int, _DocState] = {}
+    passed: Set[int] = set()
+    dedup_next = 1
+    dedup_busy = False
+
+    def release() -> None:
+        nonlocal dedup_next, dedup_busy
+        while dedup_step is not None and not dedup_busy:
+            if dedup_next in passed:
+                passed.discard(dedup_next)
+                dedup_next += 1
+                continue
+            state = waiting.pop(dedup_next, None)
+            if state is None:
+                return
+            exact = None
+            if ctx.dedup_exact_output in ("link", "copy") and state.raw_hash is not None:
+                # Побайтовая копия документа, прошедшего dedup уже после чтения этого файла
+                exact = ctx.dedup_index.check_raw(state.raw_hash, str(state.path))
+            if exact is not None:
+                events_by_idx[state.index] = []
+                finished[state.index] = _InputItem(state.index, state.path, state.fingerprint, None, state.raw_hash, exact)
+                passed.add(state.index)
+            else:
+                submit(state, dedup_step)
+                dedup_busy = True
+
+    queue = iter(items)
+    exhausted = False
+    running: Dict[Future, Tuple[int, int]] = {}
+    events_by_idx: Dict[int, List[Dict]] = {}
+    # Побайтовые копии (_InputItem) превращаются в результат при выдаче: к этому
+    # моменту канонический документ уже записан в манифест, и его выходы можно скопировать
+    finished: Dict[int, Union[_FileOutcome, _InputItem, None]] = {}
+    next_emit = 1
+    admitted = 0
+    try:
+        while True:
+            _sync_control(control, stop_evt, pause_evt)
+            while not exhausted and not stop_evt.is_set() and admitted - (next_emit - 1) < max_inflight:
+                if hasattr(control, "wait_if_paused") and not hasattr(control, "is_paused"):
                     control.wait_if_paused()
-            try:
-                # Версия с отчётом — для записи подробностей и визуализации в UI
-                if progress_cb:
-                    progress_cb({"event": "images", "file": str(path), "substage": "discover"})
-                text, images_report = enrich_text_with_image_explanations_report(text, path, cfg)
-                if progress_cb:
-                    # Передадим основные факты: сколько изображений и вставок
-                    progress_cb({
-                        "event": "images",
-                        "file": str(path),
-                        "substage": "result",
-                        "images": len(images_report.get("images") or []),
-                        "calls": len(images_report.get("calls") or []),
-                        "insertions": len(images_report.get("insertions") or []),
-                    })
-                # Сохраняем вариант исходного текста с внедрёнными пояснениями к изображениям
-                text_with_image_explanations = text
-                # Пишем отчёт в reports/images/<doc_id>.json после вычисления doc_id
-                _images_report_buffer = images_report
-            except Exception as e:
+                if pause_evt.is_set():
+                    break
+                item = next(queue, None)
+                if item is None:
+                    exhausted = True
+                    break
+                admitted += 1
+                events_by_idx[item.index] = []
+                if item.skip is not None:
+                    finished[item.index] = _skipped_outcome(item)
+                    passed.add(item.index)
+                elif item.exact is not None:
+                    finished[item.index] = item
+                    passed.add(item.index)
+                else:
+                    submit(_DocState(item.path, item.index, total, item.fingerprint, item.raw_hash), 0)
+            release()
+            if not running and (exhausted or stop_evt.is_set()) and next_emit not in finished:
+                break
+            done = set()
+            if running:
+                done, _ = wait(list(running), timeout=0.1, return_when=FIRST_COMPLETED)
+            elif pause_evt.is_set():
+                time.sleep(0.1)
+            if ctx.dedup_index is not None:
+                # Пока документы ждут LLM, пачка индекса дубликатов не держит блокировку записи
+                ctx.dedup_index.flush_if_due()
+            for fut in done:
+                idx, step = running.pop(fut)
+                state, events, stopped = fut.result()
+                events_by_idx[idx].extend(events)
+                if step == dedup_step:
+                    dedup_busy = False
+                if dedup_step is not None and step <= dedup_step:
+                    # Документ прошёл dedup или завершился до него
+                    if stopped or state.failed or state.outcome is not None or step == dedup_step:
+                        passed.add(idx)
+                if stopped or state.failed or state.outcome is not None or step + 1 >= len(plan):
+                    finished[idx] = None if stopped else state.outcome
+                elif step + 1 == dedup_step:
+                    waiting[idx] = state
+                else:
+                    submit(state, step + 1)
+            release()
+            # Выдаём результаты строго по порядку входных файлов
+            while next_emit in finished:
+                outcome = finished.pop(next_emit)
+                if isinstance(outcome, _InputItem):
+                    if exact_outputs is not None:
+                        outcome.cached_outputs = exact_outputs(outcome.exact)
+                    outcome = _exact_outcome(outcome, ctx, events_by_idx[next_emit].append)
                 if progress_cb:
-                    progress_cb({"event": "warn", "file": str(path), "stage": "images", "message": str(e)})
+                    for evt in events_by_idx.pop(next_emit, []):
+                        progress_cb(evt)
+                else:
+                    events_by_idx.pop(next_emit, None)
+                if outcome is not None:
+                    yield next_emit, outcome
+                next_emit += 1
+    finally:
+        stop_evt.set()
+        for ex in executors.values():
+            ex.shutdown(wait=True, cancel_futures=True)
 
-        # Обезличивание (проход 1)
-        if progress_cb:
-            progress_cb({"event": "stage", "file": str(path), "stage": "anonymize_pass1"})
-        if control:
-            if getattr(control, "should_stop", lambda: False)():
-                break
-            if hasattr(control, "wait_if_paused"):
-                control.wait_if_paused()
-        text, pii_report1 = anonymize_text(text)
-        # Извлечение метаданных на основе исходного текста
-        if progress_cb:
-            progress_cb({"event": "stage", "file": str(path), "stage": "extract_metadata"})
-        meta = extract_metadata(text)
 
-        # Идентификатор документа
-        doc_id = sha256_of_text(text)
+def _sync_control(control: Optional[object], stop_evt, pause_evt) -> None:
+    if not control:
+        return
+    if getattr(control, "should_stop", lambda: False)():
+        stop_evt.set()
+    is_paused = getattr(control, "is_paused", None)
+    if is_paused is not None:
+        if is_paused():
+            pause_evt.set()
+        else:
+            pause_evt.clear()
 
-        # Заголовок
-        title = _derive_title(text)
-        sections = cfg["template"].get("sections_ru", [])
 
-        # Базовый Markdown до LLM
-        if progress_cb:
-            progress_cb({"event": "stage", "file": str(path), "stage": "build_markdown"})
-        body_by_section = {sec: "" for sec in sections}
-        body_by_section[sections[0] if sections else "Резюме"] = text
-        if "Метаданные" in sections:
-            body_by_section["Метаданные"] = metadata_section_ru(meta)
-        md = render_markdown(title, sections, body_by_section)
-
-        # LLM постобработка
-        if cfg.get("llm", {}).get("enabled"):
-            if progress_cb:
-                progress_cb({"event": "stage", "file": str(path), "stage": "llm"})
-            if control:
-                if getattr(control, "should_stop", lambda: False)():
-                    break
-                if hasattr(control, "wait_if_paused"):
-                    control.wait_if_paused()
-            md_llm = postprocess_with_llm(md, system_prompt, user_prompt, cfg.get("llm", {}))
-            if md_llm:
-                md = md_llm
+def _check_control(control: Optional[object]) -> None:
+    if control:
+        if getattr(control, "should_stop", lambda: False)():
+            raise _StopRequested()
+        if hasattr(control, "wait_if_paused"):
+            control.wait_if_paused()
 
-        # Обезличивание (проход 2)
-        if progress_cb:
-            progress_cb({"event": "stage", "file": str(path), "stage": "anonymize_pass2"})
-        if control:
-            if getattr(control, "should_stop", lambda: False)():
+
+def _noop_emit(evt: Dict) -> None:
+    pass
+
+
+def _write_reports(store, run_id: str, outcome: _FileOutcome, progress_cb: Optional[Callable[[Dict], None]]) -> None:
+    r = outcome.result
+    store.add_document(
+        run_id,
+        r.doc_id,
+        str(r.input_path),
+        str(r.output_path) if r.output_path else None,
+        outcome.pii_counts1,
+        outcome.pii_counts2,
+        outcome.residual,
+        outcome.images_report,
+        outcome.pii_whitelisted,
+        outcome.pii_prefilter,
+    )
+    if outcome.images_report and progress_cb:
+        progress_cb({
+            "event": "images",
+            "file": str(r.input_path),
+            "substage": "report_written",
+            "doc_id": r.doc_id,
+            "report": outcome.images_report,
+        })
+
+
+def _add_to_cluster(clusters: Dict[str, Dict], path: str, decision: DedupDecision) -> None:
+    """Дубликат в группу своего канонического документа (отчёт reports/dedup/<run_id>.json)."""
+    cluster = clusters.setdefault(decision.canonical_id or "", {
+        "canonical_id": decision.canonical_id,
+        "canonical_path": decision.canonical_path,
+        "duplicates": [],
+    })
+    entry = {"path": path, "method": decision.method}
+    if decision.distance is not None:
+        entry["distance"] = decision.distance
+    if decision.similarity is not None:
+        entry["similarity"] = decision.similarity
+    cluster["duplicates"].append(entry)
+
+
+def _doc_prefilter(counters: Dict[str, int]) -> Dict[str, List[str]]:
+    """Пропуски префильтра PII одного документа (для его отчёта): правила по проходам."""
+    result: Dict[str, List[str]] = {}
+    for pass_name in ("pass1", "pass2"):
+        prefix = f"pii_skip_{pass_name}_"
+        result[pass_name] = sorted(k[len(prefix):] for k, v in counters.items() if k.startswith(prefix) and v)
+    return result
+
+
+def _prefilter_stats(counters: Dict[str, int]) -> Dict[str, Dict]:
+    """Сводка префильтра PII по проходам: число просмотренных текстов и пропуски по правилам."""
+    result: Dict[str, Dict] = {}
+    for pass_name in ("pass1", "pass2"):
+        prefix = f"pii_skip_{pass_name}_"
+        result[pass_name] = {
+            "scans": counters.get(f"pii_scans_{pass_name}", 0),
+            "skipped": {k[len(prefix):]: v for k, v in sorted(counters.items()) if k.startswith(prefix)},
+        }
+    return result
+
+
+# Сколько записей о таймаутах регулярных выражений хранить в статистике запуска
+_REGEX_TIMEOUTS_LIMIT = 200
+
+
+def _call_stage(stage: str, state: _DocState, ctx: _RunContext, emit: Callable[[Dict], None], checkpoint: Callable[[], None]) -> None:
+    """Стадия документа; таймаут регулярного выражения при regex.on_timeout: fail — ошибка файла."""
+    try:
+        _STAGE_FUNCS[stage](state, ctx, emit, checkpoint)
+    except RegexTimeoutError as e:
+        emit({"event": "error", "file": str(state.path), "stage": stage, "message": str(e)})
+        state.failed = True
+
+
+def _note_regex_timeouts(state: _DocState, emit: Callable[[Dict], None], stage: str, timeouts: List[Dict]) -> None:
+    """Таймауты регулярных выражений документа: предупреждение и запись для статистики запуска."""
+    for item in timeouts:
+        item = {"file": str(state.path), "stage": stage, **item}
+        state.regex_timeouts.append(item)
+        what = f"не проверено строк: {item['lines']}" if "lines" in item else "шаблон пропущен"
+        emit({"event": "warn", "file": str(state.path), "stage": stage,
+              "message": f"{item['pattern']}: превышен бюджет {item['timeout_sec']} с, {what}"})
+
+
+def _enter_stage(state: _DocState, emit: Callable[[Dict], None], stage: str) -> None:
+    """Событие о начале стадии + переключение замера времени."""
+    emit({"event": "stage", "file": str(state.path), "stage": stage})
+    state.perf.start(stage)
+
+
+def _process_file(
+    item: _InputItem,
+    total: Optional[int],
+    ctx: _RunContext,
+    emit: Callable[[Dict], None],
+    checkpoint: Callable[[], None],
+    profiler: Optional[PipelineProfiler] = None,
+) -> Optional[_FileOutcome]:
+    """Все стадии конвейера для одного файла. Отчёты PII/валидации пишет вызывающая сторона."""
+    state = _DocState(item.path, item.index, total, item.fingerprint, item.raw_hash)
+    try:
+        for stage in _ALL_STAGES:
+            with profiler.stage(stage) if profiler is not None else nullcontext():
+                _call_stage(stage, state, ctx, emit, checkpoint)
+            if state.failed:
+                return None
+            if state.outcome is not None:
                 break
-            if hasattr(control, "wait_if_paused"):
-                control.wait_if_paused()
-        md, pii_report2 = anonymize_text(md)
-        # Валидация на остаточную PII
-        if progress_cb:
-            progress_cb({"event": "stage", "file": str(path), "stage": "validate"})
-        residual = detect_residual_pii(md)
-        leakage = sum(residual.values())
+    finally:
+        state.perf.stop()
+    return state.outcome
+
+
+def _stage_prepare(state: _DocState, ctx: _RunContext, emit: Callable[[Dict], None], checkpoint: Callable[[], None]) -> None:
+    cfg = ctx.cfg
+    path = state.path
+    checkpoint()
+    emit({"event": "file_start", "file": str(path), "index": state.index, "total": state.total})
+    state.perf.start("read")
+    try:
+        raw = read_text_file(path, ctx.encoding_cache)
+        state.perf.bytes_in = state.fingerprint.size if state.fingerprint else path.stat().st_size
+    except Exception as e:
+        emit({"event": "error", "file": str(path), "message": str(e)})
+        state.failed = True
+        return
+    state.checksum = f"sha256:{sha256_of_text(raw)}"
+
+    # Нормализация
+    _enter_stage(state, emit, "normalize")
+    checkpoint()
+    text = normalize_text(raw, cfg["formatting"].get("unwrap_broken_lines", True))
+    # Очистка
+    _enter_stage(state, emit, "clean")
+    checkpoint()
+    timeouts: List[Dict] = []
+    text = remove_templates(text, cfg["cleaning"].get("remove_templates", []), ctx.regex_policy, timeouts)
+    text = normalize_lists(text)
+    text = wrap_logs(text, cfg["formatting"].get("max_line_length", 160))
+    # Фильтрация комментариев от заданных пользователей
+    users_to_filter = (cfg.get("filtering", {}) or {}).get("users_to_filter", [])
+    if users_to_filter:
+        text = filter_user_comments(text, users_to_filter, ctx.regex_policy, timeouts)
+    _note_regex_timeouts(state, emit, "clean", timeouts)
+    state.text = text
+    if ctx.dedup_fingerprinter is not None:
+        # Отпечатки для индекса дубликатов — здесь, в CPU‑стадии; сверка — в стадии dedup
+        _enter_stage(state, emit, "fingerprint")
+        state.dedup_fp = ctx.dedup_fingerprinter.fingerprint(text)
 
-        # Front matter
+
+def _stage_dedup(state: _DocState, ctx: _RunContext, emit: Callable[[Dict], None], checkpoint: Callable[[], None]) -> None:
+    # Почти‑дубликаты (simhash, MinHash) — до изображений и LLM, чтобы дубликат не стоил вызовов моделей
+    if ctx.dedup_index is None or state.dedup_fp is None:
+        return
+    _enter_stage(state, emit, "dedup")
+    checkpoint()
+    path = state.path
+    decision = ctx.dedup_index.check(state.dedup_fp, str(path), state.raw_hash)
+    if any((ctx.cfg.get(stage) or {}).get("enabled", False) for stage in ("images", "llm")):
+        # Дальше — изображения и LLM (секунды и минуты на документ): пачка фиксируется
+        # сейчас, чтобы запуск с тем же state_dir не ждал блокировку записи всё это время
+        ctx.dedup_index.flush()
+    state.dedup_group_id = decision.canonical_id
+    if not decision.is_duplicate:
+        return
+    state.duplicate_of = decision
+    state.counters["dedup_duplicates"] = state.counters.get("dedup_duplicates", 0) + 1
+    emit({
+        "event": "dedup",
+        "file": str(path),
+        "canonical_id": decision.canonical_id,
+        "canonical_path": decision.canonical_path,
+        "method": decision.method,
+        "distance": decision.distance,
+        "similarity": decision.similarity,
+        "policy": ctx.dedup_policy,
+    })
+    if ctx.dedup_policy not in ("drop", "link"):
+        # keep — обычная обработка с пометкой duplicate
+        return
+    out_file = None
+    outputs: List[str] = []
+    if ctx.dedup_policy == "link" and not ctx.dry_run:
+        # Вместо обработки — ссылка на результат канонического документа
+        out_file = ctx.output_dir / f"{path.stem}.md"
+        link_text = _duplicate_link_markdown(path, state.dedup_fp.key, state.checksum, decision, ctx.cfg)
+        write_markdown_file(out_file, link_text)
+        outputs.append(str(out_file))
+        state.perf.bytes_out += len(link_text.encode("utf-8"))
+    title = f"Дубликат: {Path(decision.canonical_path).name}" if decision.canonical_path else "Дубликат"
+    state.outcome = _FileOutcome(
+        FileResult(path, out_file, state.dedup_fp.key, title, True),
+        {}, {}, {}, outputs, state.fingerprint, state.counters,
+        perf=state.perf, short_circuit=True, duplicate_of=decision,
+    )
+
+
+def _duplicate_link_markdown(path: Path, doc_id: str, checksum: str, decision: DedupDecision, cfg: Dict) -> str:
+    """Markdown дубликата (dedup.policy: link, dedup.exact_output: link) — ссылка на результат канонического документа."""
+    target = f"{Path(decision.canonical_path).stem}.md" if decision.canonical_path else ""
+    if decision.method == "minhash":
+        how = f"MinHash, сходство {decision.similarity}"
+    elif decision.method == "bytes":
+        how = "побайтовая копия"
+    elif decision.method == "canonical":
+        how = "тот же текст после канонизации"
+    else:
+        how = f"simhash, расстояние {decision.distance} бит"
+    text = f"# Дубликат\n\nДокумент совпадает с [{target}]({target}) ({how}).\n"
+    if cfg.get("output", {}).get("front_matter", False):
         fm = FrontMatter(
             source="youtrack-export",
             document_id=doc_id,
-            title=title,
+            title="Дубликат",
             language="ru",
             has_pii=False,
             pii_rules_version=str(cfg["pii"].get("ruleset_version", "v1.0.0")),
             cleaning_profile=f"default@{datetime.utcnow().date().isoformat()}",
-            dedup_group_id=doc_id,
+            dedup_group_id=decision.canonical_id or "",
             source_path=str(path),
-            checksum=f"sha256:{sha256_of_text(raw)}",
-            llm_postprocess={
-                "enabled": bool(cfg.get("llm", {}).get("enabled")),
-                "backend": (cfg.get("llm", {}).get("priority") or "ollama"),
-            },
-            extra={},
+            checksum=checksum,
+            llm_postprocess={"enabled": False, "backend": None},
+            extra={"duplicate_of": decision.canonical_path},
         )
-        out_text = format_markdown(md)
-        if cfg.get("output", {}).get("front_matter", False):
-            out_text = render_front_matter(fm) + "\n" + out_text
+        text = render_front_matter(fm) + "\n" + text
+    return text
 
-        # Запись
-        if progress_cb:
-            progress_cb({"event": "stage", "file": str(path), "stage": "write"})
-        if not dry_run:
-            # Имя выходного файла формируем из имени исходника с расширением .md
-            out_file = output_dir / f"{path.stem}.md"
-            write_markdown_file(out_file, out_text)
-            # Дополнительно сохраняем вариант исходного текста с пояснениями к изображениям в *_srs.md
-            try:
-                srs_text = locals().get("text_with_image_explanations") or ""
-                if not srs_text:
-                    # Если по какой-то причине переменная отсутствует (например, модуль изображений отключён)
-                    # сохраняем текущий текст до преобразования в markdown как наилучшее приближение
-                    srs_text = text
-                out_file_srs = output_dir / f"{path.stem}_srs.md"
-                write_markdown_file(out_file_srs, srs_text)
-            except Exception as e:
-                if progress_cb:
-                    progress_cb({"event": "warn", "file": str(path), "stage": "write_srs", "message": str(e)})
-            # Запись отчёта по изображениям, если он был собран
-            try:
-                images_report = locals().get("_images_report_buffer")
-                if images_report:
-                    reports_dir = Path(cfg["io"].get("reports_dir", "reports"))
-                    (reports_dir / "images").mkdir(parents=True, exist_ok=True)
-                    (reports_dir / "images" / f"{doc_id}.json").write_text(__import__("json").dumps(images_report, ensure_ascii=False, indent=2), encoding="utf-8")
-                    if progress_cb:
-                        progress_cb({
-                            "event": "images",
-                            "file": str(path),
-                            "substage": "report_written",
-                            "report_path": str((reports_dir / "images" / f"{doc_id}.json").absolute()),
-                        })
-            except Exception as e:
-                if progress_cb:
-                    progress_cb({"event": "warn", "file": str(path), "stage": "write_images_report", "message": str(e)})
-        else:
-            out_file = None
-
-        # Отчёты
-        (reports_dir / "pii" / f"{doc_id}.json").write_text(
-            __import__("json").dumps({
-                "doc_id": doc_id,
-                "counts_pass1": pii_report1.counts,
-                "counts_pass2": pii_report2.counts,
-            }, ensure_ascii=False, indent=2),
-            encoding="utf-8",
+
+def _stage_images(state: _DocState, ctx: _RunContext, emit: Callable[[Dict], None], checkpoint: Callable[[], None]) -> None:
+    cfg = ctx.cfg
+    path = state.path
+    # Обогащение текстов пояснениями к изображениям
+    if not (cfg.get("images", {}) or {}).get("enabled", False):
+        return
+    _enter_stage(state, emit, "images")
+    checkpoint()
+    try:
+        # Версия с отчётом — для записи подробностей и визуализации в UI
+        emit({"event": "images", "file": str(path), "substage": "discover"})
+        text, images_report = enrich_text_with_image_explanations_report(state.text, path, cfg, cache=ctx.vision_cache)
+        for name in ("cache_hits", "cache_misses"):
+            if images_report.get(name):
+                state.counters[f"vision_{name}"] = state.counters.get(f"vision_{name}", 0) + images_report[name]
+        for call in images_report.get("calls") or []:
+            if "latency_ms" in call:
+                state.perf.add_call("vision", call["latency_ms"] / 1000.0, call.get("status") == "ok")
+        # Передадим основные факты: сколько изображений и вставок
+        emit({
+            "event": "images",
+            "file": str(path),
+            "substage": "result",
+            "images": len(images_report.get("images") or []),
+            "calls": len(images_report.get("calls") or []),
+            "insertions": len(images_report.get("insertions") or []),
+            "cache_hits": images_report.get("cache_hits", 0),
+        })
+        state.text = text
+        state.images_report = images_report
+        # Сохраняем вариант исходного текста с внедрёнными пояснениями к изображениям
+        state.text_with_image_explanations = text
+    except Exception as e:
+        emit({"event": "warn", "file": str(path), "stage": "images", "message": str(e)})
+
+
+def _stage_build(state: _DocState, ctx: _RunContext, emit: Callable[[Dict], None], checkpoint: Callable[[], None]) -> None:
+    cfg = ctx.cfg
+    path = state.path
+    # Имена (NER) — отдельной стадией, чтобы её время было видно в замерах
+    person_spans = None
+    if ctx.person_detector is not None:
+        _enter_stage(state, emit, "person_ner")
+        checkpoint()
+        person_spans = ctx.person_detector.find(state.text)
+    # Обезличивание (проход 1)
+    _enter_stage(state, emit, "anonymize_pass1")
+    checkpoint()
+    text, pii_report1 = anonymize_text(
+        state.text, ctx.pii_protector, ctx.pii_entities, ctx.secret_detector, person_spans, ctx.regex_policy
+    )
+    _note_regex_timeouts(state, emit, "anonymize_pass1", pii_report1.timeouts)
+    state.text = text
+    state.pii_counts1 = pii_report1.counts
+    state.pii_whitelisted = {k: v for k, v in pii_report1.whitelisted.items() if v}
+    _count_skipped(state.counters, "pass1", pii_report1.skipped)
+    # Извлечение метаданных на основе исходного текста
+    _enter_stage(state, emit, "extract_metadata")
+    meta = extract_metadata(text)
+
+    # Идентификатор документа
+    state.doc_id = sha256_of_text(text)
+
+    # Заголовок
+    state.title = _derive_title(text)
+    sections = cfg["template"].get("sections_ru", [])
+
+    # Базовый Markdown до LLM
+    _enter_stage(state, emit, "build_markdown")
+    body_by_section = {sec: "" for sec in sections}
+    body_by_section[sections[0] if sections else "Резюме"] = text
+    if "Метаданные" in sections:
+        body_by_section["Метаданные"] = metadata_section_ru(meta)
+    state.md = render_markdown(state.title, sections, body_by_section)
+    state.md_pass1 = state.md
+    state.pii_residual1_lines = _residual_lines(state.md, text, pii_report1.residual_at)
+
+
+def _count_skipped(counters: Dict[str, int], pass_name: str, skipped: List[str]) -> None:
+    """Счётчики префильтра PII: сколько раз правило не запускалось (pii_skip_<проход>_<правило>)."""
+    counters[f"pii_scans_{pass_name}"] = counters.get(f"pii_scans_{pass_name}", 0) + 1
+    for name in skipped:
+        key = f"pii_skip_{pass_name}_{name}"
+        counters[key] = counters.get(key, 0) + 1
+
+
+def _stage_llm(state: _DocState, ctx: _RunContext, emit: Callable[[Dict], None], checkpoint: Callable[[], None]) -> None:
+    cfg = ctx.cfg
+    # LLM постобработка
+    if not cfg.get("llm", {}).get("enabled"):
+        return
+    _enter_stage(state, emit, "llm")
+    checkpoint()
+    md_llm = postprocess_with_llm(state.md, ctx.system_prompt, ctx.user_prompt, cfg.get("llm", {}), cache=ctx.llm_cache, stats=state.counters, perf=state.perf)
+    if md_llm:
+        state.md = md_llm
+
+
+def _stage_finalize(state: _DocState, ctx: _RunContext, emit: Callable[[Dict], None], checkpoint: Callable[[], None]) -> None:
+    cfg = ctx.cfg
+    path = state.path
+    doc_id = state.doc_id
+    # Обезличивание (проход 2)
+    _enter_stage(state, emit, "anonymize_pass2")
+    checkpoint()
+    full = str(cfg["pii"].get("pass2_mode", "incremental")).lower() == "full" or state.md_pass1 is None
+    # Только фрагменты, которые LLM добавила или изменила
+    regions, line_map = ([], None) if full else diff_lines(state.md_pass1, state.md)
+    person_spans = None
+    if ctx.person_detector is not None and (full or regions):
+        _enter_stage(state, emit, "person_ner")
+        person_spans = ctx.person_detector.find(state.md) if full else ctx.person_detector.find_regions(state.md, regions)
+        _enter_stage(state, emit, "anonymize_pass2")
+    if full:
+        md, pii_report2 = anonymize_text(
+            state.md, ctx.pii_protector, ctx.pii_entities, ctx.secret_detector, person_spans, ctx.regex_policy
+        )
+        _note_regex_timeouts(state, emit, "anonymize_pass2", pii_report2.timeouts)
+        # Валидация на остаточную PII: независимый повторный поиск по всему документу
+        _enter_stage(state, emit, "validate")
+        names = ctx.person_detector.find(md) if ctx.person_detector is not None else None
+        timeouts: List[Dict] = []
+        residual = detect_residual_pii(md, ctx.pii_protector, ctx.secret_detector, names, ctx.regex_policy, timeouts)
+        _note_regex_timeouts(state, emit, "validate", timeouts)
+    else:
+        md, pii_report2 = anonymize_regions(
+            state.md, regions, ctx.pii_protector, ctx.pii_entities, ctx.secret_detector, person_spans, ctx.regex_policy
         )
-        # dedup отчёты отключены
-        if leakage:
-            with (reports_dir / "validation" / "residual_pii.jsonl").open("a", encoding="utf-8") as f:
-                f.write(__import__("json").dumps({"doc_id": doc_id, "residual": residual}, ensure_ascii=False) + "\n")
+        _note_regex_timeouts(state, emit, "anonymize_pass2", pii_report2.timeouts)
+        # Валидация — по результату маскирования: остаточная PII прохода 1 в строках, которые
+        # LLM не тронула и которые не пересканированы, плюс найденное проходом 2 в regions
+        _enter_stage(state, emit, "validate")
+        residual = carry_residual(state.pii_residual1_lines, line_map, state.md, regions)
+        for k, v in pii_report2.residual.items():
+            residual[k] = residual.get(k, 0) + v
+        if ctx.person_detector is not None:
+            # Ключ PERSON — как при полном поиске, даже если LLM ничего не изменила
+            residual.setdefault("PERSON", 0)
+    _count_skipped(state.counters, "pass2", pii_report2.skipped)
+    for k, v in pii_report2.whitelisted.items():
+        if v:
+            state.pii_whitelisted[k] = state.pii_whitelisted.get(k, 0) + v
 
-        processed += 1
-        results.append(FileResult(path, out_file, doc_id, title, False))
-        if progress_cb:
-            progress_cb({
-                "event": "file_end",
-                "file": str(path),
-                "duplicate": False,
-                "index": idx,
-                "total": total,
-                "output_path": str(out_file) if out_file else None,
-            })
-
-    return {"processed": processed, "results": [
-        {
-            "input_path": str(r.input_path),
-            "output_path": str(r.output_path) if r.output_path else None,
-            "doc_id": r.doc_id,
-            "title": r.title,
-            "duplicate": r.duplicate,
-        } for r in results
-    ]}
+    # Front matter
+    fm = FrontMatter(
+        source="youtrack-export",
+        document_id=doc_id,
+        title=state.title,
+        language="ru",
+        has_pii=False,
+        pii_rules_version=str(cfg["pii"].get("ruleset_version", "v1.0.0")),
+        cleaning_profile=f"default@{datetime.utcnow().date().isoformat()}",
+        dedup_group_id=state.dedup_group_id or doc_id,
+        source_path=str(path),
+        checksum=state.checksum,
+        llm_postprocess={
+            "enabled": bool(cfg.get("llm", {}).get("enabled")),
+            "backend": (cfg.get("llm", {}).get("priority") or "ollama"),
+        },
+        extra={},
+    )
+    state.perf.start("format")
+    out_text = format_markdown(md)
+    if cfg.get("output", {}).get("front_matter", False):
+        out_text = render_front_matter(fm) + "\n" + out_text
+
+    # Запись
+    _enter_stage(state, emit, "write")
+    outputs: List[str] = []
+    if not ctx.dry_run:
+        # Имя выходного файла формируем из имени исходника с расширением .md
+        out_file = ctx.output_dir / f"{path.stem}.md"
+        write_markdown_file(out_file, out_text)
+        outputs.append(str(out_file))
+        state.perf.bytes_out += len(out_text.encode("utf-8"))
+        # Дополнительно сохраняем вариант исходного текста с пояснениями к изображениям в *_srs.md
+        try:
+            srs_text = state.text_with_image_explanations
+            if not srs_text:
+                # Если по какой-то причине пояснений нет (например, модуль изображений отключён)
+                # сохраняем текущий текст до преобразования в markdown как наилучшее приближение
+                srs_text = state.text
+            out_file_srs = ctx.output_dir / f"{path.stem}_srs.md"
+            write_markdown_file(out_file_srs, srs_text)
+            outputs.append(str(out_file_srs))
+            state.perf.bytes_out += len(srs_text.encode("utf-8"))
+        except Exception as e:
+            emit({"event": "warn", "file": str(path), "stage": "write_srs", "message": str(e)})
+    else:
+        out_file = None
+
+    state.outcome = _FileOutcome(
+        FileResult(path, out_file, doc_id, state.title, state.duplicate_of is not None),
+        state.pii_counts1,
+        pii_report2.counts,
+        residual,
+        outputs,
+        state.fingerprint,
+        state.counters,
+        state.images_report,
+        state.perf,
+        state.pii_whitelisted,
+        state.regex_timeouts,
+        duplicate_of=state.duplicate_of,
+        pii_prefilter=_doc_prefilter(state.counters),
+    )
+
+
+_STAGE_FUNCS: Dict[str, Callable[[_DocState, _RunContext, Callable[[Dict], None], Callable[[], None]], None]] = {
+    "prepare": _stage_prepare,
+    "dedup": _stage_dedup,
+    "images": _stage_images,
+    "build": _stage_build,
+    "llm": _stage_llm,
+    "finalize": _stage_finalize,
+}
 
 
 def _derive_title(text: str) -> str:
-    for line in text.splitlines():
+    span = _title_span(text)
+    return text[span[0]:span[1]] if span else "Инцидент YouTrack"
+
+
+def _title_span(text: str) -> Optional[Tuple[int, int]]:
+    """Откуда в тексте взят заголовок: первая строка не короче 10 символов, до 120 символов."""
+    pos = 0
+    for line in text.splitlines(keepends=True):
         s = line.strip()
         if len(s) >= 10:
-            return s[:120]
-    return "Инцидент YouTrack"
+            start = pos + len(line) - len(line.lstrip())
+            return start, start + min(len(s), 120)
+        pos += len(line)
+    return None
+
+
+def _residual_lines(md: str, text: str, residual_at: List[Tuple[int, int, str]]) -> List[Tuple[int, str]]:
+    """Остаточная PII текста (смещения в text) → строки Markdown, куда текст вошёл телом
+    первой секции (после strip) и, для фрагментов заголовка, строкой «# заголовок»."""
+    if not residual_at:
+        return []
+    body = text.strip()
+    lead = len(text) - len(text.lstrip())
+    # тело ищется после строки заголовка: заголовок — тоже фрагмент текста
+    at = md.find(body, md.find("\n") + 1) if body else -1
+    title = _title_span(text)
+    lines: List[Tuple[int, str]] = []
+    if title is not None:
+        lines.extend((0, key) for start, end, key in residual_at if title[0] <= start and end <= title[1])
+    if at >= 0:
+        numbers = line_numbers(md, [at + start - lead for start, _, _ in residual_at])
+        lines.extend((n, key) for n, (_, _, key) in zip(numbers, residual_at))
+    return lines
 
 
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import time
+
+import regex
+
+
+# Бюджет по умолчанию на одно применение шаблона к документу
+DEFAULT_TIMEOUT_SEC = 2.0
+ON_TIMEOUT = ("skip", "fail")
+
+
+class RegexTimeoutError(RuntimeError):
+    """Шаблон не уложился в бюджет при regex.on_timeout: fail — файл завершается ошибкой."""
+
+    def __init__(self, name: str, timeout_sec: float):
+        super().__init__(f"регулярное выражение {name} не уложилось в {timeout_sec} с")
+        self.name = name
+        self.timeout_sec = timeout_sec
+
+
+class RegexPolicy:
+    """Выполнение регулярных выражений модулем regex с бюджетом времени (секция regex конфига).
+
+    Бюджет задаётся на шаблон по имени (`cleaning.remove_templates[0]`, `pii.PHONE`, ...),
+    иначе действует timeout_sec. on_timeout: skip — шаблон пропускается, документ идёт
+    дальше; fail — RegexTimeoutError. Каждый таймаут записывается в переданный список.
+    """
+
+    def __init__(self, timeout_sec: Optional[float] = DEFAULT_TIMEOUT_SEC, timeouts: Optional[Dict[str, float]] = None, on_timeout: str = "skip"):
+        self.timeout_sec = timeout_sec
+        self.timeouts = dict(timeouts or {})
+        self.on_timeout = on_timeout if on_timeout in ON_TIMEOUT else "skip"
+
+    @classmethod
+    def from_config(cls, cfg: Dict) -> "RegexPolicy":
+        rcfg = cfg.get("regex") or {}
+        return cls(
+            timeout_sec=rcfg.get("timeout_sec", DEFAULT_TIMEOUT_SEC),
+            timeouts={str(k): float(v) for k, v in (rcfg.get("timeouts") or {}).items()},
+            on_timeout=str(rcfg.get("on_timeout", "skip")).lower(),
+        )
+
+    def timeout_for(self, name: str) -> Optional[float]:
+        return self.timeouts.get(name, self.timeout_sec)
+
+    def sub(
+        self,
+        name: str,
+        pattern: Union[str, "regex.Pattern"],
+        repl: Union[str, Callable],
+        text: str,
+        timeouts: Optional[List[Dict]] = None,
+    ) -> str:
+        """pattern.sub с бюджетом; при таймауте (skip) текст возвращается без изменений."""
+        compiled = compile_pattern(pattern) if isinstance(pattern, str) else pattern
+        timeout = self.timeout_for(name)
+        try:
+            return compiled.sub(repl, text, timeout=timeout)
+        except TimeoutError:
+            self.timed_out(name, timeouts)
+            return text
+
+    def timed_out(self, name: str, timeouts: Optional[List[Dict]], **details) -> None:
+        """Учёт таймаута: запись в список и, при on_timeout: fail, исключение."""
+        if timeouts is not None:
+            timeouts.append({"pattern": name, "timeout_sec": self.timeout_for(name), **details})
+        if self.on_timeout == "fail":
+            raise RegexTimeoutError(name, self.timeout_for(name))
+
+
+@lru_cache(maxsize=512)
+def compile_pattern(pattern: str, flags: int = 0) -> "regex.Pattern":
+    return regex.compile(pattern, flags)
+
+
+# --- Предварительная проверка шаблонов ----------------------------------------
+
+# Группа с квантификатором внутри, за которой снова квантификатор: (a+)+, (\w+\s?)*, (.*a){12}
+_NESTED_QUANTIFIER_RE = regex.compile(r"\((?:[^()\\]|\\.)*(?:[+*]|\{\d+,\d*\})[^()]*\)(?:[+*]|\{(?:[2-9]|\d{2,})(?:,\d*)?\})")
+# Заполнители для проб: на однородной строке и «почти совпадении» видно сверхлинейный рост
+_PROBE_FILLERS = ("a", " ", "\n", "1", "-", "a ", "1 ", ".", "\t", "x\n")
+_PROBE_SIZES = (1_000, 4_000)
+# Рост времени при увеличении входа в 4 раза: линейный ~4x, квадратичный ~16x
+_SUPERLINEAR_RATIO = 8.0
+_MIN_SIGNIFICANT_SEC = 0.02
+
+
+@lru_cache(maxsize=256)
+def check_pattern(pattern: str, budget_sec: float = 0.5) -> Optional[Dict]:
+    """Проверка одного шаблона: None — проблем не найдено, иначе описание проблемы.
+
+    Сначала компиляция и статическая эвристика (вложенные квантификаторы), затем пробы
+    на синтетических входах двух размеров под тем же движком и с бюджетом времени.
+    """
+    try:
+        compiled = regex.compile(pattern)
+    except regex.error as e:
+        return {"pattern": pattern, "problem": "invalid", "detail": str(e)}
+    nested = _NESTED_QUANTIFIER_RE.search(pattern)
+    prefix = _literal_prefix(pattern)
+    probes = [(filler, False) for filler in _PROBE_FILLERS]
+    if prefix:
+        # повтор «литерал + заполнитель»: много почти‑совпадений подряд
+        probes += [(filler, True) for filler in _PROBE_FILLERS]
+    for filler, repeated in probes:
+        timings: List[float] = []
+        for size in _PROBE_SIZES:
+            if repeated:
+                probe = (prefix + filler) * (size // (len(prefix) + len(filler))) + "\0"
+            else:
+                probe = prefix + filler * (size // len(filler)) + "\0"
+            t0 = time.perf_counter()
+            try:
+                compiled.search(probe, timeout=budget_sec)
+            except TimeoutError:
+                return {"pattern": pattern, "problem": "timeout", "detail": f"проба {filler!r}x{size} дольше {budget_sec} с"}
+            timings.append(time.perf_counter() - t0)
+        small, large = timings
+        if large >= _MIN_SIGNIFICANT_SEC and large / max(small, 1e-6) >= _SUPERLINEAR_RATIO:
+            return {
+                "pattern": pattern,
+                "problem": "superlinear",
+                "detail": f"проба {filler!r}: {small * 1000:.1f} мс → {large * 1000:.1f} мс при росте входа в 4 раза",
+            }
+    if nested:
+        return {"pattern": pattern, "problem": "nested_quantifier", "detail": f"вложенный квантификатор: {nested.group(0)}"}
+    return None
+
+
+def preflight(patterns: Dict[str, str]) -> List[Dict]:
+    """Проверка набора шаблонов (имя → шаблон); список найденных проблем с именами."""
+    findings: List[Dict] = []
+    for name, pattern in patterns.items():
+        found = check_pattern(pattern)
+        if found is not None:
+            findings.append({"name": name, **found})
+    return findings
+
+
+def _literal_prefix(pattern: str) -> str:
+    """Начальный литерал шаблона (без флагов и экранирования) — чтобы проба дошла до
+    «тяжёлой» части, а не отсеялась на первом символе."""
+    body = regex.sub(r"^(?:\(\?[a-zA-Z]+\)|\(\?:|\^)+", "", pattern)
+    out: List[str] = []
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch == "\\" and i + 1 < len(body) and not body[i + 1].isalnum():
+            out.append(body[i + 1])
+            i += 2
+            continue
+        if ch in ".^$*+?{}[]()|\\":
+            break
+        out.append(ch)
+        i += 1
+    # за литералом может идти квантификатор, относящийся к последнему символу
+    if i < len(body) and body[i] in "*+?{" and out:
+        out.pop()
+    return "".join(out)
+
+
+def split_lines(text: str, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Границы строк text[start:end] (без перевода строки) — для построчного повтора после таймаута."""
+    end = len(text) if end is None else end
+    bounds: List[Tuple[int, int]] = []
+    pos = start
+    while pos < end:
+        nl = text.find("\n", pos, end)
+        stop = end if nl < 0 else nl
+        bounds.append((pos, stop))
+        pos = stop + 1
+    return bounds
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+
+import numpy as np
+
+
+# Кандидаты в секреты: длинные токены из алфавита base64/base64url/hex. Первые min_length
+# символов задаются отдельным повтором — так движок re быстрее отбрасывает короткие слова
+TOKEN_RE = r"[A-Za-z0-9+/=_\-]{%d}[A-Za-z0-9+/=_\-]*"
+# JWT: три сегмента base64url через точку (алфавит токенов точку не включает, поэтому имена
+# хостов и классов распадаются на короткие части, а JWT ищется отдельно)
+JWT_RE = re.compile(r"(?<![A-Za-z0-9_\-])eyJ[A-Za-z0-9_\-]{8,}\.eyJ[A-Za-z0-9_\-]{8,}\.[A-Za-z0-9_\-]*")
+
+# Алфавит кандидатов и его коды 0..len-1 (частоты считаются в матрице токены x алфавит)
+_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=_-"
+_CODE = np.zeros(128, dtype=np.int64)
+_CODE[[ord(c) for c in _ALPHABET]] = np.arange(len(_ALPHABET))
+_NON_HEX = np.array([c not in "0123456789abcdefABCDEF" for c in _ALPHABET])
+_DIGITS = np.array([c.isdigit() for c in _ALPHABET])
+
+# Сколько кандидатов считать за один шаг: матрица частот batch x len(_ALPHABET)
+_BATCH = 4096
+
+
+class EntropySecretDetector:
+    """Поиск секретов по энтропии Шеннона (secrets.detect_secrets).
+
+    Кандидаты — токены base64/hex длиной от min_length и JWT. Энтропия считается
+    сразу для всех кандидатов документа (numpy, матрица частот символов), порог —
+    entropy_limit для base64 и hex_entropy_limit для hex (алфавит из 16 символов не
+    даёт больше 4 бит на символ). Токен без цифр не считается секретом (имена классов,
+    слова). JWT — секрет всегда. Совпадения с allowlist_patterns пропускаются.
+    """
+
+    def __init__(
+        self,
+        entropy_limit: float = 4.5,
+        hex_entropy_limit: float = 3.0,
+        min_length: int = 20,
+        allowlist_patterns: Optional[Iterable[str]] = None,
+    ):
+        self.entropy_limit = float(entropy_limit)
+        self.hex_entropy_limit = float(hex_entropy_limit)
+        self.min_length = int(min_length)
+        self.token_re = re.compile(TOKEN_RE % self.min_length)
+        patterns = [p for p in (allowlist_patterns or []) if p]
+        self.allowlist_re: Optional[re.Pattern] = (
+            re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+        )
+
+    @classmethod
+    def from_config(cls, cfg: Dict) -> Optional["EntropySecretDetector"]:
+        """secrets.detect_secrets → детектор; None, если он выключен."""
+        ds = ((cfg.get("secrets") or {}).get("detect_secrets") or {})
+        if not ds.get("enabled", False):
+            return None
+        return cls(
+            entropy_limit=ds.get("entropy_limit", 4.5),
+            hex_entropy_limit=ds.get("hex_entropy_limit", 3.0),
+            min_length=ds.get("min_length", 20),
+            allowlist_patterns=[str(p) for p in (ds.get("allowlist_patterns") or [])],
+        )
+
+    def find(self, text: str) -> List[Tuple[int, int]]:
+        """Интервалы секретов в тексте, по возрастанию начала."""
+        found: List[Tuple[int, int]] = []
+        jwt: List[Tuple[int, int]] = [m.span() for m in JWT_RE.finditer(text)] if "eyJ" in text else []
+        spans: List[Tuple[int, int]] = []
+        tokens: List[str] = []
+        for m in self.token_re.finditer(text):
+            spans.append(m.span())
+            tokens.append(m.group(0))
+        if tokens:
+            found = [span for span, ok in zip(spans, self._secret_mask(tokens)) if ok]
+        if jwt:
+            # сегменты JWT поглощаются целым токеном
+            found = _merge_spans(found + jwt)
+        if self.allowlist_re is not None:
+            found = [(s, e) for s, e in found if not self.allowlist_re.search(text[s:e])]
+        return found
+
+    def _secret_mask(self, tokens: List[str]) -> np.ndarray:
+        """Для каждого токена: превышает ли энтропия порог своего алфавита и есть ли в нём цифры."""
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+        data = _CODE[np.frombuffer("".join(tokens).encode("ascii"), dtype=np.uint8)]
+        ends = np.cumsum(lengths)
+        # c·log2(c) для всех возможных частот символа в токене
+        c = np.arange(int(lengths.max()) + 1, dtype=np.float64)
+        clogc = np.zeros_like(c)
+        clogc[1:] = c[1:] * np.log2(c[1:])
+        out = np.zeros(len(tokens), dtype=bool)
+        width = len(_ALPHABET)
+        for lo in range(0, len(tokens), _BATCH):
+            hi = min(lo + _BATCH, len(tokens))
+            n = lengths[lo:hi]
+            owner = np.repeat(np.arange(hi - lo), n)
+            counts = np.bincount(owner * width + data[ends[lo] - n[0]:ends[hi - 1]], minlength=(hi - lo) * width)
+            counts = counts.reshape(hi - lo, width)
+            # H = log2(L) - Σ c·log2(c) / L
+            entropy = np.log2(n) - clogc[counts].sum(axis=1) / n
+            is_hex = ~counts[:, _NON_HEX].any(axis=1)
+            limit = np.where(is_hex, self.hex_entropy_limit, self.entropy_limit)
+            out[lo:hi] = (entropy > limit) & counts[:, _DIGITS].any(axis=1)
+        return out
+
+
+def _merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start < merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+import ipaddress
+import re
+
+
+# Значение похоже на телефон: сравниваем по цифрам, без учёта пробелов, скобок и дефисов
+_PHONE_LIKE_RE = re.compile(r"\+?[\d\s().\-]+")
+_NON_DIGIT_RE = re.compile(r"\D")
+_IPV4_RE = re.compile(r"\d{1,3}(?:\.\d{1,3}){3}")
+# Минимум цифр, чтобы значение сравнивалось как телефон (короче — IP, версии, коды)
+_PHONE_MIN_DIGITS = 7
+
+
+class _Trie:
+    """Префиксное дерево на словарях: есть ли среди сохранённых префиксов префикс строки."""
+
+    _END = ""
+
+    def __init__(self):
+        self.root: Dict = {}
+        self.size = 0
+
+    def add(self, key: str) -> None:
+        node = self.root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        if self._END not in node:
+            node[self._END] = True
+            self.size += 1
+
+    def has_prefix_of(self, value: str) -> bool:
+        node = self.root
+        if self._END in node:
+            return True
+        for ch in value:
+            node = node.get(ch)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+
+class PiiWhitelist:
+    """Значения, которые не маскируются (pii.whitelists, pii.whitelist_files).
+
+    Форматы записей:
+    - точное значение (`support@company.org`, `+7 800 555-35-35`) — множество, O(1) на проверку;
+      регистр не учитывается, телефоны сравниваются по цифрам;
+    - префикс со звёздочкой (`+7 800*`, `noreply-*`) — префиксное дерево, O(длины значения);
+    - сеть IPv4 в нотации CIDR (`10.0.0.0/8`) — дерево по битам адреса, не больше 32 шагов.
+
+    Проверяется найденное правилом значение (для LOGIN и пароля — само значение, без маркера).
+    """
+
+    def __init__(self, entries: Iterable[str]):
+        self.exact: set = set()
+        self.exact_digits: set = set()
+        self.prefixes = _Trie()
+        self.digit_prefixes = _Trie()
+        self.networks = _Trie()
+        for raw in entries:
+            self.add(str(raw))
+
+    @classmethod
+    def from_config(cls, pii_cfg: Dict) -> Optional["PiiWhitelist"]:
+        """Записи из pii.whitelists и файлов pii.whitelist_files (по записи в строке, # — комментарий)."""
+        entries: List[str] = [str(v) for v in (pii_cfg.get("whitelists") or [])]
+        for path in pii_cfg.get("whitelist_files") or []:
+            with Path(path).open("r", encoding="utf-8") as f:
+                entries.extend(line for line in (ln.strip() for ln in f) if line and not line.startswith("#"))
+        whitelist = cls(entries)
+        return whitelist if len(whitelist) else None
+
+    def add(self, entry: str) -> None:
+        value = entry.strip()
+        if not value:
+            return
+        if "/" in value and _IPV4_RE.match(value):
+            try:
+                net = ipaddress.IPv4Network(value, strict=False)
+            except ValueError:
+                pass
+            else:
+                self.networks.add(_bits(int(net.network_address))[: net.prefixlen])
+                return
+        if value.endswith("*"):
+            prefix = value[:-1]
+            if not prefix.strip():
+                # «*» целиком отключил бы маскирование — не принимаем
+                return
+            self.prefixes.add(prefix.casefold())
+            if _PHONE_LIKE_RE.fullmatch(prefix):
+                digits = _NON_DIGIT_RE.sub("", prefix)
+                if digits:
+                    self.digit_prefixes.add(digits)
+            return
+        self.exact.add(value.casefold())
+        if _PHONE_LIKE_RE.fullmatch(value):
+            digits = _NON_DIGIT_RE.sub("", value)
+            if len(digits) >= _PHONE_MIN_DIGITS:
+                self.exact_digits.add(digits)
+
+    def __len__(self) -> int:
+        return len(self.exact) + self.prefixes.size + self.networks.size
+
+    def allows(self, value: str) -> bool:
+        """True — значение в белом списке и маскировать его не нужно."""
+        key = value.casefold()
+        if key in self.exact:
+            return True
+        if self.prefixes and self.prefixes.has_prefix_of(key):
+            return True
+        if (self.exact_digits or self.digit_prefixes) and _PHONE_LIKE_RE.fullmatch(value):
+            digits = _NON_DIGIT_RE.sub("", value)
+            if len(digits) >= _PHONE_MIN_DIGITS and (
+                digits in self.exact_digits or self.digit_prefixes.has_prefix_of(digits)
+            ):
+                return True
+        if self.networks and _IPV4_RE.fullmatch(value):
+            try:
+                address = int(ipaddress.IPv4Address(value))
+            except ValueError:
+                return False
+            return self.networks.has_prefix_of(_bits(address))
+        return False
+
+
+def _bits(address: int) -> str:
+    return format(address, "032b")
@@ -0,0 +1,207 @@
+"""Индекс дубликатов: simhash_batch против эталона, поиск по блокам и полосам против перебора, перенос documents."""
+
+from pathlib import Path
+import json
+import random
+import sqlite3
+
+import numpy as np
+import pytest
+
+from src.pipeline.config import load_pipeline_config
+from src.pipeline.dedup import (
+    MAX_N_GRAMS, SIMHASH_HASHES, DedupFingerprint, DedupIndex, Fingerprinter, MinHashBands, SimhashBands,
+    canonicalize, hamming_distance, shingle_hashes, simhash_batch, simhash_reference,
+)
+
+
+WORDS = (
+    "оплата заказ ошибка сервер клиент кэш шлюз таймаут повтор стенд релиз payment order error cache retry"
+).split()
+
+
+def _texts():
+    rng = random.Random(7)
+    yield ""
+    yield "   \n\t "
+    yield "один"
+    yield "Ёжик в тумане — ёлка, ЁЛКА; ǅ ß ﬁ 🙂"
+    yield "a  b c d"
+    # длинные токены дохэшируются поштучно (base64, хэши)
+    yield " ".join(["x" * 200, "y" * 65, "z" * 64, "короткий"] + ["ab"] * 100)
+    for n in (10, 300, 5000):
+        yield " ".join(rng.choice(WORDS) + str(rng.randrange(50)) for _ in range(n))
+    # ничья голосов: по два токена с разными битами
+    yield "aa bb"
+
+
+@pytest.mark.parametrize("token_hash", SIMHASH_HASHES)
+def test_simhash_batch_matches_reference(token_hash):
+    texts = list(_texts())
+    expected = [simhash_reference(t, token_hash) for t in texts]
+    assert simhash_batch(texts, token_hash) == expected
+    # по одному тексту — то же, что пачкой
+    assert [simhash_batch([t], token_hash)[0] for t in texts] == expected
+
+
+def test_simhash_batch_rejects_unknown_hash():
+    with pytest.raises(ValueError):
+        simhash_batch(["текст"], "sha1")
+
+
+def _flip(value, bits, rng):
+    for i in rng.sample(range(64), bits):
+        value ^= 1 << i
+    return value
+
+
+@pytest.mark.parametrize("threshold", [0, 1, 3, 4, 6])
+def test_simhash_bands_share_key_within_threshold(threshold):
+    bands = SimhashBands(threshold)
+    rng = random.Random(threshold)
+    for _ in range(300):
+        a = rng.getrandbits(64)
+        b = _flip(a, rng.randint(0, threshold), rng)
+        assert set(bands.keys(a)) & set(bands.keys(b))
+
+
+@pytest.mark.parametrize("threshold", [2, 4])
+def test_banded_lookup_matches_brute_force(threshold):
+    rng = random.Random(100 + threshold)
+    index = DedupIndex(None, threshold_bits=threshold)
+    stored = []
+    centers = [rng.getrandbits(64) for _ in range(40)]
+    for i in range(400):
+        # документы вокруг общих центров — много отпечатков на расстоянии около порога
+        value = _flip(rng.choice(centers), rng.randint(0, threshold + 3), rng)
+        index.add(f"doc{i}", value, f"/in/{i}.txt")
+        stored.append((i + 1, f"/in/{i}.txt", value))
+    for _ in range(300):
+        query = _flip(rng.choice(centers), rng.randint(0, threshold + 3), rng)
+        close = [(hamming_distance(query, v), doc, path) for doc, path, v in stored if hamming_distance(query, v) <= threshold]
+        found = index.find(query)
+        if not close:
+            assert found is None
+            continue
+        dist, _, path = min(close)
+        assert (found.distance, found.canonical_path, found.method) == (dist, path, "simhash")
+    index.close()
+
+
+def _document(rng, n=400):
+    return " ".join(rng.choice(WORDS) + str(rng.randrange(1000)) for _ in range(n))
+
+
+def _edit(text, rng, changes):
+    tokens = text.split()
+    for _ in range(changes):
+        tokens[rng.randrange(len(tokens))] = "правка" + str(rng.randrange(10 ** 6))
+    return " ".join(tokens)
+
+
+def test_minhash_bands_keys():
+    bands = MinHashBands(0.9, 128)
+    assert bands.b * bands.r <= 128
+    signature = Fingerprinter(num_perm=128).signature(canonicalize(_document(random.Random(1))))
+    keys = bands.keys(signature)
+    assert len(keys) == bands.b == len(set(keys))
+    assert keys == bands.keys(signature.copy())
+    # одна полоса изменилась — изменился ровно её ключ
+    changed = signature.copy()
+    changed[0] ^= 1
+    assert [k1 != k2 for k1, k2 in zip(keys, bands.keys(changed))] == [True] + [False] * (bands.b - 1)
+
+
+def test_minhash_lookup_matches_brute_force():
+    rng = random.Random(3)
+    fingerprinter = Fingerprinter(num_perm=128)
+    index = DedupIndex(None, threshold_bits=0, jaccard_threshold=0.8, fingerprinter=fingerprinter)
+    base = [_document(rng) for _ in range(30)]
+    stored = []
+    for i, text in enumerate(base):
+        signature = fingerprinter.signature(canonicalize(text))
+        # simhash, далёкий от всех: поиск идёт только по MinHash
+        index.add(f"doc{i}", rng.getrandbits(64), f"/in/{i}.txt", signature)
+        stored.append((i + 1, f"/in/{i}.txt", signature))
+    hits = 0
+    for i, text in enumerate(base):
+        # 0 — копия, 2 правки — почти наверняка общая полоса, 150 — несходный текст
+        for changes in (0, 2, 150):
+            signature = fingerprinter.signature(canonicalize(_edit(text, rng, changes)))
+            found = index.find_minhash(signature)
+            similar = [
+                (-float(np.mean(sig == signature)), doc, path) for doc, path, sig in stored
+                if float(np.mean(sig == signature)) >= 0.8
+            ]
+            if changes == 150:
+                assert found is None
+                continue
+            best = min(similar)
+            assert (found.canonical_path, found.similarity, found.method) == (best[2], round(-best[0], 4), "minhash")
+            hits += 1
+    assert hits == 60
+    index.close()
+
+
+@pytest.mark.parametrize("n_grams", [0, MAX_N_GRAMS + 1, 10])
+def test_n_grams_out_of_range_rejected(n_grams, tmp_path):
+    with pytest.raises(ValueError):
+        shingle_hashes("раз два три", n_grams)
+    with pytest.raises(ValueError):
+        Fingerprinter(n_grams=n_grams)
+    config = Path("config/pipeline.yaml").read_text(encoding="utf-8").replace("n_grams: 5", f"n_grams: {n_grams}")
+    (tmp_path / "pipeline.yaml").write_text(config, encoding="utf-8")
+    with pytest.raises(ValueError, match="n_grams"):
+        load_pipeline_config(tmp_path / "pipeline.yaml")
+
+
+def test_longest_shingle_uses_all_words():
+    words = " ".join(f"w{i}" for i in range(20))
+    # шингл из 8 слов: на 20 разных слов — 13 шинглов; текст короче — один шингл
+    assert len(shingle_hashes(words, MAX_N_GRAMS)) == 20 - MAX_N_GRAMS + 1
+    assert len(shingle_hashes("раз два", MAX_N_GRAMS)) == 1
+
+
+def test_legacy_documents_migration(tmp_path):
+    con = sqlite3.connect(tmp_path / "fingerprints.sqlite")
+    # simhash без типа: значения хранятся так, как их записали прежние версии
+    con.execute("CREATE TABLE documents (doc_id TEXT PRIMARY KEY, simhash, path TEXT)")
+    big = (1 << 64) - 12345
+    con.executemany(
+        "INSERT INTO documents(doc_id, simhash, path) VALUES(?, ?, ?)",
+        [
+            ("int", 123456789, None),
+            ("text", str(big), ""),
+            # от 2^63 SQLite сохраняет REAL: младшие биты потеряны
+            ("real", float(big), ""),
+            ("null", None, ""),
+        ],
+    )
+    assert [r[0] for r in con.execute("SELECT typeof(simhash) FROM documents ORDER BY rowid")] == ["integer", "text", "real", "null"]
+    con.commit()
+    con.close()
+
+    index = DedupIndex(tmp_path, threshold_bits=3)
+    con = index._con
+    assert con.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents'").fetchone() is None
+    assert json.loads(index._layout("legacy_documents")) == {"migrated": 2, "skipped_lossy": 2}
+    # прежние отпечатки посчитаны по md5 — база остаётся на нём
+    assert index._layout("simhash_hash") == "md5"
+    assert index.fingerprinter.simhash_hash == "md5"
+    assert sorted(con.execute("SELECT doc_id, path FROM simhashes")) == [("int", None), ("text", None)]
+
+    # Перенесённая строка без файла: первый документ в пределах порога занимает её
+    fp = DedupFingerprint("new", _flip(big, 2, random.Random(0)))
+    assert not index.check(fp, "/in/a.txt").is_duplicate
+    assert len(index) == 2
+    again = index.check(DedupFingerprint("copy", big), "/in/b.txt")
+    assert (again.is_duplicate, again.canonical_path) == (True, "/in/a.txt")
+    # найденная по переносу строка всё ещё ищется по ключам блоков
+    assert index.find(123456789) is None
+    assert index._find_legacy(123456789) is not None
+    index.close()
+
+    # Повторное открытие — переноса больше нет, строки на месте
+    reopened = DedupIndex(tmp_path, threshold_bits=3)
+    assert len(reopened) == 2
+    reopened.close()
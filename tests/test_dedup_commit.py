@@ -0,0 +1,89 @@
+"""Фиксация пачек индекса дубликатов: блокировка записи и согласованность с манифестом."""
+
+from pathlib import Path
+import copy
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from src.pipeline.config import load_pipeline_config
+from src.pipeline.dedup import DedupIndex
+from src.pipeline.run import _DocState, _RunContext, _stage_dedup
+
+
+TEXT = "Не проходит оплата заказа после обновления приложения, ошибка на шаге подтверждения.\n"
+
+
+@pytest.fixture
+def cfg():
+    cfg = load_pipeline_config(Path("config/pipeline.yaml"))
+    cfg["images"]["enabled"] = False
+    cfg["llm"]["enabled"] = False
+    return cfg
+
+
+def _write_lock_free(db: Path) -> bool:
+    con = sqlite3.connect(db, timeout=0)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        con.rollback()
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        con.close()
+
+
+@pytest.mark.parametrize("llm, released", [(True, True), (False, False)])
+def test_dedup_stage_releases_write_lock_before_llm(cfg, tmp_path, llm, released):
+    cfg = copy.deepcopy(cfg)
+    cfg["llm"]["enabled"] = llm
+    ctx = _RunContext(tmp_path / "out", cfg, True, "", "")
+    ctx.dedup_index = DedupIndex.from_config(tmp_path, cfg["dedup"])
+    state = _DocState(Path("ticket.txt"), 1, None)
+    state.dedup_fp = ctx.dedup_index.fingerprinter.fingerprint(TEXT)
+    noop = lambda *_: None  # noqa: E731
+    _stage_dedup(state, ctx, noop, noop)
+    # С LLM пачка фиксируется сразу после решения; без медленных стадий — копится дальше
+    assert _write_lock_free(tmp_path / "fingerprints.sqlite") is released
+    ctx.dedup_index.close()
+    assert _write_lock_free(tmp_path / "fingerprints.sqlite")
+
+
+CRASH_SCRIPT = """
+import os, sys
+from pathlib import Path
+from src.pipeline import run
+from src.pipeline.config import load_pipeline_config
+
+tmp = Path(sys.argv[1])
+cfg = load_pipeline_config(Path("config/pipeline.yaml"))
+cfg["images"]["enabled"] = False
+cfg["llm"]["enabled"] = False
+cfg["io"].update({"state_dir": str(tmp / "state"), "reports_dir": str(tmp / "reports")})
+manifest_cls = run.ProcessingManifest
+# Манифест фиксируется каждые 3 файла — задолго до пачки индекса (200 документов или 5 с)
+run.ProcessingManifest = lambda state_dir, **kw: manifest_cls(state_dir, commit_every=3, **kw)
+for i, _ in enumerate(run.iter_process(tmp / "in", tmp / "out", cfg)):
+    if i == 7:
+        # Сбой посреди пачки: без закрытия хранилищ
+        os._exit(1)
+"""
+
+
+def test_crash_mid_batch_keeps_manifest_and_index_consistent(tmp_path):
+    (tmp_path / "in").mkdir()
+    for i in range(12):
+        text = f"Тикет {i}: " + " ".join(f"слово{i * 100 + j}" for j in range(40)) + "\n"
+        (tmp_path / "in" / f"{i:02d}.txt").write_text(text, encoding="utf-8")
+    proc = subprocess.run([sys.executable, "-c", CRASH_SCRIPT, str(tmp_path)], cwd=Path.cwd())
+    assert proc.returncode == 1
+    with sqlite3.connect(tmp_path / "state" / "manifest.sqlite") as con:
+        recorded = {Path(row[0]).name for row in con.execute("SELECT input_path FROM files")}
+    with sqlite3.connect(tmp_path / "state" / "fingerprints.sqlite") as con:
+        indexed = {Path(row[0]).name for row in con.execute("SELECT path FROM simhashes")}
+    assert recorded == {f"{i:02d}.txt" for i in range(6)}
+    # Каждый файл из манифеста есть в индексе: повторный запуск его пропустит, но дубликаты найдёт
+    assert recorded <= indexed
@@ -0,0 +1,80 @@
+"""Решения индекса дубликатов в параллельном режиме — в порядке входных файлов, как при последовательном."""
+
+from pathlib import Path
+import copy
+import multiprocessing
+import time
+
+import pytest
+
+from src.pipeline import run
+from src.pipeline.config import load_pipeline_config
+from src.pipeline.run import process_directory
+
+
+TEXT = (
+    "Не проходит оплата заказа после обновления приложения до последней версии.\n"
+    "Клиент повторил попытку трижды, каждый раз ошибка на шаге подтверждения.\n"
+    "Воспроизвели на стенде: проблема в кэше платёжного шлюза, после сброса всё работает.\n"
+)
+
+FILES = {
+    "a.txt": TEXT,
+    # тот же текст после канонизации — отличаются только пробелы
+    "b.txt": TEXT.replace(" ", "  "),
+    # побайтовая копия a.txt
+    "c.txt": TEXT,
+    # побайтовая копия b.txt: b — дубликат и в индекс не попадает
+    "d.txt": TEXT.replace(" ", "  "),
+}
+
+
+def _slow_prepare(prepare):
+    def stage(state, ctx, emit, checkpoint):
+        # Первый документ группы заканчивает подготовку последним
+        if state.path.name == "a.txt":
+            time.sleep(0.5)
+        prepare(state, ctx, emit, checkpoint)
+    return stage
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("подмена стадии наследуется процессами пула только при fork")
+    monkeypatch.setitem(run._STAGE_FUNCS, "prepare", _slow_prepare(run._STAGE_FUNCS["prepare"]))
+    (tmp_path / "in").mkdir()
+    for name, text in FILES.items():
+        (tmp_path / "in" / name).write_text(text, encoding="utf-8")
+    cfg = load_pipeline_config(Path("config/pipeline.yaml"))
+    cfg["images"]["enabled"] = False
+    cfg["llm"]["enabled"] = False
+    return tmp_path, cfg
+
+
+def _run(corpus, name, policy, exact_output, **kwargs):
+    tmp_path, cfg = corpus
+    cfg = copy.deepcopy(cfg)
+    cfg["dedup"].update({"policy": policy, "exact_output": exact_output})
+    cfg["io"].update({"state_dir": str(tmp_path / name / "state"), "reports_dir": str(tmp_path / name / "reports")})
+    out = tmp_path / name / "out"
+    events = []
+    stats = process_directory(tmp_path / "in", out, cfg, progress_cb=events.append, **kwargs)
+    results = [
+        (Path(r["input_path"]).name, Path(r["output_path"]).name if r["output_path"] else None, r["duplicate"])
+        for r in stats["results"]
+    ]
+    dedup = [(Path(e["file"]).name, Path(e["canonical_path"]).name, e["method"]) for e in events if e.get("event") == "dedup"]
+    outputs = {p.name: p.read_text(encoding="utf-8") for p in sorted(out.iterdir())}
+    return results, dedup, outputs
+
+
+@pytest.mark.parametrize("policy, exact_output", [("drop", "link"), ("link", "copy"), ("link", "off")])
+def test_late_canonical_matches_sequential(corpus, policy, exact_output):
+    sequential = _run(corpus, "seq", policy, exact_output, workers=1, io_pipeline=False)
+    results, dedup, _ = sequential
+    # каноническим остаётся первый по порядку входных файлов
+    assert results[0] == ("a.txt", "a.md", False)
+    assert all(canonical == "a.txt" for _, canonical, _ in dedup)
+    assert _run(corpus, "workers", policy, exact_output, workers=2, io_pipeline=False) == sequential
+    assert _run(corpus, "pipeline", policy, exact_output, workers=2, io_pipeline=True) == sequential
@@ -0,0 +1,55 @@
+"""fix_text: ftfy только для подозрительных сегментов — результат тот же, что у ftfy.fix_text."""
+
+import ftfy
+import pytest
+
+from src.pipeline.io_utils import _FTFY_SUSPECT_RE, fix_text, read_text_file
+
+
+PHRASES = [
+    "привет ёжик",
+    "Шура и Маша ищут ошибки",
+    "Шишкин: ошибка при оплате заказа № 42 — «таймаут»",
+    "ШЁЛК и ёлки",
+]
+
+
+def _mojibake(text):
+    # UTF-8, прочитанный как cp1251
+    return text.encode("utf-8").decode("cp1251")
+
+
+@pytest.mark.parametrize("phrase", PHRASES)
+def test_cp1251_mojibake_is_repaired(phrase):
+    broken = _mojibake(phrase)
+    assert broken != phrase
+    assert fix_text(broken) == phrase == ftfy.fix_text(broken)
+
+
+def test_mojibake_pairs_within_russian_alphabet_are_suspect():
+    # «и» → «Рё», «Ш» → «РЁ»: оба символа — из русского алфавита
+    assert _mojibake("и") == "Рё" and _mojibake("Ш") == "РЁ"
+    assert _FTFY_SUSPECT_RE.search("текст Рё текст")
+    assert _FTFY_SUSPECT_RE.search("РЁ")
+    assert _FTFY_SUSPECT_RE.search("Обычный русский текст про Россию и ёлки, Ёж.") is None
+
+
+def test_matches_ftfy_on_mixed_text():
+    lines = [
+        "Обычная строка без исправлений.",
+        _mojibake("Сломанная строка: ошибка и таймаут"),
+        "cafÃ© &amp; <b>html</b>",
+        "РёРЁ — пары без остальной строки",
+        "",
+        "x" * 100 + _mojibake("и") * 3,
+    ]
+    text = "\n".join(lines) + "\n"
+    assert fix_text(text) == ftfy.fix_text(text)
+    clean = "Тикет SUP-1: оплата не проходит.\nЁлка, ёж, съезд.\n"
+    assert fix_text(clean) == clean == ftfy.fix_text(clean)
+
+
+def test_read_text_file_repairs_mojibake(tmp_path):
+    path = tmp_path / "ticket.txt"
+    path.write_text(_mojibake("Шура пишет: привет ёжик") + "\r\n", encoding="utf-8")
+    assert read_text_file(path) == "Шура пишет: привет ёжик\n"
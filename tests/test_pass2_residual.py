@@ -0,0 +1,84 @@
+"""Остаточная PII прохода 2 в режиме incremental против полного повторного поиска (pass2_mode: full)."""
+
+from pathlib import Path
+import copy
+
+import pytest
+
+from src.pipeline.config import load_pipeline_config
+from src.pipeline.run import _DocState, _RunContext, _stage_build, _stage_finalize
+
+
+TEXT = (
+    "Не проходит оплата заказа после обновления\n"
+    "Клиент пишет с адреса ivan.petrov@example.com, телефон +7 912 345-67-89.\n"
+    "Ответ отправлен на support-team@company.org.\n"
+    "Повторно воспроизвели на стенде, адрес qa.lead@corp.local в копии.\n"
+    "Итог: проблема в кэше.\n"
+)
+
+
+def _drop_line(md: str) -> str:
+    return "".join(line for line in md.splitlines(keepends=True) if "support-team@" not in line)
+
+
+def _rewrite_line(md: str) -> str:
+    return md.replace("Ответ отправлен на support-team@company.org.", "Ответ отправлен, копия — new.owner@example.com.")
+
+
+def _append_line(md: str) -> str:
+    return md + "\nДобавлено LLM: пишите admin@example.com\n"
+
+
+def _unchanged(md: str) -> str:
+    return md
+
+
+@pytest.fixture(scope="module")
+def base_cfg():
+    cfg = load_pipeline_config(Path("config/pipeline.yaml"))
+    # EMAIL не маскируется — адреса остаются в тексте остаточной PII
+    cfg["pii"]["entities"] = ["PHONE", "IP", "MAC", "LOGIN", "SECRET"]
+    cfg["images"]["enabled"] = False
+    cfg["llm"]["enabled"] = False
+    return cfg
+
+
+def _retitle(md: str) -> str:
+    return md.replace("# ", "# Тикет: ", 1)
+
+
+def _residual(cfg, mode, llm_edit, text=TEXT):
+    cfg = copy.deepcopy(cfg)
+    cfg["pii"]["pass2_mode"] = mode
+    ctx = _RunContext(Path("/nonexistent"), cfg, True, "", "")
+    state = _DocState(Path("ticket.txt"), 1, None)
+    state.text = text
+    noop = lambda *_: None  # noqa: E731
+    _stage_build(state, ctx, noop, noop)
+    state.md = llm_edit(state.md)
+    _stage_finalize(state, ctx, noop, noop)
+    return state.outcome.residual
+
+
+@pytest.mark.parametrize("llm_edit", [_drop_line, _rewrite_line, _append_line, _unchanged])
+def test_incremental_residual_matches_full_rescan(base_cfg, llm_edit):
+    incremental = _residual(base_cfg, "incremental", llm_edit)
+    full = _residual(base_cfg, "full", llm_edit)
+    assert {k: v for k, v in incremental.items() if v} == {k: v for k, v in full.items() if v}
+
+
+@pytest.mark.parametrize("llm_edit", [_drop_line, _retitle, _unchanged])
+def test_title_residual_matches_full_rescan(base_cfg, llm_edit):
+    # Заголовок берётся из первой строки текста: адрес в ней есть и в «# заголовок», и в теле
+    text = "  Письмо от boss@example.com про оплату заказа\n" + TEXT
+    incremental = _residual(base_cfg, "incremental", llm_edit, text)
+    full = _residual(base_cfg, "full", llm_edit, text)
+    assert incremental == full
+
+
+def test_deleted_line_is_not_counted(base_cfg):
+    before = _residual(base_cfg, "incremental", _unchanged)
+    after = _residual(base_cfg, "incremental", _drop_line)
+    assert before["EMAIL"] == 3
+    assert after["EMAIL"] == 2
@@ -0,0 +1,104 @@
+"""Имена (PERSON): маскирование и остаточная PII с подменённой моделью NER natasha."""
+
+from pathlib import Path
+import copy
+import re
+import sys
+import types
+
+import pytest
+
+from src.pipeline import person
+from src.pipeline.anonymize import anonymize_text, detect_residual_pii
+from src.pipeline.config import load_pipeline_config
+from src.pipeline.person import PersonDetector
+from src.pipeline.run import _DocState, _RunContext, _stage_build, _stage_finalize
+
+
+NAMES_RE = re.compile(r"Иван Петров|Мария Сидорова")
+
+TEXT = (
+    "Не проходит оплата заказа после обновления\n"
+    "Клиент Иван Петров пишет, что оплата зависает.\n"
+    "Ответила Мария Сидорова, повторно воспроизвели на стенде.\n"
+    "Итог: проблема в кэше.\n"
+)
+
+
+class _Tagger:
+    """Вместо NewsNERTagger: имена из NAMES_RE в разметке slovnet (spans с start, stop, type)."""
+
+    def __call__(self, text):
+        spans = [types.SimpleNamespace(start=m.start(), stop=m.end(), type="PER") for m in NAMES_RE.finditer(text)]
+        return types.SimpleNamespace(spans=spans)
+
+
+def _sentenize(text):
+    # предложение — вся строка
+    yield types.SimpleNamespace(start=0, stop=len(text), text=text)
+
+
+@pytest.fixture
+def stub_natasha(monkeypatch):
+    monkeypatch.setitem(sys.modules, "razdel", types.SimpleNamespace(sentenize=_sentenize))
+    monkeypatch.setattr(person, "_TAGGER", _Tagger())
+
+
+@pytest.fixture(scope="module")
+def base_cfg():
+    cfg = load_pipeline_config(Path("config/pipeline.yaml"))
+    cfg["images"]["enabled"] = False
+    cfg["llm"]["enabled"] = False
+    return cfg
+
+
+def _run(cfg, detector, mode="incremental", entities=None, llm_edit=lambda md: md):
+    cfg = copy.deepcopy(cfg)
+    cfg["pii"]["pass2_mode"] = mode
+    if entities is not None:
+        cfg["pii"]["entities"] = entities
+    ctx = _RunContext(Path("/nonexistent"), cfg, True, "", "")
+    ctx.person_detector = detector
+    state = _DocState(Path("ticket.txt"), 1, None)
+    state.text = TEXT
+    noop = lambda *_: None  # noqa: E731
+    _stage_build(state, ctx, noop, noop)
+    md_pass1 = state.md
+    state.md = llm_edit(state.md)
+    _stage_finalize(state, ctx, noop, noop)
+    outcome = state.outcome
+    return md_pass1, outcome.pii_counts1, outcome.pii_counts2, outcome.residual
+
+
+def _append_name(md):
+    return md + "\nДобавлено LLM: звонил Иван Петров\n"
+
+
+@pytest.mark.parametrize("mode", ["incremental", "full"])
+@pytest.mark.parametrize("llm_edit, added", [(lambda md: md, 0), (_append_name, 1)])
+def test_names_masked(stub_natasha, base_cfg, mode, llm_edit, added):
+    md, counts1, counts2, residual = _run(base_cfg, PersonDetector(), mode, llm_edit=llm_edit)
+    assert NAMES_RE.search(md) is None
+    assert md.count("<PERSON>") == 2
+    assert counts1["PERSON"] == 2
+    # имя, добавленное LLM, маскирует проход 2
+    assert counts2["PERSON"] == added
+    assert residual["PERSON"] == 0
+
+
+@pytest.mark.parametrize("llm_edit", [lambda md: md, _append_name])
+def test_unmasked_names_are_residual(stub_natasha, base_cfg, llm_edit):
+    entities = ["EMAIL", "PHONE", "IP", "MAC", "LOGIN", "SECRET"]
+    md, counts1, _, incremental = _run(base_cfg, PersonDetector(), "incremental", entities, llm_edit)
+    _, _, _, full = _run(base_cfg, PersonDetector(), "full", entities, llm_edit)
+    assert counts1["PERSON"] == 0
+    assert incremental["PERSON"] == full["PERSON"] == len(NAMES_RE.findall(llm_edit(md)))
+
+
+@pytest.mark.parametrize("mode", ["incremental", "full"])
+def test_no_person_key_without_detector(base_cfg, mode):
+    md, _, _, residual = _run(base_cfg, None, mode)
+    assert "Иван Петров" in md
+    assert "PERSON" not in residual
+    assert "PERSON" not in anonymize_text(TEXT)[1].residual
+    assert "PERSON" not in detect_residual_pii(TEXT)
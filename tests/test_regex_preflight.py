@@ -0,0 +1,47 @@
+"""Предпроверка шаблонов конфига в iter_process: regex.preflight warn и off."""
+
+from pathlib import Path
+import copy
+
+import pytest
+
+from src.pipeline.config import load_pipeline_config
+from src.pipeline.run import process_directory
+
+
+# Вложенный квантификатор — предпроверка находит его всегда
+DANGEROUS = r"(a+)+$"
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    cfg = load_pipeline_config(Path("config/pipeline.yaml"))
+    cfg["io"].update({"state_dir": str(tmp_path / "state"), "reports_dir": str(tmp_path / "reports")})
+    cfg["images"]["enabled"] = False
+    cfg["llm"]["enabled"] = False
+    cfg["dedup"]["enabled"] = False
+    cfg["cleaning"]["remove_templates"] = [DANGEROUS]
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.txt").write_text("Текст тикета про оплату заказа.\n", encoding="utf-8")
+    return cfg
+
+
+def _run(cfg, tmp_path, mode):
+    cfg = copy.deepcopy(cfg)
+    cfg["regex"]["preflight"] = mode
+    events = []
+    stats = process_directory(tmp_path / "in", tmp_path / "out", cfg, dry_run=True, progress_cb=events.append)
+    warned = [e for e in events if e.get("event") == "warn" and e.get("stage") == "regex_preflight"]
+    return stats, warned
+
+
+def test_preflight_warns(cfg, tmp_path):
+    stats, warned = _run(cfg, tmp_path, "warn")
+    assert [f["name"] for f in stats["regex_preflight"]] == ["cleaning.remove_templates[0]"]
+    assert len(warned) == 1
+
+
+def test_preflight_off_skips_check(cfg, tmp_path):
+    stats, warned = _run(cfg, tmp_path, "off")
+    assert stats["regex_preflight"] == []
+    assert warned == []
@@ -0,0 +1,65 @@
+"""Отчёт документа: пропуски префильтра PII в reports.sqlite и в прежней раскладке файлов."""
+
+from pathlib import Path
+import json
+import sqlite3
+
+from src.pipeline.config import load_pipeline_config
+from src.pipeline.reports import LegacyReportWriter, ReportStore
+from src.pipeline.run import process_directory
+
+
+PREFILTER = {"pass1": ["MAC", "URL_CRED"], "pass2": ["EMAIL", "MAC", "URL_CRED"]}
+
+
+def test_prefilter_round_trip_and_legacy_export(tmp_path):
+    store = ReportStore(tmp_path / "reports")
+    store.add_document("run", "doc1", "in/a.txt", "out/a.md", {"EMAIL": 1}, {}, {"EMAIL": 0}, prefilter=PREFILTER)
+    store.flush()
+    assert store.get("doc1")["prefilter"] == PREFILTER
+    store.export_legacy(tmp_path / "legacy")
+    store.close()
+    exported = json.loads((tmp_path / "legacy" / "pii" / "doc1.json").read_text(encoding="utf-8"))
+    assert exported["prefilter"] == PREFILTER
+
+
+def test_legacy_writer_records_prefilter(tmp_path):
+    writer = LegacyReportWriter(tmp_path)
+    writer.add_document("run", "doc1", "in/a.txt", None, {}, {}, {}, prefilter=PREFILTER)
+    written = json.loads((tmp_path / "pii" / "doc1.json").read_text(encoding="utf-8"))
+    assert written["prefilter"] == PREFILTER
+
+
+def test_old_database_gets_prefilter_column(tmp_path):
+    db = tmp_path / "reports.sqlite"
+    con = sqlite3.connect(db)
+    con.execute(
+        "CREATE TABLE documents (doc_id TEXT PRIMARY KEY, run_id TEXT, source_path TEXT, output_path TEXT,"
+        " counts_pass1 TEXT, counts_pass2 TEXT, residual TEXT, leakage INTEGER NOT NULL DEFAULT 0,"
+        " images_report TEXT, updated_at TEXT)"
+    )
+    con.execute("INSERT INTO documents(doc_id, counts_pass1) VALUES('old', '{}')")
+    con.commit()
+    con.close()
+    store = ReportStore(tmp_path)
+    assert store.get("old")["prefilter"] == {}
+    store.close()
+
+
+def test_pipeline_writes_prefilter_per_document(tmp_path):
+    cfg = load_pipeline_config(Path("config/pipeline.yaml"))
+    cfg["io"].update({"state_dir": str(tmp_path / "state"), "reports_dir": str(tmp_path / "reports")})
+    cfg["images"]["enabled"] = False
+    cfg["llm"]["enabled"] = False
+    cfg["dedup"]["enabled"] = False
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "plain.txt").write_text("Обычный текст тикета без персональных данных.\n", encoding="utf-8")
+    (tmp_path / "in" / "mail.txt").write_text("Пишите на ivan@example.com по поводу заказа.\n", encoding="utf-8")
+    process_directory(tmp_path / "in", tmp_path / "out", cfg)
+    store = ReportStore(tmp_path / "reports")
+    docs = {Path(d["source_path"]).name: d["prefilter"] for d in store.iter_documents()}
+    store.close()
+    assert "EMAIL" in docs["plain.txt"]["pass1"]
+    assert "EMAIL" not in docs["mail.txt"]["pass1"]
+    assert "URL_CRED" in docs["mail.txt"]["pass1"]
+    assert set(docs["plain.txt"]) == {"pass1", "pass2"}
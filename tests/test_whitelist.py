@@ -0,0 +1,67 @@
+"""Белый список PII: точные значения, префиксы, телефоны по цифрам и сети IPv4."""
+
+from src.pipeline.whitelist import PiiWhitelist
+
+
+def test_exact_values_ignore_case():
+    wl = PiiWhitelist(["Support@Company.org"])
+    assert wl.allows("support@company.org")
+    assert wl.allows("SUPPORT@COMPANY.ORG")
+    assert not wl.allows("support@company.org.evil")
+
+
+def test_exact_phone_matches_by_digits():
+    wl = PiiWhitelist(["+7 800 555-35-35"])
+    assert wl.allows("+7 (800) 555 35 35")
+    assert wl.allows("78005553535")
+    assert not wl.allows("+7 800 555-35-36")
+
+
+def test_short_numbers_are_not_compared_as_phones():
+    wl = PiiWhitelist(["12-34"])
+    assert wl.allows("12-34")
+    assert not wl.allows("1234")
+
+
+def test_prefix_entries():
+    wl = PiiWhitelist(["noreply-*", "svc_*"])
+    assert wl.allows("noreply-billing@company.org")
+    assert wl.allows("NoReply-x")
+    assert wl.allows("svc_backup")
+    assert not wl.allows("reply-noreply-x")
+
+
+def test_phone_prefix_matches_by_digits():
+    wl = PiiWhitelist(["+7 800*"])
+    assert wl.allows("+7 (800) 123-45-67")
+    assert wl.allows("7800 000 00 00")
+    assert not wl.allows("+7 912 345-67-89")
+
+
+def test_cidr_networks():
+    wl = PiiWhitelist(["10.0.0.0/8", "192.168.1.0/24", "172.16.5.4/32"])
+    assert wl.allows("10.255.0.1")
+    assert wl.allows("192.168.1.200")
+    assert wl.allows("172.16.5.4")
+    assert not wl.allows("192.168.2.1")
+    assert not wl.allows("172.16.5.5")
+    assert not wl.allows("11.0.0.1")
+    # не адрес — сети не проверяются
+    assert not wl.allows("10.0.0.1.5")
+
+
+def test_bare_star_and_blank_entries_are_rejected():
+    wl = PiiWhitelist(["*", "  ", " *"])
+    assert len(wl) == 0
+    assert not wl.allows("anything")
+
+
+def test_from_config_reads_files_and_skips_comments(tmp_path):
+    path = tmp_path / "wl.txt"
+    path.write_text("# служебные адреса\nalerts@company.org\n\n10.0.0.0/8\n", encoding="utf-8")
+    wl = PiiWhitelist.from_config({"whitelists": ["+7 800*"], "whitelist_files": [str(path)]})
+    assert wl.allows("alerts@company.org")
+    assert wl.allows("10.1.1.1")
+    assert wl.allows("+7 800 100-00-00")
+    assert not wl.allows("# служебные адреса")
+    assert PiiWhitelist.from_config({}) is None